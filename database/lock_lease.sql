@@ -0,0 +1,11 @@
+-- Add lease expiry times to the lock table (see agdc.lock_manager).
+--
+-- Locks with a null lock_expiry never expire. Run this once against an
+-- existing database before using a version of the datacube with leased
+-- locks; database/agdc_empty_db.backup already has the column and index.
+-- Without the column, locks are not leased (see agdc.lock_manager).
+
+alter table lock add column lock_expiry timestamp with time zone;
+
+create index lock_expiry_idx on lock (lock_expiry)
+  where lock_expiry is not null;
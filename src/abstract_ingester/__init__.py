@@ -32,16 +32,23 @@
 """
 
 import os
+import sys
 import logging
 import argparse
 from datetime import datetime
 import json
+import threading
+import Queue
+import multiprocessing
+import multiprocessing.util
 from abc import ABCMeta, abstractmethod
 import psycopg2
 
 from agdc import DataCube
 from agdc.cube_util import DatasetError, DatasetSkipError, parse_date_from_string
+from agdc.cube_util import set_directory_size_kb, take_directory_size_kb
 from collection import Collection
+from ingest_journal import IngestJournal
 from abstract_dataset import AbstractDataset
 from abstract_bandstack import AbstractBandstack
 #from cube_util import synchronize
@@ -54,6 +61,27 @@ from abstract_bandstack import AbstractBandstack
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# Outcomes of ingest_individual_dataset, used to summarise an ingest run.
+#
+
+DATASET_COMPLETE = 'complete'
+DATASET_SKIPPED = 'skipped'
+DATASET_FAILED = 'failed'
+
+#
+# Pipelined ingest (see AbstractIngester.ingest_pipelined).
+#
+
+PIPELINE_QUEUE_SIZE = 2  # Max. datasets waiting between pipeline stages.
+PIPELINE_POLL = 1.0  # Seconds between checks for a pipeline shutdown.
+
+#
+# Ingester instance used by a worker process (see AbstractIngester.ingest).
+#
+
+_WORKER_INGESTER = None
+
 #
 # Classes
 #
@@ -126,6 +154,10 @@ class AbstractIngester(object):
         else:
             self.collection = collection
 
+        # Serialises use of the database connection by the stages of
+        # a pipelined ingest (see ingest_pipelined).
+        self.db_lock = threading.RLock()
+
     #
     # parse_args method for command line arguments. This should be
     # overridden if extra arguments, beyond those defined below,
@@ -169,9 +201,56 @@ class AbstractIngester(object):
         _arg_parser.add_argument('--synctype', dest='sync_type',
                                  default=None, help=sync_type_help)
 
+        AbstractIngester.add_ingest_arguments(_arg_parser)
+
         args, dummy_unknown_args = _arg_parser.parse_known_args()
         return args
 
+    @staticmethod
+    def add_ingest_arguments(arg_parser, journal=True):
+        """Add the command line arguments controlling how datasets are
+        ingested, which are shared by all ingesters, to arg_parser.
+
+        This is called by parse_args here and in the subclasses. The
+        --journal argument is left out if journal is False, for
+        ingesters whose datasets are not ingested from the paths found
+        (so cannot be journaled against them).
+        """
+
+        workers_help = 'Number of worker processes used to ingest datasets'\
+            ' in parallel (default 1, i.e. serial ingestion).'
+        arg_parser.add_argument('--workers', dest='workers',
+                                default=1, type=int, help=workers_help)
+
+        if journal:
+            journal_help = 'Ingest journal file. Datasets recorded in'\
+                ' the journal as complete or skipped are not ingested'\
+                ' again unless they have changed.'
+            arg_parser.add_argument('--journal', dest='journal',
+                                    default=None, help=journal_help)
+
+        catalog_batch_help = 'Number of datasets to catalog together in a'\
+            ' single transaction (default 1).'
+        arg_parser.add_argument('--catalogbatch', dest='catalog_batch',
+                                default=1, type=int, help=catalog_batch_help)
+
+        catalog_only_help = 'Catalog the datasets without tiling them.'
+        arg_parser.add_argument('--catalogonly', dest='catalog_only',
+                                default=False, action='store_const',
+                                const=True, help=catalog_only_help)
+
+        pipeline_help = 'Overlap the opening, tiling and mosaicking of'\
+            ' successive datasets.'
+        arg_parser.add_argument('--pipeline', dest='pipeline',
+                                default=False, action='store_const',
+                                const=True, help=pipeline_help)
+
+        defer_mosaic_help = 'Leave new tiles pending instead of mosaicking'\
+            ' them. The mosaics are made later by build_mosaics.'
+        arg_parser.add_argument('--defermosaic', dest='defer_mosaic',
+                                default=False, action='store_const',
+                                const=True, help=defer_mosaic_help)
+
     #
     # Top level algorithm
     #
@@ -186,44 +265,248 @@ class AbstractIngester(object):
         """
         start_datetime = datetime.now()
         
-        dataset_list = self.find_datasets(source_dir)
+        workers = self.get_worker_count()
+        batch_size = self.get_catalog_batch_size()
+        self.check_ingest_mode(workers, batch_size)
 
-        dataset_list = self.preprocess_dataset(dataset_list)
+        dataset_list = self.iter_datasets(source_dir)
 
-        for dataset_path in dataset_list:
-            self.ingest_individual_dataset(dataset_path)
+        journal = self.open_journal()
+        try:
+            if journal is not None:
+                dataset_list = journal.filter_done(dataset_list)
+
+            dataset_list = self.preprocess_dataset(dataset_list)
+
+            if workers > 1:
+                self.ingest_parallel(dataset_list, workers, journal,
+                                     batch_size)
+            elif self.is_pipelined():
+                self.ingest_pipelined(dataset_list, journal)
+            elif batch_size > 1:
+                for batch in _make_batches(dataset_list, batch_size):
+                    for dataset_path, outcome in \
+                            self.ingest_dataset_batch(batch):
+                        if journal is not None:
+                            journal.record(dataset_path, outcome)
+            else:
+                for dataset_path in dataset_list:
+                    outcome = self.ingest_individual_dataset(dataset_path)
+                    if journal is not None:
+                        journal.record(dataset_path, outcome)
+        finally:
+            if journal is not None:
+                journal.close()
 
         self.log_ingestion_process_complete(source_dir, datetime.now() - start_datetime)
 
+    def ingest_parallel(self, dataset_list, workers, journal=None,
+                        batch_size=1):
+        """Ingest the datasets in 'dataset_list' using a pool of workers.
+
+        Each worker process is a fork of this one which replaces the
+        inherited datacube and collection with its own (see
+        start_worker), so each has a separate database connection,
+        lock owner id and temporary tile directory. The parent only
+        hands out dataset paths (in batches for ingest_dataset_batch if
+        batch_size is greater than one) and tallies the outcomes,
+        recording them in the journal if there is one.
+        """
+
+        outcome_count = {DATASET_COMPLETE: 0,
+                         DATASET_SKIPPED: 0,
+                         DATASET_FAILED: 0}
+
+        LOGGER.info('Ingesting datasets using %d worker processes',
+                    workers)
+
+        # dataset_list may be a generator, which the pool iterates in a
+        # separate thread. An exception there would stop the pool
+        # silently, so it is caught and re-raised here.
+        feed_error_list = []
+
+        # The workers are forked before any dataset is found, so sizes
+        # already measured here (by the journal) are sent with the tasks.
+        task_list = ((dataset_path, take_directory_size_kb(dataset_path))
+                     for dataset_path in dataset_list)
+
+        if batch_size > 1:
+            ingest_function = _ingest_batch_in_worker
+            task_list = _make_batches(task_list, batch_size)
+        else:
+            ingest_function = _ingest_in_worker
+
+        pool = multiprocessing.Pool(workers,
+                                    initializer=_start_worker,
+                                    initargs=(self,))
+        try:
+            for result_list in pool.imap_unordered(
+                    ingest_function,
+                    _guard_iterable(task_list, feed_error_list)):
+                for dataset_path, outcome in result_list:
+                    outcome_count[outcome] += 1
+                    if journal is not None:
+                        journal.record(dataset_path, outcome)
+            if feed_error_list:
+                exc_type, exc_value, exc_traceback = feed_error_list[0]
+                raise exc_type, exc_value, exc_traceback
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        self.log_ingestion_summary(outcome_count)
+        return outcome_count
+
+    def ingest_pipelined(self, dataset_list, journal=None):
+        """Ingest the datasets in 'dataset_list' as a pipeline.
+
+        Each dataset passes through three stages, connected by bounded
+        queues and run in separate threads (see IngestPipeline), so
+        that the next dataset is opened while this one is warped, and
+        the previous one is stored and mosaiced in the background.
+        Outcomes are classified and logged as for
+        ingest_individual_dataset, and recorded in the journal if there
+        is one.
+        """
+
+        outcome_count = IngestPipeline(self, journal).run(dataset_list)
+
+        self.log_ingestion_summary(outcome_count)
+        return outcome_count
+
+    def start_worker(self):
+        """Set up this (forked) ingester as a worker process.
+
+        The parent's database connection must not be used, or closed,
+        by the worker, so a reference to the parent's datacube is kept
+        and a new datacube (with its own connection) is created. The
+        process id is made unique so that the worker owns its own locks
+        and temporary tile directory, which is removed when the worker
+        exits.
+        """
+
+        self.parent_datacube = self.datacube
+
+        self.datacube = IngesterDataCube(self.args)
+        self.datacube.process_id = '%s-%d' % (self.datacube.process_id,
+                                              os.getpid())
+
+        self.collection = Collection(self.datacube)
+        multiprocessing.util.Finalize(self.collection,
+                                      self.collection.cleanup,
+                                      exitpriority=10)
+
     def ingest_individual_dataset(self, dataset_path):
         """Ingests a single dataset at 'dataset_path' into the collection.
 
         If this process raises a DatasetError, the dataset is skipped,
-        but the process continues.
+        but the process continues. Returns one of DATASET_COMPLETE,
+        DATASET_SKIPPED or DATASET_FAILED.
         """
 
         start_datetime = datetime.now()
         try:
-            dataset = self.open_dataset(dataset_path)
-
-            self.collection.check_metadata(dataset)
-
-            self.filter_on_metadata(dataset)
+            dataset = self.open_and_check_dataset(dataset_path)
 
             dataset_record = self.catalog(dataset)
 
-            self.tile(dataset_record, dataset)
+            if not self.is_catalog_only():
+                self.tile(dataset_record, dataset)
 
-            self.mosaic(dataset_record)
+                self.mosaic(dataset_record)
 
         except DatasetError as err:
             self.log_dataset_fail(dataset_path, err, datetime.now() - start_datetime)
+            return DATASET_FAILED
 
         except DatasetSkipError as err:
             self.log_dataset_skip(dataset_path, err, datetime.now() - start_datetime)
+            return DATASET_SKIPPED
 
         else:
             self.log_dataset_ingest_complete(dataset_path, datetime.now() - start_datetime)
+            return DATASET_COMPLETE
+
+    def ingest_dataset_batch(self, dataset_path_list):
+        """Ingests a batch of datasets, cataloging them together.
+
+        Each dataset is opened and filtered, then the remaining datasets
+        are cataloged in a single transaction (see catalog_batch), then
+        each is tiled and mosaiced in turn. As for
+        ingest_individual_dataset a DatasetError or DatasetSkipError
+        affects only the dataset that raised it. Returns a list of
+        (dataset_path, outcome) tuples.
+        """
+
+        outcome_list = []
+        opened_list = []
+        for dataset_path in dataset_path_list:
+            start_datetime = datetime.now()
+            try:
+                dataset = self.open_and_check_dataset(dataset_path)
+
+            except DatasetError as err:
+                self.log_dataset_fail(dataset_path, err, datetime.now() - start_datetime)
+                outcome_list.append((dataset_path, DATASET_FAILED))
+
+            except DatasetSkipError as err:
+                self.log_dataset_skip(dataset_path, err, datetime.now() - start_datetime)
+                outcome_list.append((dataset_path, DATASET_SKIPPED))
+
+            else:
+                opened_list.append((dataset_path, dataset, start_datetime))
+
+        if not opened_list:
+            return outcome_list
+
+        try:
+            catalog_result_list = self.catalog_batch(
+                [dataset for (_, dataset, _) in opened_list])
+        except DatasetError as err:
+            catalog_result_list = [err] * len(opened_list)
+
+        for ((dataset_path, dataset, start_datetime),
+             catalog_result) in zip(opened_list, catalog_result_list):
+            try:
+                if isinstance(catalog_result, Exception):
+                    raise catalog_result
+
+                dataset_record = catalog_result
+                self.update_catalog(dataset_record)
+
+                if not self.is_catalog_only():
+                    self.tile(dataset_record, dataset)
+
+                    self.mosaic(dataset_record)
+
+            except DatasetError as err:
+                self.log_dataset_fail(dataset_path, err, datetime.now() - start_datetime)
+                outcome_list.append((dataset_path, DATASET_FAILED))
+
+            except DatasetSkipError as err:
+                self.log_dataset_skip(dataset_path, err, datetime.now() - start_datetime)
+                outcome_list.append((dataset_path, DATASET_SKIPPED))
+
+            else:
+                self.log_dataset_ingest_complete(dataset_path, datetime.now() - start_datetime)
+                outcome_list.append((dataset_path, DATASET_COMPLETE))
+
+        return outcome_list
+
+    def open_and_check_dataset(self, dataset_path):
+        """Open the dataset at 'dataset_path', check its metadata against
+        the collection and filter it, returning the dataset object."""
+
+        dataset = self.open_dataset(dataset_path)
+
+        self.collection.check_metadata(dataset)
+
+        self.filter_on_metadata(dataset)
+
+        return dataset
 
     def filter_on_metadata(self, dataset):
         """Raises a DatasetError unless the dataset passes the filter."""
@@ -246,7 +529,7 @@ class AbstractIngester(object):
         tries = 0
         while tries < self.CATALOG_MAX_TRIES:
             try:
-                with self.collection.transaction():
+                with self.db_lock, self.collection.transaction():
                     acquisition_record = \
                         self.collection.create_acquisition_record(dataset)
                     dataset_record = \
@@ -258,20 +541,67 @@ class AbstractIngester(object):
             raise DatasetError('Unable to catalog: ' +
                                'persistent integrity error.')
 
+        self.update_catalog(dataset_record)
+
+        return dataset_record
+
+    def catalog_batch(self, dataset_list):
+        """Catalog a batch of datasets into the collection together.
+
+        The acquisition and dataset records for the whole batch are
+        found or created in a single transaction, using multi-row
+        queries (see Collection.catalog_datasets). Returns a list of
+        dataset records, or the DatasetError or DatasetSkipError for
+        datasets which could not be cataloged, in the same order as
+        dataset_list. Updating the existing dataset records is left to
+        update_catalog.
+        """
+
+        # As for catalog, an IntegrityError caused by a simultanious
+        # attempt to create the same records is handled by retrying the
+        # (whole) transaction.
+        tries = 0
+        while tries < self.CATALOG_MAX_TRIES:
+            try:
+                with self.collection.transaction():
+                    result_list = \
+                        self.collection.catalog_datasets(dataset_list)
+                break
+            except psycopg2.IntegrityError:
+                tries = tries + 1
+        else:
+            raise DatasetError('Unable to catalog batch: ' +
+                               'persistent integrity error.')
+
+        return result_list
+
+    def update_catalog(self, dataset_record):
+        """Update a newly cataloged dataset record, if necessary."""
+
         # Update the dataset and remove tiles if necessary.
         if dataset_record.needs_update:
-            overlap_list = dataset_record.get_removal_overlaps()
+            with self.db_lock:
+                overlap_list = dataset_record.get_removal_overlaps()
             with self.collection.lock_datasets(overlap_list):
-                with self.collection.transaction():
+                with self.db_lock, self.collection.transaction():
                     dataset_record.remove_mosaics(overlap_list)
                     dataset_record.remove_tiles()
                     dataset_record.update()
 
-        return dataset_record
-
     def tile(self, dataset_record, dataset):
         """Create tiles for a newly created or updated dataset."""
 
+        tile_list = self.warp_tiles(dataset_record, dataset)
+
+        self.store_tiles(dataset_record, tile_list)
+
+    def warp_tiles(self, dataset_record, dataset):
+        """Warp the tiles for a dataset into the temporary tile directory,
+        returning a list of tile_contents objects.
+
+        This does not use the database.
+        """
+
         tile_list = []
         for tile_type_id in dataset_record.list_tile_types():
             if not self.filter_tile_type(tile_type_id):
@@ -283,17 +613,31 @@ class AbstractIngester(object):
 
             tile_list += dataset_record.make_tiles(tile_type_id, band_stack)
 
+        return tile_list
+
+    def store_tiles(self, dataset_record, tile_list):
+        """Record the warped tiles of a dataset in the database, moving
+        them to the tile store when the transaction commits."""
+
         with self.collection.lock_datasets([dataset_record.dataset_id]):
-            with self.collection.transaction():
+            with self.db_lock, self.collection.transaction():
                 dataset_record.store_tiles(tile_list)
 
     def mosaic(self, dataset_record):
-        """Create mosaics for a newly tiled dataset."""
+        """Create mosaics for a newly tiled dataset.
+
+        If mosaicking is deferred this does nothing, leaving the new
+        tiles pending (see build_mosaics).
+        """
 
-        overlap_list = dataset_record.get_creation_overlaps()
+        if self.is_mosaic_deferred():
+            return
+
+        with self.db_lock:
+            overlap_list = dataset_record.get_creation_overlaps()
 
         with self.collection.lock_datasets(overlap_list):
-            with self.collection.transaction():
+            with self.db_lock, self.collection.transaction():
                 dataset_record.create_mosaics(overlap_list)
 
     #
@@ -335,6 +679,18 @@ class AbstractIngester(object):
 
         raise NotImplementedError
 
+    def iter_datasets(self, source_dir):
+        """Return an iterator over the paths to the datasets under
+        'source_dir'.
+
+        This is what ingest uses to find the datasets. By default it
+        iterates over the list returned by find_datasets. Subclasses may
+        override it to generate the datasets as they are found, so that
+        ingestion starts before the search finishes.
+        """
+
+        return iter(self.find_datasets(source_dir))
+
     def preprocess_dataset(self, dataset_list):
         """Performs pre-processing on the dataset_list object.
 
@@ -465,6 +821,80 @@ class AbstractIngester(object):
         tt_set = self.get_tile_type_set()
         return tt_set is None or tile_type_id in tt_set
 
+    def open_journal(self):
+        """Return the ingest journal, or None if there is no journal.
+
+        This comes from the --journal command line argument. Datasets
+        which were ingested successfully, or skipped because they were
+        already in the database, are journaled as done.
+        """
+
+        journal_path = getattr(self.args, 'journal', None)
+        if not journal_path:
+            return None
+
+        return IngestJournal(journal_path,
+                             [DATASET_COMPLETE, DATASET_SKIPPED])
+
+    def get_catalog_batch_size(self):
+        """Return the number of datasets to catalog together.
+
+        This comes from the --catalogbatch command line argument, and
+        defaults to 1 (each dataset cataloged separately).
+        """
+
+        batch_size = getattr(self.args, 'catalog_batch', None)
+        return max(1, batch_size or 1)
+
+    def is_catalog_only(self):
+        """Return True if datasets should be cataloged but not tiled.
+
+        This comes from the --catalogonly command line flag.
+        """
+
+        return bool(getattr(self.args, 'catalog_only', False))
+
+    def is_pipelined(self):
+        """Return True if datasets should be ingested as a pipeline.
+
+        This comes from the --pipeline command line flag.
+        """
+
+        return bool(getattr(self.args, 'pipeline', False))
+
+    def check_ingest_mode(self, workers, batch_size):
+        """Check that the command line arguments select a single way of
+        ingesting the datasets, raising an AssertionError otherwise.
+
+        The --pipeline flag cannot be combined with more than one worker
+        or with a catalog batch size greater than one.
+        """
+
+        if self.is_pipelined() and workers > 1:
+            raise AssertionError("Unable to ingest with both --pipeline " +
+                                 "and --workers %d." % workers)
+        if self.is_pipelined() and batch_size > 1:
+            raise AssertionError("Unable to ingest with both --pipeline " +
+                                 "and --catalogbatch %d." % batch_size)
+
+    def is_mosaic_deferred(self):
+        """Return True if new tiles should be left pending, not mosaicked.
+
+        This comes from the --defermosaic command line flag.
+        """
+
+        return bool(getattr(self.args, 'defer_mosaic', False))
+
+    def get_worker_count(self):
+        """Return the number of worker processes to ingest with.
+
+        This comes from the --workers command line argument, and
+        defaults to 1 (serial ingestion) if it is not present.
+        """
+
+        workers = getattr(self.args, 'workers', None)
+        return max(1, workers or 1)
+
     #
     # Log messages
     #
@@ -500,4 +930,282 @@ class AbstractIngester(object):
         LOGGER.info("Ingestion complete for dataset " +
                     "'%s' in %s.", dataset_path, elapsed_time)
 
+    def log_ingestion_summary(self, outcome_count):
+
+        LOGGER.info("Datasets complete: %d, skipped: %d, failed: %d.",
+                    outcome_count[DATASET_COMPLETE],
+                    outcome_count[DATASET_SKIPPED],
+                    outcome_count[DATASET_FAILED])
+
     # pylint: enable=missing-docstring, no-self-use
+
+class IngestPipeline(object):
+    """Runs the stages of an ingest concurrently.
+
+    The open stage (a thread) opens, checks and filters each dataset.
+    The tile stage (the calling thread) catalogs each dataset and warps
+    its tiles. The store stage (a thread) stores the tiles and creates
+    the mosaics. The stages are connected by queues holding at most
+    PIPELINE_QUEUE_SIZE datasets, so a slow stage holds up the stages
+    before it rather than piling up warped tiles.
+
+    The stages share the ingester's database connection, so database
+    work is done holding the ingester's db_lock. Dataset locks are
+    waited for without it (see AbstractIngester.update_catalog and
+    AbstractIngester.mosaic), and are exclusive between the stages as
+    well as between processes (see collection.Lock). A DatasetError
+    or DatasetSkipError in any stage fails or skips just that dataset.
+    Any other exception stops the pipeline and is re-raised by run.
+    """
+
+    def __init__(self, ingester, journal=None):
+
+        self.ingester = ingester
+        self.journal = journal
+
+        self.open_queue = Queue.Queue(PIPELINE_QUEUE_SIZE)
+        self.store_queue = Queue.Queue(PIPELINE_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.error_list = []
+
+        self.outcome_lock = threading.Lock()
+        self.outcome_count = {DATASET_COMPLETE: 0,
+                              DATASET_SKIPPED: 0,
+                              DATASET_FAILED: 0}
+
+    def run(self, dataset_list):
+        """Ingest the datasets in dataset_list, returning a dictionary of
+        counts of the outcomes."""
+
+        thread_list = [
+            threading.Thread(target=self.__run_stage,
+                             args=(self.__open_stage, dataset_list),
+                             name='ingest-open'),
+            threading.Thread(target=self.__run_stage,
+                             args=(self.__store_stage,),
+                             name='ingest-store')
+            ]
+        for thread in thread_list:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            self.__tile_stage()
+        except:
+            self.stop_event.set()
+            raise
+        finally:
+            for thread in thread_list:
+                thread.join()
+
+        if self.error_list:
+            exc_type, exc_value, exc_traceback = self.error_list[0]
+            raise exc_type, exc_value, exc_traceback
+
+        return self.outcome_count
+
+    #
+    # Stages
+    #
+
+    def __open_stage(self, dataset_list):
+        """Open, check and filter each dataset."""
+
+        for dataset_path in dataset_list:
+            if self.stop_event.is_set():
+                break
+            start_datetime = datetime.now()
+            (done, dataset) = self.__run_step(
+                dataset_path, start_datetime,
+                self.ingester.open_and_check_dataset, dataset_path)
+            if done:
+                self.__put(self.open_queue,
+                           (dataset_path, start_datetime, dataset))
+
+        self.__put(self.open_queue, None)
+
+    def __tile_stage(self):
+        """Catalog each dataset and warp its tiles."""
+
+        while True:
+            item = self.__get(self.open_queue)
+            if item is None:
+                break
+            (dataset_path, start_datetime, dataset) = item
+
+            (done, dataset_record) = self.__run_step(
+                dataset_path, start_datetime, self.ingester.catalog, dataset)
+            if not done:
+                continue
+
+            if self.ingester.is_catalog_only():
+                self.__complete(dataset_path, start_datetime)
+                continue
+
+            (done, tile_list) = self.__run_step(
+                dataset_path, start_datetime,
+                self.ingester.warp_tiles, dataset_record, dataset)
+            if done:
+                self.__put(self.store_queue, (dataset_path, start_datetime,
+                                              dataset_record, tile_list))
+
+        self.__put(self.store_queue, None)
+
+    def __store_stage(self):
+        """Store the tiles of each dataset and create its mosaics."""
+
+        while True:
+            item = self.__get(self.store_queue)
+            if item is None:
+                break
+            (dataset_path, start_datetime, dataset_record, tile_list) = item
+
+            (done, dummy_result) = self.__run_step(
+                dataset_path, start_datetime,
+                self.ingester.store_tiles, dataset_record, tile_list)
+            if not done:
+                continue
+
+            (done, dummy_result) = self.__run_step(
+                dataset_path, start_datetime,
+                self.ingester.mosaic, dataset_record)
+            if done:
+                self.__complete(dataset_path, start_datetime)
+
+    #
+    # Utility methods
+    #
+
+    def __run_stage(self, stage, *args):
+        """Thread target: run a stage, stopping the pipeline if it
+        raises an exception."""
+
+        try:
+            stage(*args)
+        except:  # pylint: disable=bare-except
+            self.error_list.append(sys.exc_info())
+            self.stop_event.set()
+
+    def __run_step(self, dataset_path, start_datetime, function, *args):
+        """Run one step of the ingest of a dataset.
+
+        Returns a tuple (True, result of function). If the step raises
+        a DatasetError or DatasetSkipError the dataset is finished,
+        logged as for ingest_individual_dataset, and (False, None) is
+        returned.
+        """
+
+        try:
+            return (True, function(*args))
+
+        except DatasetError as err:
+            self.ingester.log_dataset_fail(dataset_path, err,
+                                           datetime.now() - start_datetime)
+            self.__record(dataset_path, DATASET_FAILED)
+
+        except DatasetSkipError as err:
+            self.ingester.log_dataset_skip(dataset_path, err,
+                                           datetime.now() - start_datetime)
+            self.__record(dataset_path, DATASET_SKIPPED)
+
+        return (False, None)
+
+    def __complete(self, dataset_path, start_datetime):
+        """Finish a successfully ingested dataset."""
+
+        self.ingester.log_dataset_ingest_complete(
+            dataset_path, datetime.now() - start_datetime)
+        self.__record(dataset_path, DATASET_COMPLETE)
+
+    def __record(self, dataset_path, outcome):
+        """Count the outcome of a dataset, and record it in the journal."""
+
+        with self.outcome_lock:
+            self.outcome_count[outcome] += 1
+        if self.journal is not None:
+            self.journal.record(dataset_path, outcome)
+
+    def __put(self, queue, item):
+        """Put item on queue, giving up if the pipeline is stopped."""
+
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=PIPELINE_POLL)
+                return
+            except Queue.Full:
+                pass
+
+    def __get(self, queue):
+        """Get an item from queue, returning None (as at the end of the
+        queue) if the pipeline is stopped."""
+
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=PIPELINE_POLL)
+            except Queue.Empty:
+                pass
+
+        return None
+
+
+#
+# Worker process functions
+#
+# These are module level functions so that they can be passed to a
+# multiprocessing pool.
+#
+
+
+def _start_worker(ingester):
+    """Pool initializer: set up the ingester inherited by a worker."""
+
+    global _WORKER_INGESTER  # pylint: disable=global-statement
+
+    ingester.start_worker()
+    _WORKER_INGESTER = ingester
+
+
+def _guard_iterable(iterable, error_list):
+    """Generate the items of iterable, stopping on an exception and
+    appending its sys.exc_info() to error_list."""
+
+    try:
+        for item in iterable:
+            yield item
+    except Exception:  # pylint: disable=broad-except
+        error_list.append(sys.exc_info())
+
+
+def _make_batches(iterable, batch_size):
+    """Generate lists of up to batch_size items from iterable."""
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ingest_in_worker(task):
+    """Ingest one dataset in a worker process, returning a list of one
+    (dataset path, outcome) tuple. The task is a (dataset path, size in
+    kB or None) tuple."""
+
+    (dataset_path, size_kb) = task
+    set_directory_size_kb(dataset_path, size_kb)
+    return [(dataset_path,
+             _WORKER_INGESTER.ingest_individual_dataset(dataset_path))]
+
+
+def _ingest_batch_in_worker(task_list):
+    """Ingest a batch of datasets in a worker process, returning a list
+    of (dataset path, outcome) tuples. The tasks are as for
+    _ingest_in_worker."""
+
+    for (dataset_path, size_kb) in task_list:
+        set_directory_size_kb(dataset_path, size_kb)
+    return _WORKER_INGESTER.ingest_dataset_batch(
+        [dataset_path for (dataset_path, dummy_size_kb) in task_list])
@@ -70,7 +70,13 @@ class AcquisitionRecord(object):
                                    'cloud_cover'
                                    ]
 
-    def __init__(self, collection, dataset):
+    def __init__(self, collection, dataset, find_or_create=True):
+        """Set up the acquisition record for a dataset.
+
+        If find_or_create is False the acquisition_id is not looked up
+        (or created) in the database. It must then be filled in using
+        set_acquisition_id (see Collection.catalog_datasets).
+        """
 
         self.collection = collection
         self.datacube = collection.datacube
@@ -83,25 +89,32 @@ class AcquisitionRecord(object):
         for field in self.ACQUISITION_METADATA_FIELDS:
             self.acquisition_dict[field] = dataset.metadata_dict[field]
 
-        # Next look up the satellite_id and sensor_id in the
-        # database and fill these in.
+        # Next look up the satellite_id and sensor_id (cached by the
+        # collection) and fill these in.
         self.acquisition_dict['satellite_id'] = \
-            self.db.get_satellite_id(self.acquisition_dict['satellite_tag'])
+            collection.get_satellite_id(self.acquisition_dict['satellite_tag'])
         self.acquisition_dict['sensor_id'] = \
-            self.db.get_sensor_id(self.acquisition_dict['satellite_id'],
-                                  self.acquisition_dict['sensor_name'])
+            collection.get_sensor_id(self.acquisition_dict['satellite_id'],
+                                     self.acquisition_dict['sensor_name'])
 
         # Finally look up the acquisiton_id, or create a new record if it
         # does not exist, and fill it into the dictionary.
-        self.acquisition_id = \
-            self.db.get_acquisition_id_fuzzy(self.acquisition_dict)
-        if self.acquisition_id is None:
-            self.acquisition_id = \
-                self.db.insert_acquisition_record(self.acquisition_dict)
-        else:
-            # Do we update the acquisition record here?
-            pass
-        self.acquisition_dict['acquisition_id'] = self.acquisition_id
+        if find_or_create:
+            acquisition_id = \
+                self.db.get_acquisition_id_fuzzy(self.acquisition_dict)
+            if acquisition_id is None:
+                acquisition_id = \
+                    self.db.insert_acquisition_record(self.acquisition_dict)
+            else:
+                # Do we update the acquisition record here?
+                pass
+            self.set_acquisition_id(acquisition_id)
+
+    def set_acquisition_id(self, acquisition_id):
+        """Set the acquisition_id of an existing or newly created record."""
+
+        self.acquisition_id = acquisition_id
+        self.acquisition_dict['acquisition_id'] = acquisition_id
 
     def create_dataset_record(self, dataset):
         """Factory method to create an instance of the DatasetRecord class.
@@ -113,3 +126,24 @@ class AcquisitionRecord(object):
         """
 
         return DatasetRecord(self.collection, self, dataset)
+
+    def matches(self, other):
+        """Return True if the acquisition of 'other' (an AcquisitionRecord)
+        would be found for this one by get_acquisition_id_fuzzy.
+
+        This is used to match acquisitions which are both new to the
+        database within a batch (see Collection.catalog_datasets)."""
+
+        this_dict = self.acquisition_dict
+        other_dict = other.acquisition_dict
+        aq_length = this_dict['end_datetime'] - this_dict['start_datetime']
+        delta = (aq_length*self.db.FUZZY_MATCH_PERCENTAGE)/100
+
+        return (this_dict['satellite_id'] == other_dict['satellite_id'] and
+                this_dict['sensor_id'] == other_dict['sensor_id'] and
+                this_dict['x_ref'] == other_dict['x_ref'] and
+                this_dict['y_ref'] == other_dict['y_ref'] and
+                abs(this_dict['start_datetime'] -
+                    other_dict['start_datetime']) <= delta and
+                abs(this_dict['end_datetime'] -
+                    other_dict['end_datetime']) <= delta)
@@ -41,16 +41,42 @@ format changes.
 import logging
 import os
 import time
+import random
 import shutil
-from agdc.cube_util import DatasetError, create_directory
-from tile_contents import TileContents
+import threading
+from agdc.cube_util import DatasetError, DatasetSkipError, create_directory
+from tile_contents import TileContents, WARP_ENGINES, WARP_ENGINE_SUBPROCESS
 from acquisition_record import AcquisitionRecord
+from dataset_record import DatasetRecord
 from ingest_db_wrapper import IngestDBWrapper
+from ingest_db_wrapper import TC_SINGLE_SCENE, TC_SUPERSEDED, TC_MOSAIC
+from mosaic_contents import MosaicContents
+from tile_mover import TileMover, MOVER_WORKERS
 
 # Set up logger.
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# Process-wide set of the (x_index, y_index, tile_type_id) keys of the
+# tile footprints known to be in the database. This is loaded on first
+# use (see Collection.update_tile_footprints) and added to as footprints
+# are committed. Footprints are never removed from the database, so it
+# does not go stale.
+#
+
+_TILE_FOOTPRINT_SET = None
+
+#
+# Process-wide set of the objects locked by Lock context managers in
+# this process, so that threads (such as the stages of an
+# IngestPipeline) exclude each other. The database locks belong to the
+# process, and are re-entrant for it, so they do not do this.
+#
+
+_LOCAL_LOCK_CONDITION = threading.Condition()
+_LOCAL_LOCK_SET = set()
+
 
 class Collection(object):
     """Collection database interface class."""
@@ -67,11 +93,18 @@ class Collection(object):
         self.new_bands = self.__reindex_bands(datacube.bands)
         self.transaction_stack = []
 
-        self.temp_tile_directory = os.path.join(self.datacube.tile_root,
+        self.satellite_dict = None
+        self.sensor_dict = None
+        self.level_dict = None
+        self.refresh_reference_data()
+
+        self.temp_tile_directory = os.path.join(self.get_staging_root(),
                                                 'ingest_temp',
                                                 self.datacube.process_id)
         create_directory(self.temp_tile_directory)
 
+        self.tile_mover = self.__make_tile_mover()
+
     def cleanup(self):
         """Do end-of-process cleanup.
 
@@ -80,8 +113,40 @@ class Collection(object):
         object has a destructor which does that.
         """
 
+        if self.tile_mover is not None:
+            self.tile_mover.close()
         shutil.rmtree(self.temp_tile_directory, ignore_errors=True)
 
+    def refresh_reference_data(self):
+        """Reload the satellite, sensor and processing level ids.
+
+        These are read from the database once when the collection is
+        created, so this needs to be called if the tables are changed
+        while the collection is in use.
+        """
+
+        (self.satellite_dict,
+         self.sensor_dict,
+         self.level_dict) = self.db.get_reference_data()
+
+    def get_satellite_id(self, satellite_tag):
+        """Return the satellite_id for satellite_tag, or None if it
+        is not in the database."""
+
+        return self.satellite_dict.get(satellite_tag)
+
+    def get_sensor_id(self, satellite_id, sensor_name):
+        """Return the sensor_id for a satellite_id, sensor_name pair,
+        or None if it is not in the database."""
+
+        return self.sensor_dict.get((satellite_id, sensor_name))
+
+    def get_level_id(self, level_name):
+        """Return the (processing) level_id for level_name, or None if
+        it is not in the database."""
+
+        return self.level_dict.get(level_name)
+
     @staticmethod
     def get_dataset_key(dataset):
         """Return the dataset key for use with the new_bands dictionary.
@@ -110,6 +175,39 @@ class Collection(object):
 
         return self.temp_tile_directory
 
+    def get_staging_root(self):
+        """Return the root of the temporary (staging) tile directories.
+
+        This is the 'staging_root' configuration file item, which may
+        point at fast local storage (e.g. a local disk or tmpfs) rather
+        than the shared tile store. It defaults to tile_root.
+        """
+
+        # pylint: disable=maybe-no-member
+        staging_root = getattr(self.datacube, 'staging_root', None)
+        return staging_root or self.datacube.tile_root
+
+    def get_tile_mover_workers(self):
+        """Return the number of threads moving tiles to the tile store.
+
+        This is the 'tile_mover_workers' configuration file item, and
+        defaults to tile_mover.MOVER_WORKERS. Zero means tiles are moved
+        by the committing thread, as they are if there is no separate
+        staging_root.
+        """
+
+        try:
+            # pylint: disable=maybe-no-member
+            workers = int(self.datacube.tile_mover_workers)
+        except AttributeError:
+            workers = MOVER_WORKERS
+        except (TypeError, ValueError):
+            raise AssertionError("Unable to parse the " +
+                                 "'tile_mover_workers' configuration " +
+                                 "file item.")
+
+        return workers
+
     def check_metadata(self, dataset):
         """Check that the satellite, sensor, and bands are in the database.
 
@@ -130,7 +228,8 @@ class Collection(object):
         """
 
         return Transaction(self.db if db is None else db,
-                           self.transaction_stack)
+                           self.transaction_stack,
+                           self.tile_mover)
 
     def lock_datasets(self, dataset_list):
         """Returns a Lock context manager object.
@@ -144,7 +243,22 @@ class Collection(object):
 
         lock_list = ['Dataset-' + str(dataset_id)
                      for dataset_id in dataset_list]
-        return Lock(self.datacube, lock_list)
+        return Lock(self.datacube, lock_list, timeout=self.get_lock_timeout())
+
+    def get_lock_timeout(self):
+        """Return the time (in seconds) to wait for dataset locks.
+
+        This comes from the lock_timeout configuration item, and
+        defaults to Lock.DEFAULT_TIMEOUT.
+        """
+
+        try:
+            # pylint: disable=maybe-no-member
+            timeout = float(self.datacube.lock_timeout)
+        except (AttributeError, TypeError, ValueError):
+            timeout = Lock.DEFAULT_TIMEOUT
+
+        return timeout
 
     def create_acquisition_record(self, dataset):
         """Factory method to create an instance of the AcquisitonRecord class.
@@ -155,6 +269,97 @@ class Collection(object):
 
         return AcquisitionRecord(self, dataset)
 
+    def catalog_datasets(self, dataset_list):
+        """Create the acquisition and dataset records for a batch of datasets.
+
+        This has the same effect as calling create_acquisition_record and
+        then create_dataset_record for each dataset in turn, but finds
+        and inserts the records using a few multi-row queries for the
+        whole batch. It should be called inside a transaction.
+
+        Returns a list, in the same order as dataset_list, of the dataset
+        records, or of the DatasetError or DatasetSkipError raised for a
+        dataset which cannot be cataloged. Other exceptions (including
+        database errors) are raised for the batch as a whole.
+        """
+
+        # Acquisitions: look up all at once, then insert the new ones,
+        # matching new acquisitions within the batch as the fuzzy query
+        # would have matched them had they been inserted one at a time.
+        acquisition_list = [AcquisitionRecord(self, dataset,
+                                              find_or_create=False)
+                            for dataset in dataset_list]
+        acquisition_id_list = self.db.get_acquisition_ids_fuzzy(
+            [acquisition.acquisition_dict for acquisition in acquisition_list])
+
+        new_acquisition_list = []
+        same_acquisition_list = []
+        for (acquisition, acquisition_id) in zip(acquisition_list,
+                                                 acquisition_id_list):
+            if acquisition_id is not None:
+                acquisition.set_acquisition_id(acquisition_id)
+                continue
+            for new_acquisition in new_acquisition_list:
+                if acquisition.matches(new_acquisition):
+                    same_acquisition_list.append((acquisition,
+                                                  new_acquisition))
+                    break
+            else:
+                new_acquisition_list.append(acquisition)
+
+        new_acquisition_id_list = self.db.insert_acquisition_records(
+            [acquisition.acquisition_dict
+             for acquisition in new_acquisition_list])
+        for (acquisition, acquisition_id) in zip(new_acquisition_list,
+                                                 new_acquisition_id_list):
+            acquisition.set_acquisition_id(acquisition_id)
+        for (acquisition, new_acquisition) in same_acquisition_list:
+            acquisition.set_acquisition_id(new_acquisition.acquisition_id)
+
+        # Datasets: likewise. A dataset which duplicates a new one earlier
+        # in the batch is checked against it as an existing record.
+        result_list = []
+        for (acquisition, dataset) in zip(acquisition_list, dataset_list):
+            try:
+                result_list.append(DatasetRecord(self, acquisition, dataset,
+                                                 find_or_create=False))
+            except (DatasetError, DatasetSkipError) as err:
+                result_list.append(err)
+
+        index_list = [index for (index, result) in enumerate(result_list)
+                      if isinstance(result, DatasetRecord)]
+        dataset_id_list = self.db.get_dataset_ids(
+            [result_list[index].dataset_dict for index in index_list])
+
+        new_index_list = []
+        new_record_dict = {}
+        existing_list = []
+        for (index, dataset_id) in zip(index_list, dataset_id_list):
+            dataset_dict = result_list[index].dataset_dict
+            key = (dataset_dict['acquisition_id'], dataset_dict['level_id'])
+            if dataset_id is not None:
+                existing_list.append((index, dataset_id, None))
+            elif key in new_record_dict:
+                existing_list.append((index, None, new_record_dict[key]))
+            else:
+                new_record_dict[key] = result_list[index]
+                new_index_list.append(index)
+
+        new_dataset_id_list = self.db.insert_dataset_records(
+            [result_list[index].dataset_dict for index in new_index_list])
+        for (index, dataset_id) in zip(new_index_list, new_dataset_id_list):
+            result_list[index].set_dataset_id(dataset_id, is_new=True)
+
+        for (index, dataset_id, new_record) in existing_list:
+            if new_record is not None:
+                dataset_id = new_record.dataset_id
+            try:
+                result_list[index].set_dataset_id(dataset_id, is_new=False)
+            except (DatasetError, DatasetSkipError) as err:
+                result_list[index] = err
+
+        return result_list
+
     def create_tile_contents(self, tile_type_id, tile_footprint,
                              band_stack):
         """Factory method to create an instance of the TileContents class.
@@ -165,9 +370,164 @@ class Collection(object):
 
         tile_type_info = self.datacube.tile_type_dict[tile_type_id]
         tile_contents = TileContents(self.datacube.tile_root, tile_type_info,
-                                     tile_footprint, band_stack)
+                                     tile_footprint, band_stack,
+                                     warp_engine=self.get_warp_engine())
         return tile_contents
 
+    def store_tile_records(self, tile_record_list):
+        """Write a list of tile records to the database in bulk.
+
+        The tile records (created with find_or_create=False) may belong
+        to any number of datasets. This has the same effect as creating
+        each of them with find_or_create=True, but uses a few multi-row
+        queries for the whole list. It should be called inside a
+        transaction, and fills in the tile_ids of the records.
+        """
+
+        if not tile_record_list:
+            return
+
+        self.update_tile_footprints([tile_record.get_footprint_dict()
+                                     for tile_record in tile_record_list])
+
+        # Make the tile record entries on the database.
+        tile_dict_list = [tile_record.tile_dict
+                          for tile_record in tile_record_list]
+        if any(tile_id is not None for tile_id
+               in self.db.get_tile_ids(tile_dict_list)):
+            # If there was any existing tile corresponding to tile_dict then
+            # it should already have been removed.
+            raise AssertionError("Attempt to recreate an existing tile.")
+
+        tile_id_list = self.db.insert_tile_records(tile_dict_list)
+        for (tile_record, tile_id) in zip(tile_record_list, tile_id_list):
+            tile_record.set_tile_id(tile_id)
+
+    def update_tile_footprints(self, footprint_dict_list):
+        """Make sure the tile footprints in footprint_dict_list exist.
+
+        Footprints are checked against the process-wide footprint set,
+        which is loaded from the database the first time this is called.
+        Any missing footprints are inserted on the current connection
+        (doing nothing if another process has inserted them first), and
+        added to the set when the current transaction commits. They are
+        inserted in key order, so that concurrent ingests take the index
+        locks on new footprints in the same order and cannot deadlock.
+        """
+
+        global _TILE_FOOTPRINT_SET
+        if _TILE_FOOTPRINT_SET is None:
+            _TILE_FOOTPRINT_SET = set(self.db.get_tile_footprint_keys())
+            LOGGER.debug('Loaded %d tile footprints.',
+                         len(_TILE_FOOTPRINT_SET))
+
+        missing_dict = {}
+        for footprint_dict in footprint_dict_list:
+            key = (footprint_dict['x_index'],
+                   footprint_dict['y_index'],
+                   footprint_dict['tile_type_id'])
+            if key not in _TILE_FOOTPRINT_SET:
+                missing_dict[key] = footprint_dict
+
+        if missing_dict:
+            self.db.insert_tile_footprints([missing_dict[key] for key
+                                            in sorted(missing_dict)])
+            if self.transaction_stack:
+                self.current_transaction().add_commit_action(
+                    _TILE_FOOTPRINT_SET.update, missing_dict.keys())
+            else:
+                _TILE_FOOTPRINT_SET.update(missing_dict.keys())
+
+    def get_pending_mosaic_groups(self):
+        """Return the groups of datasets with pending mosaics.
+
+        Tiles left pending (by an ingest with deferred mosaicking) are
+        found with a single query. Returns a list of sorted lists of
+        dataset ids. Each list holds the datasets whose tiles overlap,
+        directly or through other tiles, so the mosaics for a group can
+        be made with one set of dataset locks (see create_pending_mosaics),
+        and different groups can be mosaicked in parallel.
+        """
+
+        overlap_group_list = _group_overlaps(self.db.get_pending_overlaps())
+
+        dataset_group_dict = {}
+        for tile_record_list in overlap_group_list:
+            dataset_set = set(tr['dataset_id'] for tr in tile_record_list)
+            for dataset_id in list(dataset_set):
+                dataset_set.update(dataset_group_dict.get(dataset_id, ()))
+            for dataset_id in dataset_set:
+                dataset_group_dict[dataset_id] = dataset_set
+
+        group_dict = dict((id(dataset_set), dataset_set) for dataset_set
+                          in dataset_group_dict.values())
+        return sorted(sorted(dataset_set)
+                      for dataset_set in group_dict.values())
+
+    def create_pending_mosaics(self, dataset_filter):
+        """Create the mosaics for the pending tiles of a group of datasets.
+
+        'dataset_filter' is a list of dataset_ids, as returned by
+        get_pending_mosaic_groups. They should be locked, and this should
+        be called inside a transaction. Overlapping tiles are mosaicked
+        (replacing any existing mosaic) and marked as superseded, and
+        pending tiles without overlaps are marked as single scene tiles.
+        Returns the number of mosaics created.
+        """
+
+        overlap_list = self.db.get_pending_overlaps(
+            dataset_filter=dataset_filter)
+
+        mosaic_count = 0
+        for tile_record_list in _group_overlaps(overlap_list):
+            old_mosaic_list = [tr for tr in tile_record_list
+                               if tr['tile_class_id'] == TC_MOSAIC]
+            tile_record_list = [tr for tr in tile_record_list
+                                if tr['tile_class_id'] != TC_MOSAIC]
+
+            if len(tile_record_list) > 1:
+                for tr in old_mosaic_list:
+                    self.db.remove_tile_record(tr['tile_id'])
+                    self.mark_tile_for_removal(tr['tile_pathname'])
+
+                mosaic = MosaicContents(
+                    tile_record_list,
+                    self.datacube.tile_type_dict,
+                    tile_record_list[0]['level_name'],
+                    self.get_temp_tile_directory()
+                    )
+                mosaic.create_record(self.db)
+                self.mark_tile_for_creation(mosaic)
+                mosaic_count += 1
+
+                for tr in tile_record_list:
+                    self.db.update_tile_class(tr['tile_id'], TC_SUPERSEDED)
+            else:
+                for tr in tile_record_list:
+                    self.db.update_tile_class(tr['tile_id'], TC_SINGLE_SCENE)
+
+        return mosaic_count
+
+    def get_warp_engine(self):
+        """Return the warp engine used to reproject tiles.
+
+        This is the 'warp_engine' configuration file item, which should be
+        one of tile_contents.WARP_ENGINES. It defaults to running the
+        gdalwarp command if it is not set.
+        """
+
+        # pylint: disable=maybe-no-member
+        warp_engine = getattr(self.datacube, 'warp_engine', None)
+        if not warp_engine:
+            warp_engine = WARP_ENGINE_SUBPROCESS
+
+        if warp_engine not in WARP_ENGINES:
+            raise AssertionError("Unable to parse the 'warp_engine' " +
+                                 "configuration file item: '%s'." %
+                                 warp_engine)
+
+        return warp_engine
+
     def current_transaction(self):
         """Returns the current transaction."""
 
@@ -187,6 +547,20 @@ class Collection(object):
     # worker methods
     #
 
+    def __make_tile_mover(self):
+        """Return a TileMover to move tiles from a separate staging area
+        to the tile store in the background, or None if tiles should be
+        moved at commit time."""
+
+        workers = self.get_tile_mover_workers()
+        if (workers <= 0 or
+                self.get_staging_root() == self.datacube.tile_root):
+            return None
+
+        LOGGER.debug('Staging tiles under %s, with %d mover threads.',
+                     self.get_staging_root(), workers)
+        return TileMover(workers)
+
     @staticmethod
     def __reindex_bands(bands):
         """Reindex the datacube.bands nested dict structure.
@@ -226,13 +600,13 @@ class Collection(object):
         Raises a DatasetError if they are not.
         """
 
-        satellite_id = self.db.get_satellite_id(dataset.get_satellite_tag())
+        satellite_id = self.get_satellite_id(dataset.get_satellite_tag())
         if satellite_id is None:
             raise DatasetError("Unknown satellite tag: '%s'" %
                                dataset.get_satellite_tag())
 
-        sensor_id = self.db.get_sensor_id(satellite_id,
-                                          dataset.get_sensor_name())
+        sensor_id = self.get_sensor_id(satellite_id,
+                                       dataset.get_sensor_name())
         if sensor_id is None:
             msg = ("Unknown satellite and sensor pair: '%s', '%s'" %
                    (dataset.get_satellite_tag(), dataset.get_sensor_name()))
@@ -244,7 +618,7 @@ class Collection(object):
         Raises a DatasetError if it is not.
         """
 
-        level_id = self.db.get_level_id(dataset.get_processing_level())
+        level_id = self.get_level_id(dataset.get_processing_level())
         if level_id is None:
             raise DatasetError("Unknown processing level: '%s'" %
                                dataset.get_processing_level())
@@ -265,6 +639,41 @@ class Collection(object):
             for band_info in tile_type_bands.values():
                 dataset.find_band_file(band_info['file_pattern'])
 
+#
+# Functions
+#
+
+
+def _group_overlaps(overlap_list):
+    """Group the tile records returned by IngestDBWrapper.get_pending_overlaps.
+
+    Tiles overlapping the same pending tile, directly or through other
+    pending tiles, are grouped together (these always share a tile
+    footprint). Returns a list of lists of tile records, in order of
+    acquisition start time within each list.
+    """
+
+    tile_record_dict = {}
+    group_dict = {}
+    for (pending_tile_id, tile_record) in overlap_list:
+        tile_id = tile_record['tile_id']
+        tile_record_dict[tile_id] = tile_record
+
+        pending_group = group_dict.setdefault(pending_tile_id,
+                                              [pending_tile_id])
+        tile_group = group_dict.setdefault(tile_id, [tile_id])
+        if pending_group is not tile_group:
+            pending_group.extend(tile_group)
+            for member_id in tile_group:
+                group_dict[member_id] = pending_group
+
+    group_list = dict((id(group), group)
+                      for group in group_dict.values()).values()
+
+    return [sorted((tile_record_dict[tile_id] for tile_id in group),
+                   key=lambda tr: tr['start_datetime'])
+            for group in group_list]
+
 #
 # Context manager classes
 #
@@ -279,12 +688,16 @@ class Transaction(object):
     in coordination with the transaction.
     """
 
-    def __init__(self, db, tr_stack=None):
+    def __init__(self, db, tr_stack=None, tile_mover=None):
         """Initialise the transaction.
 
         db is the database connection to use.
         tr_stack is a stack of transactions. If not None, the last item
             on the tr_stack should be the current transaction.
+        tile_mover is a tile_mover.TileMover. If not None, tiles marked
+            for creation start moving to their final location in the
+            background straight away, and the commit only waits for the
+            moves still in progress.
         tile_remove_list is the list of tile files to remove on commit.
         tile_create_list is the list of tile contents to create on commit
         (or cleanup on roll back).
@@ -297,8 +710,10 @@ class Transaction(object):
 
         self.db = db
         self.tr_stack = tr_stack
+        self.tile_mover = tile_mover
         self.tile_remove_list = None
         self.tile_create_list = None
+        self.commit_action_list = None
         self.previous_commit_mode = None
 
     def __enter__(self):
@@ -314,6 +729,7 @@ class Transaction(object):
 
         self.tile_remove_list = []
         self.tile_create_list = []
+        self.commit_action_list = []
         self.previous_commit_mode = self.db.turn_off_autocommit()
 
         if self.tr_stack is not None:
@@ -339,6 +755,7 @@ class Transaction(object):
 
         self.tile_remove_list = None
         self.tile_create_list = None
+        self.commit_action_list = None
         self.db.restore_commit_mode(self.previous_commit_mode)
 
         if self.tr_stack is not None:
@@ -377,6 +794,9 @@ class Transaction(object):
                 if os.path.isfile(tile_pathname):
                     os.remove(tile_pathname)
 
+        for (function, args) in self.commit_action_list:
+            function(*args)
+
     def __rollback(self):
         """Roll back the transaction while handling tile files."""
 
@@ -410,6 +830,18 @@ class Transaction(object):
         """
 
         self.tile_create_list.append(tile_contents)
+        if self.tile_mover is not None:
+            tile_contents.start_promotion(self.tile_mover)
+
+    def add_commit_action(self, function, *args):
+        """Arrange for function(*args) to be called after the transaction
+        commits.
+
+        This is used to update in-memory state (such as caches) which
+        must only reflect committed changes to the database.
+        """
+
+        self.commit_action_list.append((function, args))
 
 
 class Lock(object):
@@ -419,20 +851,31 @@ class Lock(object):
     locks. It handles acquiring and releasing the locks as well as
     waiting and retries if the locks cannot be acquired.
 
+    Between attempts it waits for a notification that a lock has been
+    released, so it can retry as soon as another process is finished.
+    Because a notification may never come (for instance if the other
+    process dies) each wait is also limited, using exponential backoff
+    with jitter, and the whole attempt gives up at a deadline.
+
+    The objects are first claimed within the process, so a thread waits
+    for other threads of the same process to release them (see
+    _LOCAL_LOCK_SET), as well as for other processes.
+
     Not that this will not work for nested locks/with statements in the
-    same process that attempt to lock the same object, because the
-    locking mechanism  does not count the number of times an object has
-    been locked.
+    same thread that attempt to lock the same object: the inner lock
+    waits for the outer one until it times out.
     """
 
-    DEFAULT_WAIT = 10
-    DEFAULT_RETRIES = 6
+    DEFAULT_TIMEOUT = 60
+    DEFAULT_MIN_WAIT = 0.5
+    DEFAULT_MAX_WAIT = 10
 
     def __init__(self,
                  datacube,
                  lock_list,
-                 wait=DEFAULT_WAIT,
-                 retries=DEFAULT_RETRIES):
+                 timeout=DEFAULT_TIMEOUT,
+                 min_wait=DEFAULT_MIN_WAIT,
+                 max_wait=DEFAULT_MAX_WAIT):
 
         """Initialise the lock object.
 
@@ -443,10 +886,10 @@ class Lock(object):
                 that is being locked.
 
         Keyword Arguments:
-            wait: The amount of time to wait, in seconds, before again trying
-                to acquire the locks.
-            retries: The maximum number of attempts before giving up and
-                raising an exception.
+            timeout: The time, in seconds, after which to give up trying
+                to acquire the locks and raise an exception.
+            min_wait, max_wait: The range of the (backoff) time to wait
+                for a lock to be released before trying again anyway.
         """
 
         self.datacube = datacube
@@ -454,30 +897,31 @@ class Lock(object):
         # This avoids mini-deadlocks and resulting retries when acquiring
         # multiple locks.
         self.lock_list = sorted(lock_list)
-        self.wait = wait
-        self.retries = retries
+        self.timeout = timeout
+        self.min_wait = min_wait
+        self.max_wait = max_wait
 
     def __enter__(self):
         """Auto-called on 'with' statement entry.
 
         This acquires the locks or raises a LockError if it cannot
-        do so (after the maximum number of tries). Note that LockError
-        is a subclass of DatasetError, so it will cause a dataset skip.
+        do so before the timeout. Note that LockError is a subclass of
+        DatasetError, so it will cause a dataset skip.
 
         Returns 'self' so that other methods are available via an 'as'
         clause (though there are no interface methods at the moment).
         """
 
-        for dummy_tries in range(self.retries + 1):
+        deadline = time.time() + self.timeout
+        self.__claim_local_locks(deadline)
+        try:
             try:
                 self.__acquire_locks(self.lock_list)
-                break
             except LockError:
-                time.sleep(self.wait)
-        else:
-            raise LockError(("Unable to lock objects after %s tries: " %
-                             self.retries) +
-                            self.lock_list)
+                self.__wait_for_locks(deadline)
+        except:
+            self.__release_local_locks()
+            raise
 
         return self
 
@@ -489,37 +933,85 @@ class Lock(object):
         exception to be re-raised.
         """
 
-        for object_to_unlock in self.lock_list:
-            self.datacube.unlock_object(object_to_unlock)
+        try:
+            self.datacube.unlock_objects(self.lock_list)
+        finally:
+            self.__release_local_locks()
+
+    def __claim_local_locks(self, deadline):
+        """Claim the objects on the lock_list within this process,
+        waiting until no other thread holds any of them.
+
+        Raises a LockError if they are still held at the deadline.
+        """
+
+        with _LOCAL_LOCK_CONDITION:
+            while _LOCAL_LOCK_SET.intersection(self.lock_list):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise LockError(
+                        "Unable to lock objects held by another thread: %s" %
+                        self.lock_list)
+                _LOCAL_LOCK_CONDITION.wait(remaining)
+            _LOCAL_LOCK_SET.update(self.lock_list)
+
+    def __release_local_locks(self):
+        """Release the claim on the objects on the lock_list within this
+        process, waking any threads waiting for them."""
+
+        with _LOCAL_LOCK_CONDITION:
+            _LOCAL_LOCK_SET.difference_update(self.lock_list)
+            _LOCAL_LOCK_CONDITION.notify_all()
+
+    def __wait_for_locks(self, deadline):
+        """Acquire the locks on the lock_list after a first attempt has
+        failed, waiting for them to be released.
+
+        The lock manager's listener is only opened here, so uncontended
+        locks do not pay for a LISTEN and UNLISTEN. The locks are tried
+        again straight after the LISTEN, so that a release between the
+        first attempt and the LISTEN is not missed. Raises a LockError if
+        the locks are not acquired by the deadline.
+        """
+
+        tries = 1
+        with self.datacube.get_lock_manager().listener() as listener:
+            while True:
+                tries = tries + 1
+                try:
+                    self.__acquire_locks(self.lock_list)
+                    return
+                except LockError:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise LockError(
+                            "Unable to lock objects after %s tries: %s" %
+                            (tries, self.lock_list))
+                    listener.wait(min(self.__backoff(tries - 1), remaining),
+                                  self.lock_list)
+
+    def __backoff(self, tries):
+        """Return the maximum time to wait after 'tries' failed attempts.
+
+        This doubles with each attempt up to max_wait, with the upper
+        half randomised so that waiting processes do not retry in step.
+        """
+
+        wait = min(self.max_wait, self.min_wait * 2 ** (tries - 1))
+        return wait/2.0 + random.uniform(0, wait/2.0)
 
     def __acquire_locks(self, lock_list):
         """Acquire all the locks on the lock_list.
 
         Either sucessfully acquires *all* the locks or raises a
-        LockError and releases all the locks obtained so far.
+        LockError having acquired none of them. The locks are taken
+        together by one statement, whatever their number, in a
+        transaction which is rolled back unless it takes them all (see
+        LockManager.lock_objects).
         """
 
-        # Recursive algorithm.
-        #
-        # If the list is empty do nothing, otherwise ...
-        if lock_list:
-            # See if we can lock the object at the head of the list ...
-            if self.datacube.lock_object(lock_list[0]):
-                # If yes, then attempt to lock the rest (tail) of the list
-                # using a recursive call ...
-                try:
-                    self.__acquire_locks(lock_list[1:])
-                except:
-                    # If locking the tail does not work then release the
-                    # lock we have on the head, and re-raise the exception.
-                    self.datacube.unlock_object(lock_list[0])
-                    raise
-            else:
-                # If we cannot lock the head then raise an exception
-                # (which will cause all previous calls in the chain to
-                # release their locks and re-raise the exception, in reverse
-                # order).
-                raise LockError()
+        if not self.datacube.lock_objects(lock_list):
+            raise LockError()
 
 #
 # Exceptions
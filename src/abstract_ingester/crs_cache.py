@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+
+"""
+crs_cache: cached spatial references and coordinate transformations.
+
+Parsing a WKT or EPSG projection into an osr.SpatialReference and
+building an osr.CoordinateTransformation are expensive compared with
+transforming the four corners of a dataset, and an ingest sees only a
+handful of distinct projections. The objects are therefore kept in
+small least recently used caches keyed by the projection strings.
+
+The cached objects are shared: callers must not modify them. A
+coordinate transformation should only be used by one thread at a time.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from osgeo import osr
+
+#
+# Constants
+#
+
+SPATIAL_REF_CACHE_SIZE = 32  # Number of spatial references kept.
+TRANSFORMATION_CACHE_SIZE = 32  # Number of transformations kept.
+
+#
+# Classes
+#
+
+
+class LRUCache(object):
+    """A dictionary of limited size, discarding the least recently used
+    entry when full. Access is serialised by a lock."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entry_dict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, create):
+        """Return the value for key, calling create(key) to make it if it
+        is not in the cache. A value of None is returned but not cached."""
+
+        with self.lock:
+            if key in self.entry_dict:
+                value = self.entry_dict.pop(key)
+                self.entry_dict[key] = value
+                return value
+
+        value = create(key)
+
+        if value is not None:
+            with self.lock:
+                self.entry_dict.pop(key, None)
+                self.entry_dict[key] = value
+                while len(self.entry_dict) > self.max_size:
+                    self.entry_dict.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        """Discard all the entries."""
+
+        with self.lock:
+            self.entry_dict.clear()
+
+    def __len__(self):
+        return len(self.entry_dict)
+
+#
+# Module state
+#
+
+SPATIAL_REF_CACHE = LRUCache(SPATIAL_REF_CACHE_SIZE)
+TRANSFORMATION_CACHE = LRUCache(TRANSFORMATION_CACHE_SIZE)
+
+#
+# Functions
+#
+
+
+def create_spatial_ref(crs):
+    """Return a new spatial reference system for the projection crs, given
+    as WKT or 'EPSG:<code>', or None if it is not recognised."""
+    # pylint: disable=broad-except
+
+    osr.UseExceptions()
+    spatial_ref = osr.SpatialReference()
+    try:
+        spatial_ref.ImportFromWkt(crs)
+        return spatial_ref
+    except Exception:
+        pass
+    try:
+        matchobj = re.match(r'EPSG:(\d+)', crs)
+        epsg_code = int(matchobj.group(1))
+        spatial_ref.ImportFromEPSG(epsg_code)
+        return spatial_ref
+    except Exception:
+        return None
+
+
+def get_spatial_ref(crs):
+    """Return the (shared) spatial reference system for the projection crs,
+    or None if it is not recognised."""
+
+    return SPATIAL_REF_CACHE.get(crs, create_spatial_ref)
+
+
+def get_transformation(source_crs, target_crs):
+    """Return the (shared) coordinate transformation from source_crs to
+    target_crs, or None if either projection is not recognised."""
+
+    return TRANSFORMATION_CACHE.get((source_crs, target_crs),
+                                    _create_transformation)
+
+
+def clear_caches():
+    """Discard all the cached spatial references and transformations."""
+
+    TRANSFORMATION_CACHE.clear()
+    SPATIAL_REF_CACHE.clear()
+
+
+def _create_transformation(crs_pair):
+    """Return a new coordinate transformation for crs_pair, which is
+    (source_crs, target_crs), or None."""
+
+    (source_crs, target_crs) = crs_pair
+    source_spatial_ref = get_spatial_ref(source_crs)
+    target_spatial_ref = get_spatial_ref(target_crs)
+    if source_spatial_ref is None or target_spatial_ref is None:
+        return None
+
+    osr.UseExceptions()
+    return osr.CoordinateTransformation(source_spatial_ref,
+                                        target_spatial_ref)
@@ -41,19 +41,37 @@ format changes.
 import logging
 import os
 import re
-from osgeo import osr
+from multiprocessing.pool import ThreadPool
 from agdc.cube_util import DatasetError, DatasetSkipError
 from ingest_db_wrapper import IngestDBWrapper
 from ingest_db_wrapper import TC_PENDING, TC_SINGLE_SCENE, TC_SUPERSEDED
 from ingest_db_wrapper import TC_MOSAIC
 from mosaic_contents import MosaicContents
+from scene_cutter import SceneCutter
 from tile_record import TileRecord
+import tile_coverage
+import crs_cache
 from math import floor
 
 # Set up logger.
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# Tiling modes (the 'tiling_mode' configuration file item):
+#
+
+TILING_MODE_FOOTPRINT = 'footprint' # Warp each tile footprint separately
+TILING_MODE_SCENE = 'scene' # Warp row strips once and cut the tiles out
+TILING_MODES = (TILING_MODE_FOOTPRINT, TILING_MODE_SCENE)
+
+#
+# Coverage engines (see DatasetRecord.get_touched_tiles):
+#
+
+COVERAGE_ENGINE_NUMPY = 'numpy' # Vectorised, see tile_coverage
+COVERAGE_ENGINE_PYTHON = 'python' # Test each candidate tile in turn
+COVERAGE_ENGINES = (COVERAGE_ENGINE_NUMPY, COVERAGE_ENGINE_PYTHON)
 
 class DatasetRecord(object):
     """DatasetRecord database interface class."""
@@ -74,7 +92,13 @@ class DatasetRecord(object):
                                'xml_text'
                                ]
 
-    def __init__(self, collection, acquisition, dataset):
+    def __init__(self, collection, acquisition, dataset, find_or_create=True):
+        """Set up the dataset record for a dataset.
+
+        If find_or_create is False the dataset_id is not looked up (or
+        created) in the database. It must then be filled in using
+        set_dataset_id (see Collection.catalog_datasets).
+        """
 
         self.collection = collection
         self.datacube = collection.datacube
@@ -94,22 +118,39 @@ class DatasetRecord(object):
         self.dataset_dict['crs'] = self.mdd['projection']
         self.dataset_dict['level_name'] = self.mdd['processing_level']
         self.dataset_dict['level_id'] = \
-            self.db.get_level_id(self.dataset_dict['level_name'])
-
-        self.dataset_dict['dataset_id'] = \
-            self.db.get_dataset_id(self.dataset_dict)
-        if self.dataset_dict['dataset_id'] is None:
-            # create a new dataset record in the database
-            self.dataset_dict['dataset_id'] = \
-                self.db.insert_dataset_record(self.dataset_dict)
+            self.collection.get_level_id(self.dataset_dict['level_name'])
+
+        self.dataset_dict['dataset_id'] = None
+        self.dataset_id = None
+        self.needs_update = None
+
+        if find_or_create:
+            dataset_id = self.db.get_dataset_id(self.dataset_dict)
+            if dataset_id is None:
+                # create a new dataset record in the database
+                dataset_id = self.db.insert_dataset_record(self.dataset_dict)
+                self.set_dataset_id(dataset_id, is_new=True)
+            else:
+                self.set_dataset_id(dataset_id, is_new=False)
+
+    def set_dataset_id(self, dataset_id, is_new):
+        """Set the dataset_id of an existing or newly created record.
+
+        If the record already existed (is_new is False) this checks
+        that it can be updated, raising a DatasetSkipError if not, and
+        sets needs_update.
+        """
+
+        self.dataset_dict['dataset_id'] = dataset_id
+        self.dataset_id = dataset_id
+
+        if is_new:
             self.needs_update = False
         else:
             # check that the old dataset record can be updated
             self.__check_update_ok()
             self.needs_update = True
 
-        self.dataset_id = self.dataset_dict['dataset_id']
-
     def remove_mosaics(self, dataset_filter):
         """Remove mosaics associated with the dataset.
 
@@ -148,11 +189,9 @@ class DatasetRecord(object):
             )
 
         # update tile classes for overlap tiles from other datasets
+        # (Remaining overlaps of two or more tiles are mosaicked again by
+        # create_mosaics once this dataset has been re-tiled.)
         for tile_record_list in overlap_dict.values():
-            if len(tile_record_list) > 2:
-                raise DatasetError("Attempt to update a mosaic of three or " +
-                                   "more datasets. Handling for this case " +
-                                   "is not yet implemented.")
             for tr in tile_record_list:
                 if tr['dataset_id'] != self.dataset_id:
                     self.db.update_tile_class(tr['tile_id'], TC_SINGLE_SCENE)
@@ -196,21 +235,29 @@ class DatasetRecord(object):
         self.db.update_dataset_record(self.dataset_dict)
 
     def make_tiles(self, tile_type_id, band_stack):
-        """Tile the dataset, returning a list of tile_content objects."""
+        """Tile the dataset, returning a list of tile_content objects.
+
+        The tiles are returned in footprint order. Reprojection is done
+        by a pool of threads if the 'tiling_threads' configuration item
+        is greater than one (see reproject_tiles).
+        """
 
-        tile_list = []
         tile_footprint_list = sorted(self.get_coverage(tile_type_id))
         LOGGER.info('%d tile footprints cover dataset', len(tile_footprint_list))
-        
-        for tile_footprint in tile_footprint_list:
-            tile_contents = self.collection.create_tile_contents(
-                tile_type_id,
-                tile_footprint,
-                band_stack
-                )
-            tile_contents.reproject()
-
-            if tile_contents.has_data():
+
+        tile_contents_list = [
+            self.collection.create_tile_contents(tile_type_id,
+                                                 tile_footprint,
+                                                 band_stack)
+            for tile_footprint in tile_footprint_list
+            ]
+
+        has_data_list = self.reproject_tiles(tile_contents_list)
+
+        tile_list = []
+        for (tile_contents, has_data) in zip(tile_contents_list,
+                                             has_data_list):
+            if has_data:
                 tile_list.append(tile_contents)
             else:
                 tile_contents.remove()
@@ -218,19 +265,110 @@ class DatasetRecord(object):
         LOGGER.info('%d non-empty tiles created', len(tile_list))
         return tile_list
 
+    def reproject_tiles(self, tile_contents_list):
+        """Reproject a list of tile_contents and check them for data.
+
+        Returns a list of has_data flags in the same order as
+        tile_contents_list. In the default 'footprint' tiling mode each
+        tile is an independent gdalwarp. In 'scene' tiling mode each
+        contiguous run of tiles in a row is warped once as a strip and
+        the tiles are cut out of it (see SceneCutter). Either way the
+        independent pieces of work are run concurrently on a bounded pool
+        of threads when get_tiling_thread_count is greater than one. If
+        any tile fails, all the temporary tile files are removed (once
+        every reprojection has finished) before the exception is
+        re-raised.
+        """
+
+        try:
+            if self.get_tiling_mode() == TILING_MODE_SCENE:
+                scene_cutter = SceneCutter(tile_contents_list)
+                self.__map_on_threads(scene_cutter.cut_strip,
+                                      scene_cutter.strip_list)
+                has_data_list = self.__map_on_threads(
+                    lambda tile_contents: tile_contents.has_data(),
+                    tile_contents_list)
+            else:
+                has_data_list = self.__map_on_threads(
+                    self.__reproject_and_check, tile_contents_list)
+        except:
+            for tile_contents in tile_contents_list:
+                tile_contents.remove()
+            raise
+
+        return has_data_list
+
+    def __map_on_threads(self, function, arg_list):
+        """Return [function(arg) for arg in arg_list], run on a pool of
+        get_tiling_thread_count threads. All calls finish before any
+        exception is re-raised."""
+
+        thread_count = min(self.get_tiling_thread_count(), len(arg_list))
+        if thread_count <= 1:
+            return [function(arg) for arg in arg_list]
+
+        pool = ThreadPool(thread_count)
+        try:
+            result_list = [pool.apply_async(function, (arg,))
+                           for arg in arg_list]
+            pool.close()
+            pool.join()
+        except:
+            pool.terminate()
+            raise
+        return [result.get() for result in result_list]
+
+    def get_tiling_mode(self):
+        """Return the tiling mode, one of TILING_MODES.
+
+        This is the 'tiling_mode' configuration file item, which defaults
+        to TILING_MODE_FOOTPRINT.
+        """
+
+        # pylint: disable=maybe-no-member
+        tiling_mode = getattr(self.datacube, 'tiling_mode', None)
+        if not tiling_mode:
+            tiling_mode = TILING_MODE_FOOTPRINT
+
+        if tiling_mode not in TILING_MODES:
+            raise AssertionError("Unable to parse the 'tiling_mode' " +
+                                 "configuration file item: '%s'." %
+                                 tiling_mode)
+
+        return tiling_mode
+
+    def get_tiling_thread_count(self):
+        """Return the number of threads to use for reprojecting tiles.
+
+        This is the 'tiling_threads' configuration file item. It defaults
+        to 1 (serial reprojection) if it is not set or cannot be parsed.
+        """
+
+        try:
+            thread_count = int(self.datacube.tiling_threads)
+        except (AttributeError, TypeError, ValueError):
+            thread_count = 1
+
+        return max(1, thread_count)
+
     def store_tiles(self, tile_list):
         """Store tiles in the database and file store.
 
         'tile_list' is a list of tile_contents objects. This
         method will create the corresponding database records and
-        mark tiles for creation when the transaction commits.
+        mark tiles for creation when the transaction commits. The
+        records are written in bulk (see Collection.store_tile_records).
         """
 
         tile_record_list = []
         for tile_contents in tile_list:
-            tile_record = self.create_tile_record(tile_contents)
+            self.collection.mark_tile_for_creation(tile_contents)
+            tile_record = TileRecord(self.collection, self, tile_contents,
+                                     find_or_create=False)
             tile_record_list.append(tile_record)
 
+        self.collection.store_tile_records(tile_record_list)
+
         return tile_record_list
 
     def create_mosaics(self, dataset_filter):
@@ -254,13 +392,24 @@ class DatasetRecord(object):
             dataset_filter=dataset_filter
             )
 
+        # Find existing mosaics, which are replaced if an overlap gains
+        # another tile (e.g. a third scene over an existing mosaic).
+        mosaic_dict = self.db.get_overlapping_tiles_for_dataset(
+            self.dataset_id,
+            input_tile_class_filter=(TC_PENDING,
+                                     TC_SINGLE_SCENE,
+                                     TC_SUPERSEDED),
+            output_tile_class_filter=(TC_MOSAIC,),
+            dataset_filter=dataset_filter
+            )
+
         # Make mosaics and update tile classes as needed.
-        for tile_record_list in overlap_dict.values():
-            if len(tile_record_list) > 2:
-                raise DatasetError("Attempt to create a mosaic of three or " +
-                                   "more datasets. Handling for this case " +
-                                   "is not yet implemented.")
-            elif len(tile_record_list) == 2:
+        for tile_footprint, tile_record_list in overlap_dict.items():
+            if len(tile_record_list) > 1:
+                for tr in mosaic_dict.get(tile_footprint, []):
+                    self.db.remove_tile_record(tr['tile_id'])
+                    self.collection.mark_tile_for_removal(
+                        tr['tile_pathname'])
                 self.__make_one_mosaic(tile_record_list)
                 for tr in tile_record_list:
                     self.db.update_tile_class(tr['tile_id'], TC_SUPERSEDED)
@@ -388,6 +537,13 @@ class DatasetRecord(object):
                 
             raise DatasetSkipError(skip_message)
         
+    @staticmethod
+    def __reproject_and_check(tile_contents):
+        """Reproject a single tile and return True if it has data."""
+
+        tile_contents.reproject()
+        return tile_contents.has_data()
+
     def __make_one_mosaic(self, tile_record_list):
         """Create a single mosaic.
 
@@ -424,19 +580,18 @@ class DatasetRecord(object):
 
     def define_transformation(self, dataset_crs, tile_crs):
         """Return the transformation between dataset_crs
-        and tile_crs projections"""
-        osr.UseExceptions()
+        and tile_crs projections.
+
+        The transformation comes from the crs_cache module, so it is shared
+        with other datasets and tile types using the same projections."""
         try:
-            dataset_spatial_reference = self.create_spatial_ref(dataset_crs)
-            tile_spatial_reference = self.create_spatial_ref(tile_crs)
-            if dataset_spatial_reference is None:
+            if crs_cache.get_spatial_ref(dataset_crs) is None:
                 raise DatasetError('Unknown projecton %s'
                                    % str(dataset_crs))
-            if tile_spatial_reference is None:
+            if crs_cache.get_spatial_ref(tile_crs) is None:
                 raise DatasetError('Unknown projecton %s'
                                    % str(tile_crs))
-            return osr.CoordinateTransformation(dataset_spatial_reference,
-                                                tile_spatial_reference)
+            return crs_cache.get_transformation(dataset_crs, tile_crs)
         except Exception:
             raise DatasetError('Coordinate transformation error ' +
                                'for transforming %s to %s' %
@@ -445,26 +600,10 @@ class DatasetRecord(object):
     @staticmethod
     def create_spatial_ref(crs):
         """Create a spatial reference system for projecton crs.
-        Called by define_transformation()"""
-        # pylint: disable=broad-except
+        Returns None if crs is not recognised. The result is a new object,
+        see crs_cache.get_spatial_ref for the shared, cached version."""
 
-        osr.UseExceptions()
-        try:
-            spatial_ref = osr.SpatialReference()
-        except Exception:
-            raise DatasetError('No spatial reference done for %s' % str(crs))
-        try:
-            spatial_ref.ImportFromWkt(crs)
-            return spatial_ref
-        except Exception:
-            pass
-        try:
-            matchobj = re.match(r'EPSG:(\d+)', crs)
-            epsg_code = int(matchobj.group(1))
-            spatial_ref.ImportFromEPSG(epsg_code)
-            return spatial_ref
-        except Exception:
-            return None
+        return crs_cache.create_spatial_ref(crs)
 
     @staticmethod
     def get_bbox(transform, geotrans, pixels, lines):
@@ -484,24 +623,36 @@ class DatasetRecord(object):
                 geotrans[3] + geotrans[4] * pixels + geotrans[5] * lines, 0)
         return [(xul, yul), (xur, yur), (xlr, ylr), (xll, yll)]
 
-    def get_touched_tiles(self, dataset_bbox, cube_origin, cube_tile_size):
-        """Return a list of tuples (itile, jtile) comprising all tiles
-        footprints that intersect the dataset bounding box"""
+    @staticmethod
+    def get_touched_tiles(dataset_bbox, cube_origin, cube_tile_size,
+                          coverage_engine=COVERAGE_ENGINE_NUMPY):
+        """Return a set of tuples (itile, jtile) comprising all tiles
+        footprints that intersect the dataset bounding box.
+
+        The coverage_engine gives the same result either way: the numpy
+        engine tests all the candidate tiles at once (which is much
+        faster for fine tile grids), the python engine tests them one
+        at a time using the methods below."""
+        if coverage_engine == COVERAGE_ENGINE_NUMPY:
+            return tile_coverage.get_touched_tiles(dataset_bbox,
+                                                   cube_origin,
+                                                   cube_tile_size)
         definite_tiles, possible_tiles = \
-            self.get_definite_and_possible_tiles(dataset_bbox,
-                                                 cube_origin, cube_tile_size)
+            DatasetRecord.get_definite_and_possible_tiles(dataset_bbox,
+                                                          cube_origin,
+                                                          cube_tile_size)
         coverage_set = definite_tiles
         #Check possible tiles:
         #Check if the tile perimeter intersects the dataset bbox perimeter:
         intersected_tiles = \
-            self.get_intersected_tiles(possible_tiles, dataset_bbox,
-                                       cube_origin, cube_tile_size)
+            DatasetRecord.get_intersected_tiles(possible_tiles, dataset_bbox,
+                                                cube_origin, cube_tile_size)
         coverage_set = coverage_set.union(intersected_tiles)
         possible_tiles = possible_tiles.difference(intersected_tiles)
         #Otherwise the tile might be wholly contained in the dataset bbox
         contained_tiles = \
-            self.get_contained_tiles(possible_tiles, dataset_bbox,
-                                     cube_origin, cube_tile_size)
+            DatasetRecord.get_contained_tiles(possible_tiles, dataset_bbox,
+                                              cube_origin, cube_tile_size)
         coverage_set = coverage_set.union(contained_tiles)
         return coverage_set
 
@@ -549,7 +700,8 @@ class DatasetRecord(object):
                               ]).difference(definite_tiles)
         return (definite_tiles, possible_tiles)
 
-    def get_intersected_tiles(self, candidate_tiles, dset_bbox,
+    @staticmethod
+    def get_intersected_tiles(candidate_tiles, dset_bbox,
                               cube_origin, cube_tile_size):
         """Return the subset of candidate_tiles that have an intersection with
         the dataset bounding box"""
@@ -574,7 +726,7 @@ class DatasetRecord(object):
                     xcoords = [x1, x2, x3, x4]
                     ycoords = [y1, y2, y3, y4]
                     intersection_exists = \
-                        self.check_intersection(xcoords, ycoords)
+                        DatasetRecord.check_intersection(xcoords, ycoords)
                     if intersection_exists:
                         keep_list.append((itile, jtile))
                         break
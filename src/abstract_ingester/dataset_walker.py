@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+    dataset_walker.py - streaming search for datasets under a directory.
+
+    walk_datasets generates the paths of the datasets under a source
+    directory as it finds them, so that ingestion can start on the first
+    dataset rather than after the whole tree has been crawled. Directory
+    listings are done ahead of time on a small pool of threads, which
+    hides much of the latency of listing directories on a parallel file
+    system, while the datasets are still generated in a predictable
+    (sorted, depth first) order. Only the next few subdirectories of each
+    directory are listed ahead, so the listings held in memory stay
+    small however wide the tree is.
+
+    The scandir package is used if it is installed, as its directory
+    entries give the file type without a stat call on most file systems.
+"""
+
+import os
+import logging
+from multiprocessing.pool import ThreadPool
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+#
+# Set up logger
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+WALKER_THREADS = 8  # Number of threads used to list directories.
+WALKER_LOOKAHEAD = 16  # Subdirectories listed ahead in each directory.
+
+#
+# Functions
+#
+
+
+def walk_datasets(source_dir, is_dataset_dir=None, is_dataset_file=None,
+                  follow_links=False, threads=WALKER_THREADS,
+                  lookahead=WALKER_LOOKAHEAD):
+    """Generate the paths of the datasets under source_dir.
+
+    is_dataset_dir: function taking the set of entry names in a
+        directory, returning True if the directory is a dataset. Dataset
+        directories are generated and not searched any further.
+    is_dataset_file: function taking a file name, returning True if the
+        file is a dataset.
+    follow_links: search symbolic links to directories if True. Each
+        directory is then searched only once, which avoids link loops.
+    threads: number of threads listing directories ahead of the search.
+    lookahead: number of subdirectories of each directory listed ahead
+        of the search.
+
+    Entries are visited in sorted order within each directory. Paths are
+    generated in absolute form.
+    """
+
+    pool = ThreadPool(threads)
+    try:
+        source_dir = os.path.abspath(source_dir)
+        listing = pool.apply_async(list_directory, (source_dir,))
+        visited = set([os.path.realpath(source_dir)]) if follow_links else None
+        for dataset_path in _walk(pool, source_dir, listing,
+                                  is_dataset_dir, is_dataset_file,
+                                  visited, max(lookahead, 1)):
+            yield dataset_path
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _walk(pool, directory, listing, is_dataset_dir, is_dataset_file,
+          visited, lookahead):
+    """Generate the datasets in directory, given the (asynchronous)
+    listing of the directory, recursively.
+
+    visited is the set of real paths of the directories searched so far
+    if symbolic links are followed, None otherwise. At most lookahead
+    subdirectory listings are outstanding at each level, started in
+    walk order as the subdirectories before them are searched.
+    """
+
+    entry_list = listing.get()
+
+    if is_dataset_dir and is_dataset_dir(set([entry[0]
+                                              for entry in entry_list])):
+        yield directory
+        return
+
+    # Pick the subdirectories to search before searching any of them, so
+    # that a link further down cannot claim a later sibling.
+    subdir_list = []
+    for name, is_dir, is_link in entry_list:
+        if not is_dir:
+            continue
+        subdir = os.path.join(directory, name)
+        if visited is None:
+            if is_link:
+                continue
+        else:
+            real_subdir = os.path.realpath(subdir)
+            if real_subdir in visited:
+                continue
+            visited.add(real_subdir)
+        subdir_list.append(name)
+
+    # List the next few subdirectories ahead of the search.
+    subdir_listing = {}
+    next_subdir = 0
+    for name, is_dir, is_link in entry_list:
+        while (next_subdir < len(subdir_list) and
+               len(subdir_listing) < lookahead):
+            subdir = os.path.join(directory, subdir_list[next_subdir])
+            subdir_listing[subdir_list[next_subdir]] = pool.apply_async(
+                list_directory, (subdir,))
+            next_subdir += 1
+
+        if name in subdir_listing:
+            for dataset_path in _walk(pool, os.path.join(directory, name),
+                                      subdir_listing.pop(name),
+                                      is_dataset_dir, is_dataset_file,
+                                      visited, lookahead):
+                yield dataset_path
+        elif not is_dir and is_dataset_file and is_dataset_file(name):
+            yield os.path.join(directory, name)
+
+
+def list_directory(directory):
+    """Return a sorted list of (name, is_dir, is_link) tuples for the
+    entries in directory.
+
+    is_dir is True for symbolic links to directories. Directories that
+    cannot be listed are logged and treated as empty, as os.walk does.
+    """
+
+    try:
+        if scandir is not None:
+            entry_list = [(entry.name, entry.is_dir(), entry.is_symlink())
+                          for entry in scandir(directory)]
+        else:
+            entry_list = []
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                entry_list.append((name, os.path.isdir(path),
+                                   os.path.islink(path)))
+    except OSError as err:
+        LOGGER.warning('Unable to list directory %s: %s', directory, err)
+        return []
+
+    entry_list.sort()
+    return entry_list
@@ -87,6 +87,37 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
     # This is the +- percentage to match within for fuzzy datetime matches.
     FUZZY_MATCH_PERCENTAGE = 15
 
+    # Columns of the tile table, in the order they are inserted.
+    TILE_COLUMN_LIST = ['tile_id',
+                        'x_index',
+                        'y_index',
+                        'tile_type_id',
+                        'dataset_id',
+                        'tile_pathname',
+                        'tile_class_id',
+                        'tile_size',
+                        'ctime']
+
+    # Columns of the tile_footprint table, in the order they are inserted.
+    TILE_FOOTPRINT_COLUMN_LIST = ['x_index',
+                                  'y_index',
+                                  'tile_type_id',
+                                  'x_min',
+                                  'y_min',
+                                  'x_max',
+                                  'y_max',
+                                  'bbox']
+
+    # SQL for insert_tile_record. Values are taken from the tile_dict,
+    # with keys the same as the column name, except for tile_id, which
+    # is the next value in the tile_id_seq sequence, and ctime.
+    INSERT_TILE_SQL = (
+        "INSERT INTO tile (" + ",\n".join(TILE_COLUMN_LIST) + ")\n" +
+        "VALUES (nextval('tile_id_seq'),\n" +
+        "%(" + ")s,\n%(".join(TILE_COLUMN_LIST[1:-1]) + ")s,\n" +
+        "now())\n" +
+        "RETURNING tile_id;")
+
     #
     # Utility Functions
     #
@@ -172,6 +203,41 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
         self.conn.autocommit = autocommit
         self.conn.set_isolation_level(isolation_level)
 
+    def get_reference_data(self):
+        """Reads the satellite, sensor and processing level tables.
+
+        Returns a tuple of dictionaries (satellite_dict, sensor_dict,
+        level_dict) mapping satellite_tag to satellite_id,
+        (satellite_id, sensor_name) to sensor_id, and level_name to
+        level_id respectively. All three tables are read in a single
+        query."""
+
+        sql = ("SELECT 'satellite', satellite_tag::text, NULL::integer,\n" +
+               "    satellite_id::integer\n" +
+               "FROM satellite\n" +
+               "UNION ALL\n" +
+               "SELECT 'sensor', sensor_name::text, satellite_id::integer,\n" +
+               "    sensor_id::integer\n" +
+               "FROM sensor\n" +
+               "UNION ALL\n" +
+               "SELECT 'level', level_name::text, NULL::integer,\n" +
+               "    level_id::integer\n" +
+               "FROM processing_level;")
+        result = self.execute_sql_multi(sql, None)
+
+        satellite_dict = {}
+        sensor_dict = {}
+        level_dict = {}
+        for (table, name, satellite_id, row_id) in result:
+            if table == 'satellite':
+                satellite_dict[name] = row_id
+            elif table == 'sensor':
+                sensor_dict[(satellite_id, name)] = row_id
+            else:
+                level_dict[name] = row_id
+
+        return (satellite_dict, sensor_dict, level_dict)
+
     def get_satellite_id(self, satellite_tag):
         """Finds a satellite_id in the database.
 
@@ -325,6 +391,120 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
 
         return acquisition_id
 
+    def get_acquisition_ids_fuzzy(self, acquisition_dict_list):
+        """Finds the ids of a list of acquisition records in the database.
+
+        Returns a list of acquisition_ids (or None where no record is
+        found) in the same order as acquisition_dict_list. Each match is
+        the same as for get_acquisition_id_fuzzy, but all the acquisitions
+        are looked up in a single query.
+        """
+
+        if not acquisition_dict_list:
+            return []
+
+        value_list = []
+        params = []
+        for index, acquisition_dict in enumerate(acquisition_dict_list):
+            aq_length = (acquisition_dict['end_datetime'] -
+                         acquisition_dict['start_datetime'])
+            delta = (aq_length*self.FUZZY_MATCH_PERCENTAGE)/100
+            value_list.append("(%s, %s, %s, %s::integer, %s::integer,\n" +
+                              "     %s::timestamp, %s::timestamp, " +
+                              "%s::interval)")
+            params.extend([index,
+                           acquisition_dict['satellite_id'],
+                           acquisition_dict['sensor_id'],
+                           acquisition_dict['x_ref'],
+                           acquisition_dict['y_ref'],
+                           acquisition_dict['start_datetime'],
+                           acquisition_dict['end_datetime'],
+                           delta])
+
+        sql = ("SELECT DISTINCT ON (v.idx) v.idx, a.acquisition_id\n" +
+               "FROM (VALUES\n    " + ",\n    ".join(value_list) + "\n" +
+               "    ) AS v (idx, satellite_id, sensor_id, x_ref, y_ref,\n" +
+               "            start_datetime, end_datetime, delta)\n" +
+               "JOIN acquisition a ON\n" +
+               "    a.satellite_id = v.satellite_id AND\n" +
+               "    a.sensor_id = v.sensor_id AND\n" +
+               "    a.x_ref IS NOT DISTINCT FROM v.x_ref AND\n" +
+               "    a.y_ref IS NOT DISTINCT FROM v.y_ref AND\n" +
+               "    a.start_datetime BETWEEN\n" +
+               "        v.start_datetime - v.delta AND\n" +
+               "        v.start_datetime + v.delta AND\n" +
+               "    a.end_datetime BETWEEN\n" +
+               "        v.end_datetime - v.delta AND\n" +
+               "        v.end_datetime + v.delta\n" +
+               "ORDER BY v.idx, a.acquisition_id;")
+        result = self.execute_sql_multi(sql, params)
+
+        acquisition_id_list = [None] * len(acquisition_dict_list)
+        for (index, acquisition_id) in result:
+            acquisition_id_list[index] = acquisition_id
+
+        return acquisition_id_list
+
+    def insert_acquisition_records(self, acquisition_dict_list):
+        """Creates new acquisition records in the database.
+
+        This is the same as calling insert_acquisition_record for each
+        dictionary in acquisition_dict_list, but uses a single multi-row
+        insert. Returns a list of the new acquisition_ids in the same
+        order as acquisition_dict_list."""
+
+        if not acquisition_dict_list:
+            return []
+
+        acquisition_id_list = self.allocate_ids('acquisition_id_seq',
+                                                len(acquisition_dict_list))
+
+        column_list = ['acquisition_id',
+                       'satellite_id',
+                       'sensor_id',
+                       'x_ref',
+                       'y_ref',
+                       'start_datetime',
+                       'end_datetime',
+                       'll_lon',
+                       'll_lat',
+                       'lr_lon',
+                       'lr_lat',
+                       'ul_lon',
+                       'ul_lat',
+                       'ur_lon',
+                       'ur_lat',
+                       'gcp_count',
+                       'mtl_text'
+                       ]
+        columns = "(" + ",\n".join(column_list) + ")"
+
+        # As for insert_acquisition_record, empty gcp_count or mtl_text
+        # values pick up the column defaults.
+        row_list = []
+        params = []
+        for (acquisition_id, acquisition_dict) in zip(acquisition_id_list,
+                                                      acquisition_dict_list):
+            value_list = []
+            for column in column_list:
+                if column == 'acquisition_id':
+                    value_list.append("%s")
+                    params.append(acquisition_id)
+                elif (column in ('gcp_count', 'mtl_text') and
+                      acquisition_dict[column] is None):
+                    value_list.append("DEFAULT")
+                else:
+                    value_list.append("%s")
+                    params.append(acquisition_dict[column])
+            row_list.append("(" + ", ".join(value_list) + ")")
+
+        sql = ("INSERT INTO acquisition " + columns + "\n" +
+               "VALUES\n" + ",\n".join(row_list) + "\n" +
+               "RETURNING acquisition_id;")
+        self.execute_sql_multi(sql, params)
+
+        return acquisition_id_list
+
     def get_dataset_id(self, dataset_dict):
         """Finds the id of a dataset record in the database.
 
@@ -341,6 +521,30 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
 
         return dataset_id
 
+    def get_dataset_ids(self, dataset_dict_list):
+        """Finds the ids of a list of dataset records in the database.
+
+        Returns a list of dataset_ids (or None where no record is found)
+        in the same order as dataset_dict_list. Each match is the same
+        as for get_dataset_id, but all the datasets are looked up in a
+        single query."""
+
+        if not dataset_dict_list:
+            return []
+
+        key_list = [(dataset_dict['acquisition_id'], dataset_dict['level_id'])
+                    for dataset_dict in dataset_dict_list]
+
+        sql = ("SELECT acquisition_id, level_id, dataset_id FROM dataset\n" +
+               "WHERE (acquisition_id, level_id) IN %s;")
+        result = self.execute_sql_multi(sql, (tuple(key_list),))
+
+        dataset_id_dict = dict(((acquisition_id, level_id), dataset_id)
+                               for (acquisition_id, level_id, dataset_id)
+                               in result)
+
+        return [dataset_id_dict.get(key) for key in key_list]
+
     def dataset_older_than_database(self, dataset_id,
                                     disk_datetime_processed,
                                     tile_class_filter=None):
@@ -439,6 +643,65 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
 
         return dataset_id
 
+    def insert_dataset_records(self, dataset_dict_list):
+        """Creates new dataset records in the database.
+
+        This is the same as calling insert_dataset_record for each
+        dictionary in dataset_dict_list, but uses a single multi-row
+        insert. Returns a list of the new dataset_ids in the same order
+        as dataset_dict_list."""
+
+        if not dataset_dict_list:
+            return []
+
+        dataset_id_list = self.allocate_ids('dataset_id_seq',
+                                            len(dataset_dict_list))
+
+        column_list = ['dataset_id',
+                       'acquisition_id',
+                       'dataset_path',
+                       'level_id',
+                       'datetime_processed',
+                       'dataset_size',
+                       'crs',
+                       'll_x',
+                       'll_y',
+                       'lr_x',
+                       'lr_y',
+                       'ul_x',
+                       'ul_y',
+                       'ur_x',
+                       'ur_y',
+                       'x_pixels',
+                       'y_pixels',
+                       'xml_text']
+        columns = "(" + ",\n".join(column_list) + ")"
+
+        row = "(" + ", ".join(["%s"] * len(column_list)) + ")"
+        params = []
+        for (dataset_id, dataset_dict) in zip(dataset_id_list,
+                                              dataset_dict_list):
+            params.append(dataset_id)
+            params.extend([dataset_dict[column]
+                           for column in column_list[1:]])
+
+        sql = ("INSERT INTO dataset " + columns + "\n" +
+               "VALUES\n" + ",\n".join([row] * len(dataset_dict_list)) +
+               "\n" +
+               "RETURNING dataset_id;")
+        self.execute_sql_multi(sql, params)
+
+        return dataset_id_list
+
+    def allocate_ids(self, sequence_name, count):
+        """Returns a list of 'count' new ids from the sequence
+        'sequence_name', allocated in a single query."""
+
+        sql = ("SELECT nextval(%s) FROM generate_series(1, %s);")
+        result = self.execute_sql_multi(sql, (sequence_name, count))
+
+        return [row[0] for row in result]
+
     def update_dataset_record(self, dataset_dict):
         """Updates an existing dataset record in the database.
 
@@ -527,6 +790,31 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
         tile_id = result[0] if result else None
         return tile_id
 
+    def get_tile_ids(self, tile_dict_list):
+        """Finds the ids of a list of tile records in the database.
+
+        Returns a list of tile_ids (or None where no record is found) in
+        the same order as tile_dict_list. Each match is the same as for
+        get_tile_id, but all the tiles are looked up in a single query."""
+
+        if not tile_dict_list:
+            return []
+
+        key_list = [(tile_dict['dataset_id'],
+                     tile_dict['x_index'],
+                     tile_dict['y_index'],
+                     tile_dict['tile_type_id'])
+                    for tile_dict in tile_dict_list]
+
+        sql = ("SELECT dataset_id, x_index, y_index, tile_type_id, tile_id\n" +
+               "FROM tile\n" +
+               "WHERE (dataset_id, x_index, y_index, tile_type_id) IN %s;")
+        result = self.execute_sql_multi(sql, (tuple(key_list),))
+
+        tile_id_dict = dict((tuple(row[:4]), row[4]) for row in result)
+
+        return [tile_id_dict.get(key) for key in key_list]
+
     def tile_footprint_exists(self, tile_dict):
         """Check the tile footprint table for an existing entry.
 
@@ -543,9 +831,63 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
         footprint_exists = True if result else False
         return footprint_exists
 
+    def get_tile_footprint_keys(self):
+        """Returns a list of the (x_index, y_index, tile_type_id) keys of
+        all the entries in the tile_footprint table."""
+
+        sql = "SELECT x_index, y_index, tile_type_id FROM tile_footprint;"
+        result = self.execute_sql_multi(sql, None)
+
+        return [tuple(row) for row in result]
+
+    def get_sample_tile_pathnames(self, tile_type_id, sample_size):
+        """Returns the pathnames of a random sample of (at most sample_size)
+        single scene and superseded tiles of a tile type."""
+
+        sql = ("SELECT tile_pathname FROM tile\n" +
+               "WHERE tile_type_id = %(tile_type_id)s\n" +
+               "    AND tile_class_id IN %(tile_class_filter)s\n" +
+               "ORDER BY random()\n" +
+               "LIMIT %(sample_size)s;")
+        params = {'tile_type_id': tile_type_id,
+                  'tile_class_filter': (TC_SINGLE_SCENE, TC_SUPERSEDED),
+                  'sample_size': sample_size
+                  }
+        result = self.execute_sql_multi(sql, params)
+
+        return [row[0] for row in result]
+
+    def insert_tile_footprints(self, footprint_dict_list):
+        """Inserts a list of entries into the tile_footprint table.
+
+        This is the same as calling insert_tile_footprint for each
+        dictionary in footprint_dict_list, but uses a single multi-row
+        insert. Entries which already exist are left alone."""
+
+        if not footprint_dict_list:
+            return
+
+        column_list = self.TILE_FOOTPRINT_COLUMN_LIST
+        columns = "(" + ",\n".join(column_list) + ")"
+
+        row = "(" + ", ".join(["%s"] * (len(column_list) - 1)) + ", NULL)"
+        params = []
+        for footprint_dict in footprint_dict_list:
+            params.extend([footprint_dict[column]
+                           for column in column_list[:-1]])
+
+        sql = ("INSERT INTO tile_footprint " + columns + "\n" +
+               "VALUES\n" + ",\n".join([row] * len(footprint_dict_list)) +
+               "\n" +
+               "ON CONFLICT DO NOTHING\n" +
+               "RETURNING x_index;")
+        self.execute_sql_multi(sql, params)
+
     def insert_tile_footprint(self, footprint_dict):
         """Inserts an entry into the tile_footprint table of the database.
 
+        Nothing is inserted if the entry already exists.
+
         TODO: describe how bbox generated.
         """
         # TODO Use Alex's code in email to generate bbox
@@ -571,6 +913,7 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
 
         sql = ("INSERT INTO tile_footprint " + columns + "\n" +
                "VALUES " + values + "\n" +
+               "ON CONFLICT DO NOTHING\n" +
                "RETURNING x_index;")
         self.execute_sql_single(sql, footprint_dict)
 
@@ -580,37 +923,39 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
         The values of the fields in the new record are taken from
         tile_dict. Returns the tile_id of the new record."""
 
-        column_list = ['tile_id',
-                       'x_index',
-                       'y_index',
-                       'tile_type_id',
-                       'dataset_id',
-                       'tile_pathname',
-                       'tile_class_id',
-                       'tile_size',
-                       'ctime']
+        result = self.execute_sql_single(self.INSERT_TILE_SQL, tile_dict)
+        tile_id = result[0]
+        return tile_id
+
+    def insert_tile_records(self, tile_dict_list):
+        """Creates new tile records in the database.
+
+        This is the same as calling insert_tile_record for each
+        dictionary in tile_dict_list, but uses a single multi-row
+        insert. Returns a list of the new tile_ids in the same order as
+        tile_dict_list."""
+
+        if not tile_dict_list:
+            return []
+
+        tile_id_list = self.allocate_ids('tile_id_seq', len(tile_dict_list))
+
+        column_list = self.TILE_COLUMN_LIST
         columns = "(" + ",\n".join(column_list) + ")"
 
-        # Values are taken from the tile_dict, with keys the same
-        # as the column name, except for tile_id, which is the next
-        # value in the dataset_id_seq sequence.
-        value_list = []
-        for column in column_list:
-            if column == 'tile_id':
-                value_list.append("nextval('tile_id_seq')")
-            elif column == 'ctime':
-                value_list.append('now()')
-            else:
-                value_list.append("%(" + column + ")s")
-        values = "(" + ",\n".join(value_list) + ")"
+        # tile_id and values from the tile_dict, then ctime.
+        row = "(" + ", ".join(["%s"] * (len(column_list) - 1)) + ", now())"
+        params = []
+        for (tile_id, tile_dict) in zip(tile_id_list, tile_dict_list):
+            params.append(tile_id)
+            params.extend([tile_dict[column] for column in column_list[1:-1]])
 
         sql = ("INSERT INTO tile " + columns + "\n" +
-               "VALUES " + values + "\n" +
+               "VALUES\n" + ",\n".join([row] * len(tile_dict_list)) + "\n" +
                "RETURNING tile_id;")
+        self.execute_sql_multi(sql, params)
 
-        result = self.execute_sql_single(sql, tile_dict)
-        tile_id = result[0]
-        return tile_id
+        return tile_id_list
 
     def get_overlapping_dataset_ids(self,
                                     dataset_id,
@@ -763,6 +1108,90 @@ class IngestDBWrapper(dbutil.ConnectionWrapper):
 
         return overlap_dict
 
+    def get_pending_overlaps(self, delta_t=ONE_HOUR, dataset_filter=None):
+        """Return the tiles overlapping pending tiles, for all datasets.
+
+        This is the set based equivalent of get_overlapping_tiles_for_dataset
+        for every tile of class TC_PENDING (as left by a deferred mosaic
+        ingest). Returns a list of (pending_tile_id, tile_record) tuples,
+        one for each tile overlapping a pending tile (including the
+        pending tile itself). Each tile record is a dictionary as for
+        get_overlapping_tiles_for_dataset, with extra entries for
+        start_datetime and level_name. Overlapping tiles may be pending,
+        single scene, superseded, or existing mosaics.
+
+        Arguments:
+            delta_t: The tolerance used to detect overlaps in time.
+            dataset_filter: A tuple of dataset_ids. If non-empty, only
+                pending tiles and overlapping tiles from these datasets
+                are included. Used to avoid operating on the tiles of
+                non-locked datasets.
+        """
+
+        sql = ("SELECT DISTINCT t.tile_id, o.tile_id, o.x_index,\n" +
+               "    o.y_index, o.tile_type_id, o.dataset_id,\n" +
+               "    o.tile_pathname, o.tile_class_id, o.tile_size,\n" +
+               "    o.ctime, oa.start_datetime, l.level_name\n" +
+               "FROM tile t\n" +
+               "INNER JOIN dataset d USING (dataset_id)\n" +
+               "INNER JOIN acquisition a USING (acquisition_id)\n" +
+               "INNER JOIN tile o ON\n" +
+               "    o.x_index = t.x_index AND\n" +
+               "    o.y_index = t.y_index AND\n" +
+               "    o.tile_type_id = t.tile_type_id\n" +
+               "INNER JOIN dataset od ON\n" +
+               "    od.dataset_id = o.dataset_id AND\n" +
+               "    od.level_id = d.level_id\n" +
+               "INNER JOIN processing_level l ON\n" +
+               "    l.level_id = od.level_id\n" +
+               "INNER JOIN acquisition oa ON\n" +
+               "    oa.acquisition_id = od.acquisition_id AND\n" +
+               "    oa.satellite_id = a.satellite_id\n" +
+               "WHERE\n" +
+               "    t.tile_class_id = %(pending_tile_class)s\n" +
+               "    AND o.tile_class_id IN %(tile_class_filter)s\n" +
+               ("    AND d.dataset_id IN %(dataset_filter)s\n" +
+                "    AND od.dataset_id IN %(dataset_filter)s\n" if
+                dataset_filter else "") +
+               "    AND (\n" +
+               "        (oa.start_datetime BETWEEN\n" +
+               "         a.start_datetime - %(delta_t)s AND\n" +
+               "         a.end_datetime + %(delta_t)s)\n" +
+               "     OR\n" +
+               "        (oa.end_datetime BETWEEN\n" +
+               "         a.start_datetime - %(delta_t)s AND\n" +
+               "         a.end_datetime + %(delta_t)s)\n" +
+               "    )\n" +
+               "ORDER BY oa.start_datetime;"
+               )
+        params = {'pending_tile_class': TC_PENDING,
+                  'tile_class_filter': (TC_PENDING,
+                                        TC_SINGLE_SCENE,
+                                        TC_SUPERSEDED,
+                                        TC_MOSAIC),
+                  'dataset_filter': tuple(dataset_filter or ()),
+                  'delta_t': delta_t
+                  }
+        result = self.execute_sql_multi(sql, params)
+
+        overlap_list = []
+        for record in result:
+            tile_record = {'tile_id': record[1],
+                           'x_index': record[2],
+                           'y_index': record[3],
+                           'tile_type_id': record[4],
+                           'dataset_id': record[5],
+                           'tile_pathname': record[6],
+                           'tile_class_id': record[7],
+                           'tile_size': record[8],
+                           'ctime': record[9],
+                           'start_datetime': record[10],
+                           'level_name': record[11]
+                           }
+            overlap_list.append((record[0], tile_record))
+
+        return overlap_list
+
     def update_tile_class(self, tile_id, new_tile_class_id):
         """Update the tile_class_id of a tile to a new value."""
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+IngestJournal: persistent record of dataset ingestion outcomes.
+
+The journal is a local SQLite file recording the outcome of ingesting
+each dataset, keyed by the dataset path together with the latest
+modification time and the total size of its files. An ingest run given a
+journal skips datasets that were previously ingested (or skipped as
+already in the database), without opening them, so that restarting a
+large ingest after a failure costs little more than finding the
+datasets. A dataset that has changed since it was journaled (a file
+added, removed or rewritten) is ingested again.
+
+Finding the key walks the dataset tree, so each dataset is also recorded
+with a cheap stamp: the modification times of the dataset directory and
+its immediate subdirectories (scene01 for Landsat), or the mtime and size
+of a plain file dataset. A done dataset whose stamp is unchanged is
+skipped without walking it. Files added, removed or replaced (written
+and renamed into place) change the stamp, but a band file rewritten in
+place does not.
+
+The walk also measures the dataset's size, so the size is recorded in
+the journal too. The size of each dataset to be ingested is handed on
+(see cube_util.set_directory_size_kb) so that the dataset is not walked
+again when it is opened.
+"""
+
+import logging
+import os
+import sqlite3
+import stat
+import threading
+from datetime import datetime
+from agdc.cube_util import DatasetError, scan_directory_tree
+from agdc.cube_util import set_directory_size_kb
+
+# Set up logger.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+JOURNAL_TIMEOUT = 60.0  # Seconds to wait for another process's lock.
+
+# Columns added since the journal was first written, with their types.
+JOURNAL_ADDED_COLUMNS = [('size_kb', 'INTEGER'), ('stamp', 'TEXT')]
+
+
+class IngestJournal(object):
+    """Ingest journal backed by a SQLite file."""
+
+    def __init__(self, journal_path, done_outcomes):
+        """Open (creating if necessary) the journal at journal_path.
+
+        done_outcomes: the outcomes which mean a dataset does not need to
+            be ingested again.
+        """
+
+        self.journal_path = journal_path
+        self.done_outcomes = set(done_outcomes)
+        # Scans (see scan_dataset) of the datasets passed on by
+        # filter_done, by path, for record.
+        self.scan_dict = {}
+        # The journal may be read by the thread feeding datasets to a
+        # worker pool while outcomes are recorded by the main thread.
+        self.connection_lock = threading.Lock()
+        self.connection = sqlite3.connect(journal_path,
+                                          timeout=JOURNAL_TIMEOUT,
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_journal (\n" +
+                "    dataset_path TEXT PRIMARY KEY,\n" +
+                "    mtime REAL NOT NULL,\n" +
+                "    size INTEGER NOT NULL,\n" +
+                "    outcome TEXT NOT NULL,\n" +
+                "    journal_time TEXT NOT NULL,\n" +
+                "    size_kb INTEGER,\n" +
+                "    stamp TEXT\n" +
+                ");"
+                )
+            # Journals written before the columns were added.
+            column_list = [row[1] for row in self.connection.execute(
+                "PRAGMA table_info(ingest_journal);")]
+            for (column, column_type) in JOURNAL_ADDED_COLUMNS:
+                if column not in column_list:
+                    self.connection.execute(
+                        "ALTER TABLE ingest_journal ADD COLUMN %s %s;" %
+                        (column, column_type))
+
+    @staticmethod
+    def get_dataset_key(dataset_path):
+        """Return the (mtime, size) of the dataset, or None if the
+        dataset_path cannot be read.
+
+        A dataset may be a directory tree, whose own mtime and size do
+        not change when a file is rewritten in place, so mtime is the
+        latest modification time of its files and size their total size
+        (see cube_util.scan_directory_tree).
+        """
+
+        scan = IngestJournal.scan_dataset(dataset_path)
+        return scan[0] if scan is not None else None
+
+    @staticmethod
+    def get_dataset_stamp(dataset_path):
+        """Return the stamp of the dataset, as a string, or None if the
+        dataset_path cannot be read.
+
+        The stamp is the mtime of the dataset directory and of each of its
+        immediate subdirectories, or the mtime and size of a plain file.
+        Finding it takes a stat call per entry of the dataset directory,
+        rather than per file in the tree.
+        """
+
+        try:
+            path_stat = os.stat(dataset_path)
+            if not stat.S_ISDIR(path_stat.st_mode):
+                return repr((path_stat.st_mtime, path_stat.st_size))
+
+            subdir_list = []
+            for name in sorted(os.listdir(dataset_path)):
+                entry_stat = os.lstat(os.path.join(dataset_path, name))
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    subdir_list.append((name, entry_stat.st_mtime))
+        except OSError:
+            return None
+        return repr((path_stat.st_mtime, subdir_list))
+
+    @staticmethod
+    def scan_dataset(dataset_path):
+        """Return a tuple ((mtime, size), size_kb, stamp) of the dataset
+        key (see get_dataset_key), its size in kB and its stamp (see
+        get_dataset_stamp), from a single walk of the dataset, or None if
+        the dataset_path cannot be read."""
+
+        # The stamp is taken first, so that a change during the walk is
+        # seen next time.
+        stamp = IngestJournal.get_dataset_stamp(dataset_path)
+        if stamp is None:
+            return None
+        try:
+            (mtime, size, size_kb) = scan_directory_tree(dataset_path)
+        except DatasetError:
+            return None
+        return ((mtime, size), size_kb, stamp)
+
+    def is_done(self, dataset_path):
+        """Return True if the dataset at dataset_path is journaled with a
+        done outcome and has not changed since."""
+
+        return self.__check(dataset_path)[0]
+
+    def filter_done(self, dataset_list):
+        """Generate the datasets in dataset_list (which may be any
+        iterable) that are not done.
+
+        The size of each dataset generated is passed to
+        cube_util.set_directory_size_kb, and its key kept for record.
+        """
+
+        dataset_count = 0
+        done_count = 0
+        for dataset_path in dataset_list:
+            dataset_count += 1
+            (done, scan) = self.__check(dataset_path)
+            if done:
+                done_count += 1
+                continue
+            if scan is not None:
+                with self.connection_lock:
+                    self.scan_dict[dataset_path] = scan
+                set_directory_size_kb(dataset_path, scan[1])
+            yield dataset_path
+
+        LOGGER.info('Ingest journal %s: skipped %d of %d datasets.',
+                    self.journal_path, done_count, dataset_count)
+
+    def record(self, dataset_path, outcome):
+        """Record the outcome of ingesting the dataset at dataset_path."""
+
+        with self.connection_lock:
+            scan = self.scan_dict.pop(dataset_path, None)
+        if scan is None:
+            scan = self.scan_dataset(dataset_path)
+        if scan is None:
+            return
+        ((mtime, size), size_kb, stamp) = scan
+
+        with self.connection_lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO ingest_journal\n" +
+                    "    (dataset_path, mtime, size, outcome,\n" +
+                    "     journal_time, size_kb, stamp)\n" +
+                    "VALUES (?, ?, ?, ?, ?, ?, ?);",
+                    (dataset_path, mtime, size, outcome,
+                     datetime.now().isoformat(), size_kb, stamp)
+                    )
+
+    def __check(self, dataset_path):
+        """Return a tuple (done, scan): done is True if the dataset is
+        journaled with a done outcome and has not changed since, and scan
+        is as returned by scan_dataset, or None if the dataset was not
+        walked.
+
+        A done dataset with an unchanged stamp is not walked. Otherwise
+        the dataset is walked and its key compared; if only the stamp has
+        changed the new stamp is journaled, and the size of an unchanged
+        dataset is taken from the journal.
+        """
+
+        with self.connection_lock:
+            row = self.connection.execute(
+                "SELECT mtime, size, outcome, size_kb, stamp\n" +
+                "FROM ingest_journal\n" +
+                "WHERE dataset_path = ?;",
+                (dataset_path,)
+                ).fetchone()
+
+        if (row is not None and row[2] in self.done_outcomes and
+                row[4] is not None and
+                row[4] == self.get_dataset_stamp(dataset_path)):
+            return (True, None)
+
+        scan = self.scan_dataset(dataset_path)
+        if scan is None:
+            return (False, None)
+
+        if row is None or (row[0], row[1]) != scan[0]:
+            return (False, scan)
+        if row[4] != scan[2]:
+            with self.connection_lock:
+                with self.connection:
+                    self.connection.execute(
+                        "UPDATE ingest_journal SET stamp = ?\n" +
+                        "WHERE dataset_path = ?;",
+                        (scan[2], dataset_path)
+                        )
+        if row[3] is not None:
+            scan = (scan[0], row[3], scan[2])
+        return (row[2] in self.done_outcomes, scan)
+
+    def close(self):
+        """Close the journal."""
+
+        with self.connection_lock:
+            self.connection.close()
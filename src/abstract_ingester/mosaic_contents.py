@@ -41,11 +41,11 @@ format changes.
 import logging
 import os
 import re
-import shutil
-from EOtools.execute import execute
-from EOtools.utils import log_multiline
 from agdc.cube_util import DatasetError, get_file_size_mb, create_directory
+from agdc.vrt_writer import write_vrt
 from ingest_db_wrapper import TC_MOSAIC
+from tile_mover import promote_file
+from tile_contents import parse_format_options, build_overviews
 from osgeo import gdal
 import numpy
 
@@ -59,6 +59,49 @@ LOGGER.setLevel(logging.INFO)
 
 PQA_CONTIGUITY = 256  # contiguity = bit 8
 
+#
+# Minimum number of pixels per block in the PQA mosaic merge:
+#
+
+MOSAIC_MIN_PIXELS = 256 * 256
+
+#
+# Functions
+#
+
+
+def merge_pqa_blocks(pqa_block_list, dtype):
+    """Merge corresponding blocks of any number of PQA tiles.
+
+    Contiguous pixels are combined with a bitwise-and, so a test only
+    passes in the mosaic if it passes in every tile with data. Pixels
+    that are not contiguous in any tile are combined with a bitwise-or
+    (which should reproduce the original no-data values). Returns the
+    merged block.
+    """
+
+    block_shape = pqa_block_list[0].shape
+    # Set all background values of data_array to all ones
+    data_array = numpy.invert(numpy.zeros(block_shape, dtype=dtype))
+    # Set all background values of no_data_array to all zeroes
+    no_data_array = numpy.zeros(block_shape, dtype=dtype)
+    overall_data_mask = numpy.zeros(block_shape, dtype=numpy.bool)
+
+    for pqa_array in pqa_block_list:
+        # Treat contiguous and non-contiguous pixels separately
+        pqa_data_mask = (pqa_array & PQA_CONTIGUITY).astype(numpy.bool)
+        # Expand overall_data_mask to true for any contiguous pixels
+        overall_data_mask |= pqa_data_mask
+        # Perform bitwise-and on contiguous pixels in data_array
+        data_array[pqa_data_mask] &= pqa_array[pqa_data_mask]
+        # Perform bitwise-or on non-contiguous pixels in no_data_array
+        no_data_array[~pqa_data_mask] |= pqa_array[~pqa_data_mask]
+
+    # Set all pixels which don't contain data to combined no-data values
+    data_array[~overall_data_mask] = no_data_array[~overall_data_mask]
+
+    return data_array
+
 #
 # Classes
 #
@@ -78,9 +121,6 @@ class MosaicContents(object):
 
         assert len(tile_record_list) > 1, \
             "Attempt to make a mosaic out of a single tile."
-        assert len(tile_record_list) <= 2, \
-            ("Attempt to make a mosaic out of more than 2 tiles.\n" +
-             "Handling for this case is not yet implemented.")
 
         tile_dict = tile_record_list[0]
         tile_type_id = tile_dict['tile_type_id']
@@ -111,15 +151,31 @@ class MosaicContents(object):
         self.mosaic_dict['tile_size'] = (
             get_file_size_mb(self.mosaic_temp_path))
 
+        self.promotion = None
+
     def remove(self):
         """Remove the temporary mosaic file."""
+        if self.promotion:
+            self.promotion.cancel()
+            self.promotion = None
         if os.path.isfile(self.mosaic_temp_path):
             os.remove(self.mosaic_temp_path)
 
+    def start_promotion(self, tile_mover):
+        """Start copying the mosaic towards its permanent location in the
+        background (see TileContents.start_promotion)."""
+
+        self.promotion = tile_mover.start(self.mosaic_temp_path,
+                                          self.mosaic_final_path)
+
     def make_permanent(self):
         """Move mosaic tile contents to its permanent location."""
 
-        shutil.move(self.mosaic_temp_path, self.mosaic_final_path)
+        if self.promotion:
+            self.promotion.finish()
+            self.promotion = None
+        else:
+            promote_file(self.mosaic_temp_path, self.mosaic_final_path)
 
     def get_output_path(self):
         """Return the final location for the mosaic."""
@@ -173,13 +229,16 @@ class MosaicContents(object):
         gdal_dtype = template_dataset.GetRasterBand(1).DataType
         numpy_dtype = gdal.GetDataTypeName(gdal_dtype)
 
+        (creation_option_list, dummy_overview_list, dummy_resampling) = \
+            parse_format_options(tile_type_info['format_options'])
+
         mosaic_dataset = gdal_driver.Create(
             mosaic_path,
             template_dataset.RasterXSize,
             template_dataset.RasterYSize,
             1,
             gdal_dtype,
-            tile_type_info['format_options'].split(','),
+            creation_option_list,
             )
 
         if not mosaic_dataset:
@@ -194,48 +253,46 @@ class MosaicContents(object):
         #     pass
 
         output_band = mosaic_dataset.GetRasterBand(1)
-        # Set all background values of data_array to FFFF (i.e. all ones)
-        data_array = numpy.ones(shape=(template_dataset.RasterYSize,
-                                       template_dataset.RasterXSize),
-                                dtype=numpy_dtype
-                                ) * -1
-        # Set all background values of no_data_array to 0 (i.e. all zeroes)
-        no_data_array = numpy.zeros(shape=(template_dataset.RasterYSize,
-                                           template_dataset.RasterXSize),
-                                    dtype=numpy_dtype
-                                    )
-        overall_data_mask = numpy.zeros((mosaic_dataset.RasterYSize,
-                                         mosaic_dataset.RasterXSize),
-                                        dtype=numpy.bool
-                                        )
-        del template_dataset
 
-        # Populate data_array with -masked PQA data
-        for pqa_dataset_index in range(len(mosaic_file_list)):
-            pqa_dataset_path = mosaic_file_list[pqa_dataset_index]
+        # Open all the source tiles up front so that each block can be
+        # merged across all of them in one pass.
+        pqa_dataset_list = []
+        for pqa_dataset_path in mosaic_file_list:
             pqa_dataset = gdal.Open(pqa_dataset_path)
             if not pqa_dataset:
                 raise DatasetError('Unable to open %s' % pqa_dataset_path)
-            pqa_array = pqa_dataset.ReadAsArray()
-            del pqa_dataset
             LOGGER.debug('Opened %s', pqa_dataset_path)
+            pqa_dataset_list.append(pqa_dataset)
+        pqa_band_list = [ds.GetRasterBand(1) for ds in pqa_dataset_list]
+
+        # Merge block by block so that memory use depends on the block
+        # size rather than the tile size. Blocks are assumed to be aligned
+        # the same way for all source tiles. Small blocks (e.g. single-row
+        # strips) are read a few at a time to limit the per-read overhead.
+        x_size = template_dataset.RasterXSize
+        y_size = template_dataset.RasterYSize
+        block_x_size, block_y_size = pqa_band_list[0].GetBlockSize()
+        block_y_size *= max(1, MOSAIC_MIN_PIXELS //
+                            (block_x_size * block_y_size))
+        del template_dataset
 
-            # Treat contiguous and non-contiguous pixels separately
-            # Set all contiguous pixels to true in data_mask
-            pqa_data_mask = (pqa_array & PQA_CONTIGUITY).astype(numpy.bool)
-            # Expand overall_data_mask to true for any contiguous pixels
-            overall_data_mask = overall_data_mask | pqa_data_mask
-            # Perform bitwise-and on contiguous pixels in data_array
-            data_array[pqa_data_mask] &= pqa_array[pqa_data_mask]
-            # Perform bitwise-or on non-contiguous pixels in no_data_array
-            no_data_array[~pqa_data_mask] |= pqa_array[~pqa_data_mask]
-
-        # Set all pixels which don't contain data to combined no-data values
-        # (should be same as original no-data values)
-        data_array[~overall_data_mask] = no_data_array[~overall_data_mask]
-
-        output_band.WriteArray(data_array)
+        for y_offset in range(0, y_size, block_y_size):
+            block_rows = min(block_y_size, y_size - y_offset)
+            for x_offset in range(0, x_size, block_x_size):
+                block_cols = min(block_x_size, x_size - x_offset)
+                pqa_block_list = [band.ReadAsArray(x_offset, y_offset,
+                                                   block_cols, block_rows)
+                                  for band in pqa_band_list]
+                data_block = merge_pqa_blocks(pqa_block_list, numpy_dtype)
+                output_band.WriteArray(data_block, x_offset, y_offset)
+
+        del pqa_band_list
+        del pqa_dataset_list
         mosaic_dataset.FlushCache()
+        del output_band
+        del mosaic_dataset
+
+        build_overviews(mosaic_path, tile_type_info['format_options'])
 
     @staticmethod
     def __make_mosaic_vrt(tile_record_list, mosaic_path):
@@ -245,24 +302,4 @@ class MosaicContents(object):
 
         source_file_list = [tr['tile_pathname'] for tr in tile_record_list]
 
-        gdalbuildvrt_cmd = ["gdalbuildvrt",
-                            "-q",
-                            "-overwrite",
-                            "%s" % mosaic_path
-                            ]
-        gdalbuildvrt_cmd.extend(source_file_list)
-
-        result = execute(gdalbuildvrt_cmd, shell=False)
-
-        if result['stdout']:
-            log_multiline(LOGGER.info, result['stdout'],
-                                    'stdout from %s' % gdalbuildvrt_cmd, '\t')
-
-        if result['stderr']:
-            log_multiline(LOGGER.debug, result['stderr'],
-                                    'stderr from %s' % gdalbuildvrt_cmd, '\t')
-
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to perform gdalbuildvrt: ' +
-                               '"%s" failed: %s'
-                               % (gdalbuildvrt_cmd, result['stderr']))
+        write_vrt(mosaic_path, source_file_list)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+SceneCutter: single-read tiling of a scene.
+
+Reprojecting each tile footprint separately reads the overlapping parts
+of the source scene once per tile (plus the resampling margin at every
+tile edge). The SceneCutter instead warps each contiguous run of tiles in
+a row of the tile grid as a single strip, then cuts the individual tiles
+out of the strip, so that each part of the source band stack is read
+roughly once per tile type.
+"""
+
+import logging
+import os
+from itertools import groupby
+
+# Set up logger.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Format used for the intermediate strips. These are temporary, so are
+# left uncompressed (and may be larger than 4GB for wide scenes).
+#
+
+STRIP_FILE_FORMAT = 'GTiff'
+STRIP_FORMAT_SPEC = ['-co', 'BIGTIFF=IF_SAFER']
+
+
+class SceneCutter(object):
+    """Cuts a list of tile contents for one tile type out of row strips."""
+
+    def __init__(self, tile_contents_list):
+        """Group the tile contents into strips.
+
+        All the tile contents must share a band stack and tile type. Each
+        strip is a list of tile contents with the same y_index and
+        consecutive x_indexes, sorted by x_index.
+        """
+
+        self.strip_list = []
+
+        tile_contents_list = sorted(
+            tile_contents_list,
+            key=lambda tile_contents: (tile_contents.tile_footprint[1],
+                                       tile_contents.tile_footprint[0])
+            )
+        for _, row in groupby(tile_contents_list,
+                              lambda tile_contents:
+                                  tile_contents.tile_footprint[1]):
+            strip = []
+            for tile_contents in row:
+                if (strip and tile_contents.tile_footprint[0] !=
+                        strip[-1].tile_footprint[0] + 1):
+                    self.strip_list.append(strip)
+                    strip = []
+                strip.append(tile_contents)
+            self.strip_list.append(strip)
+
+    @staticmethod
+    def cut_strip(strip):
+        """Warp a strip once and cut its tiles out of it.
+
+        The strip file is written next to the band stack vrt (where the
+        temporary tiles go) and is removed once the tiles have been cut,
+        whether or not this succeeds.
+        """
+
+        first_tile = strip[0]
+        last_tile = strip[-1]
+        tile_type_info = first_tile.tile_type_info
+
+        first_extents = first_tile.get_tile_extents()
+        last_extents = last_tile.get_tile_extents()
+        strip_extents = (first_extents[0], first_extents[1],
+                         last_extents[2], last_extents[3])
+
+        strip_path = os.path.join(
+            os.path.dirname(first_tile.band_stack.vrt_name),
+            'strip_%d_%+04d_%+04d_%+04d.tif' % (first_tile.tile_type_id,
+                                                 first_tile.tile_footprint[0],
+                                                 last_tile.tile_footprint[0],
+                                                 first_tile.tile_footprint[1])
+            )
+
+        LOGGER.info('Performing gdalwarp for strip of %d tiles %s to %s',
+                    len(strip), first_tile.tile_footprint,
+                    last_tile.tile_footprint)
+
+        try:
+            first_tile.warp(strip_extents, strip_path,
+                            STRIP_FILE_FORMAT, STRIP_FORMAT_SPEC)
+
+            for tile_index, tile_contents in enumerate(strip):
+                tile_contents.cut_from_strip(
+                    strip_path, tile_index * tile_type_info['x_pixels'])
+        finally:
+            if os.path.isfile(strip_path):
+                os.remove(strip_path)
@@ -38,13 +38,14 @@ particular dataset, but will change if the database schema or tile store
 format changes.
 """
 
-import shutil
 import logging
 import os
 import re
 from EOtools.execute import execute
 from EOtools.utils import log_multiline
 from agdc.cube_util import DatasetError, create_directory
+from agdc.vrt_writer import write_vrt
+from tile_mover import promote_file
 from osgeo import gdal
 import numpy as np
 from datetime import datetime
@@ -59,14 +60,111 @@ LOGGER.setLevel(logging.INFO)
 
 PQA_CONTIGUITY = 256  # contiguity = bit 8
 
+#
+# Minimum number of pixels per read in the has_data scan:
+#
+
+SCAN_MIN_PIXELS = 256 * 256
+
+#
+# Warp engines used by TileContents.reproject ('warp_engine' config item):
+#
+
+WARP_ENGINE_SUBPROCESS = 'gdalwarp'  # Run the gdalwarp command.
+WARP_ENGINE_IN_PROCESS = 'gdal'  # Use the GDAL python warp API (GDAL >= 2.1).
+WARP_ENGINES = (WARP_ENGINE_SUBPROCESS, WARP_ENGINE_IN_PROCESS)
+
+#
+# Tile type format_options which are not GDAL creation options (see
+# parse_format_options). For example 'OVERVIEWS=2:4:8' builds internal
+# overviews at those levels once the tile is written.
+#
+
+FORMAT_OPTION_OVERVIEWS = 'OVERVIEWS'
+FORMAT_OPTION_OVERVIEW_RESAMPLING = 'OVERVIEW_RESAMPLING'
+DEFAULT_OVERVIEW_RESAMPLING = 'NEAREST'
+
+#
+# Functions
+#
+
+
+def parse_format_options(format_options):
+    """Parse the format_options of a tile type.
+
+    format_options is a comma separated list of GDAL creation options
+    (e.g. 'TILED=YES,BLOCKXSIZE=512,BLOCKYSIZE=512,COMPRESS=DEFLATE,
+    PREDICTOR=2'), which may also include the OVERVIEWS and
+    OVERVIEW_RESAMPLING options. Returns a tuple (creation_option_list,
+    overview_list, overview_resampling), where overview_list is a
+    (possibly empty) list of overview levels. Raises DatasetError if the
+    OVERVIEWS levels are not integers.
+    """
+
+    creation_option_list = []
+    overview_list = []
+    overview_resampling = DEFAULT_OVERVIEW_RESAMPLING
+    for format_option in (format_options or '').split(','):
+        format_option = format_option.strip()
+        if not format_option:
+            continue
+        (key, dummy_sep, value) = format_option.partition('=')
+        key = key.strip().upper()
+        if key == FORMAT_OPTION_OVERVIEWS:
+            try:
+                overview_list = [int(level) for level in value.split(':')]
+            except ValueError:
+                raise DatasetError("Unable to parse the tile type " +
+                                   "format option '%s'." % format_option)
+        elif key == FORMAT_OPTION_OVERVIEW_RESAMPLING:
+            overview_resampling = value.strip().upper()
+        else:
+            creation_option_list.append(format_option)
+
+    return (creation_option_list, overview_list, overview_resampling)
+
+
+def build_overviews(tile_path, format_options):
+    """Add internal overviews to the tile at tile_path, if format_options
+    (see parse_format_options) asks for them.
+
+    The overviews are compressed in the same way as the tile itself.
+    """
+
+    (dummy_option_list, overview_list, overview_resampling) = \
+        parse_format_options(format_options)
+    if not overview_list:
+        return
+
+    tile_dataset = gdal.Open(tile_path, gdal.GA_Update)
+    if not tile_dataset:
+        raise DatasetError('Unable to open %s to build overviews.' %
+                           tile_path)
+    result = tile_dataset.BuildOverviews(overview_resampling, overview_list)
+    tile_dataset = None # Close to flush the overviews to disk
+    if result != 0:
+        raise DatasetError('Unable to build overviews for %s: %s' %
+                           (tile_path, gdal.GetLastErrorMsg()))
+
+#
+# Classes
+#
+
 
 class TileContents(object):
     """TileContents database interface class."""
     # pylint: disable=too-many-instance-attributes
     def __init__(self, tile_root, tile_type_info,
-                 tile_footprint, band_stack):
+                 tile_footprint, band_stack,
+                 warp_engine=WARP_ENGINE_SUBPROCESS):
         """Set the tile_footprint over which we want to resample this dataset.
+
+        warp_engine selects how reproject does the warp, and should be
+        one of WARP_ENGINES.
         """
+        assert warp_engine in WARP_ENGINES, \
+            "Unknown warp engine '%s'." % warp_engine
+        self.warp_engine = warp_engine
         self.tile_type_id = tile_type_info['tile_type_id']
         self.tile_type_info = tile_type_info
         self.tile_footprint = tile_footprint
@@ -108,6 +206,10 @@ class TileContents(object):
             os.path.basename(self.tile_output_path)
             )
         self.tile_extents = None
+        # Bytes read by the last has_data scan
+        self.scan_bytes_read = None
+        # Background move to the tile store (see start_promotion)
+        self.promotion = None
         
         # Work-around to allow existing GDAL code to work with netCDF subdatasets as band stacks
         # N.B: file_extension must be set to ".vrt" when used with netCDF
@@ -127,31 +229,138 @@ class TileContents(object):
         nc_abs_path = os.path.abspath(nc_path)
         vrt_abs_path = os.path.abspath(vrt_path)
         
-        # Create VRT file using absolute pathnames
-        nc2vrt_cmd = "gdalbuildvrt -separate -allow_projection_difference -overwrite %s %s" % (vrt_abs_path, nc_abs_path)
-        LOGGER.debug('nc2vrt_cmd = %s', nc2vrt_cmd)
-        result = execute(nc2vrt_cmd) #, shell=False)
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to perform gdalbuildvrt: ' +
-                               '"%s" failed: %s' % (nc2vrt_cmd,
-                                                    result['stderr']))
+        # Stack the subdatasets (or the bands of a single variable) using
+        # absolute pathnames, as gdalbuildvrt -separate would
+        nc_dataset = gdal.Open(nc_abs_path)
+        if nc_dataset is None:
+            raise DatasetError('Unable to open %s' % nc_abs_path)
+        source_list = [subdataset_name for subdataset_name, _
+                       in nc_dataset.GetSubDatasets()]
+        if not source_list or nc_dataset.RasterCount:
+            source_list = [nc_abs_path]
+        del nc_dataset
+
+        LOGGER.debug('Writing VRT %s for %s', vrt_abs_path, source_list)
+        write_vrt(vrt_abs_path, source_list, separate=True,
+                  allow_projection_difference=True)
             
     
     def reproject(self):
         """Reproject the scene dataset into tile coordinate reference system
-        and extent. This method uses gdalwarp to do the reprojection."""
-        # pylint: disable=too-many-locals
+        and extent. This method uses gdalwarp to do the reprojection, either
+        as a subprocess or in-process, depending on self.warp_engine. Both
+        are given the same gdalwarp arguments, so produce the same tile."""
+        # Make the tile_extents visible to tile_record
+        self.tile_extents = self.get_tile_extents()
+
+        # Work-around to allow existing code to work with netCDF subdatasets as GDAL band stacks
+        temp_tile_output_path = self.nc_temp_tile_output_path or self.temp_tile_output_path
+
+        LOGGER.info('Performing gdalwarp for tile %s', self.tile_footprint)
+
+        # Use locally-defined output path, not class instance value
+        self.warp(self.tile_extents,
+                  temp_tile_output_path,
+                  self.tile_type_info['file_format'],
+                  self.get_format_spec())
+
+        # Work-around to allow existing code to work with netCDF subdatasets as GDAL band stacks
+        if self.nc_temp_tile_output_path:
+            self.nc2vrt(self.nc_temp_tile_output_path, self.temp_tile_output_path)
+        else:
+            build_overviews(self.temp_tile_output_path,
+                            self.tile_type_info['format_options'])
+
+    def cut_from_strip(self, strip_path, x_offset):
+        """Create the tile by copying its window out of a reprojected strip.
+
+        The strip (see scene_cutter.SceneCutter) has already been warped
+        onto the tile grid, so the tile is a straight copy of the
+        tile-sized window starting 'x_offset' pixels from the left edge of
+        the strip, written with the tile type's format and options.
+        """
+
+        self.tile_extents = self.get_tile_extents()
+
+        temp_tile_output_path = self.nc_temp_tile_output_path or self.temp_tile_output_path
+
+        LOGGER.info('Cutting tile %s from strip', self.tile_footprint)
+
+        translate_options = ["-q",
+                             "-of",
+                             "%s" % self.tile_type_info['file_format'],
+                             "-srcwin",
+                             "%d" % x_offset,
+                             "0",
+                             "%d" % self.tile_type_info['x_pixels'],
+                             "%d" % self.tile_type_info['y_pixels']
+                             ]
+        translate_options.extend(self.get_format_spec())
+
+        if self.warp_engine == WARP_ENGINE_IN_PROCESS:
+            gdal.PushErrorHandler('CPLQuietErrorHandler')
+            try:
+                gdal.ErrorReset()
+                tile_dataset = gdal.Translate(temp_tile_output_path,
+                                              strip_path,
+                                              options=translate_options)
+                error_message = (gdal.GetLastErrorMsg() or 'Unknown error'
+                                 if tile_dataset is None else None)
+                tile_dataset = None # Close to flush the tile to disk
+            finally:
+                gdal.PopErrorHandler()
+        else:
+            translate_cmd = ["gdal_translate"]
+            translate_cmd.extend(translate_options)
+            translate_cmd.extend([strip_path, temp_tile_output_path])
+            result = execute(translate_cmd, shell=False)
+            error_message = result['stderr'] if result['returncode'] else None
+
+        if error_message is not None:
+            raise DatasetError('Unable to cut tile %s from strip %s: %s' %
+                               (self.tile_footprint, strip_path,
+                                error_message))
+
+        if self.nc_temp_tile_output_path:
+            self.nc2vrt(self.nc_temp_tile_output_path, self.temp_tile_output_path)
+        else:
+            build_overviews(self.temp_tile_output_path,
+                            self.tile_type_info['format_options'])
+
+    def get_tile_extents(self):
+        """Return the extents (xmin, ymin, xmax, ymax) of the tile footprint
+        in the tile coordinate reference system."""
+
         x_origin = self.tile_type_info['x_origin']
         y_origin = self.tile_type_info['y_origin']
         x_size = self.tile_type_info['x_size']
         y_size = self.tile_type_info['y_size']
-        x_pixel_size = self.tile_type_info['x_pixel_size']
-        y_pixel_size = self.tile_type_info['y_pixel_size']
         x0 = x_origin + self.tile_footprint[0] * x_size
         y0 = y_origin + self.tile_footprint[1] * y_size
-        tile_extents = (x0, y0, x0 + x_size, y0 + y_size)
-        # Make the tile_extents visible to tile_record
-        self.tile_extents = tile_extents
+        return (x0, y0, x0 + x_size, y0 + y_size)
+
+    def get_format_spec(self):
+        """Return the tile type's creation options as gdal '-co' arguments."""
+
+        (creation_option_list, dummy_overview_list, dummy_resampling) = \
+            parse_format_options(self.tile_type_info['format_options'])
+
+        format_spec = []
+        for format_option in creation_option_list:
+            format_spec.extend(["-co", "%s" % format_option])
+        return format_spec
+
+    def warp(self, extents, output_path, file_format, format_spec):
+        """Warp the band stack onto the tile grid over 'extents'.
+
+        'extents' is (xmin, ymin, xmax, ymax) in the tile coordinate
+        reference system; it is usually the tile extents, but may span
+        several tiles (see cut_from_strip). The output is written to
+        output_path in file_format with the gdal '-co' arguments in
+        format_spec.
+        """
+        x_pixel_size = self.tile_type_info['x_pixel_size']
+        y_pixel_size = self.tile_type_info['y_pixel_size']
         nodata_value = self.band_stack.nodata_list[0]
         #Assume resampling method is the same for all bands, this is
         #because resampling_method is per proessing_level
@@ -170,42 +379,48 @@ class TileContents(object):
                            ]
         else:
             nodata_spec = []
-        format_spec = []
-        for format_option in self.tile_type_info['format_options'].split(','):
-            format_spec.extend(["-co", "%s" % format_option])
-            
-        # Work-around to allow existing code to work with netCDF subdatasets as GDAL band stacks
-        temp_tile_output_path = self.nc_temp_tile_output_path or self.temp_tile_output_path
 
-        
-        reproject_cmd = ["gdalwarp",
-                         "-q",
-                         "-of",
-                         "%s" % self.tile_type_info['file_format'],
-                         "-t_srs",
-                         "%s" % self.tile_type_info['crs'],
-                         "-te",
-                         "%f" % tile_extents[0],
-                         "%f" % tile_extents[1],
-                         "%f" % tile_extents[2],
-                         "%f" % tile_extents[3],
-                         "-tr",
-                         "%f" % x_pixel_size,
-                         "%f" % y_pixel_size,
-                         "-tap",
-                         "-tap",
-                         "-r",
-                         "%s" % resampling_method,
-                         ]
-        reproject_cmd.extend(nodata_spec)
-        reproject_cmd.extend(format_spec)
-        reproject_cmd.extend(["-overwrite",
-                              "%s" % self.band_stack.vrt_name,
-                              "%s" % temp_tile_output_path # Use locally-defined output path, not class instance value
+        warp_options = ["-q",
+                        "-of",
+                        "%s" % file_format,
+                        "-t_srs",
+                        "%s" % self.tile_type_info['crs'],
+                        "-te",
+                        "%f" % extents[0],
+                        "%f" % extents[1],
+                        "%f" % extents[2],
+                        "%f" % extents[3],
+                        "-tr",
+                        "%f" % x_pixel_size,
+                        "%f" % y_pixel_size,
+                        "-tap",
+                        "-tap",
+                        "-r",
+                        "%s" % resampling_method,
+                        ]
+        warp_options.extend(nodata_spec)
+        warp_options.extend(format_spec)
+        warp_options.append("-overwrite")
+
+        if self.warp_engine == WARP_ENGINE_IN_PROCESS:
+            self.__warp_in_process(warp_options, file_format, format_spec,
+                                   output_path)
+        else:
+            self.__warp_subprocess(warp_options, file_format, format_spec,
+                                   output_path)
+
+    def __warp_subprocess(self, warp_options, file_format, format_spec,
+                          temp_tile_output_path):
+        """Warp the band stack to temp_tile_output_path using the gdalwarp
+        command."""
+
+        reproject_cmd = ["gdalwarp"]
+        reproject_cmd.extend(warp_options)
+        reproject_cmd.extend(["%s" % self.band_stack.vrt_name,
+                              "%s" % temp_tile_output_path
                               ])
         
         command_string = ' '.join(reproject_cmd)
-        LOGGER.info('Performing gdalwarp for tile %s', self.tile_footprint)
         retry=True
         while retry:
             LOGGER.debug('command_string = %s', command_string)
@@ -221,7 +436,7 @@ class TileContents(object):
 
                 # Work-around for gdalwarp error writing LZW-compressed GeoTIFFs 
                 if (result['stderr'].find('LZW') > -1 # LZW-related error
-                    and self.tile_type_info['file_format'] == 'GTiff' # Output format is GeoTIFF
+                    and file_format == 'GTiff' # Output format is GeoTIFF
                     and 'COMPRESS=LZW' in format_spec): # LZW compression requested
                         
                     uncompressed_tile_path = temp_tile_output_path + '.tmp'
@@ -246,16 +461,97 @@ class TileContents(object):
 
             else:
                 retry = False # No retry on success
-        
-        # Work-around to allow existing code to work with netCDF subdatasets as GDAL band stacks
-        if self.nc_temp_tile_output_path:
-            self.nc2vrt(self.nc_temp_tile_output_path, self.temp_tile_output_path)
-        
+
+    def __warp_in_process(self, warp_options, file_format, format_spec,
+                          temp_tile_output_path):
+        """Warp the band stack to temp_tile_output_path using gdal.Warp.
+
+        This avoids the fork/exec, GDAL initialisation and cold block cache
+        of a gdalwarp subprocess for every tile. The LZW work-around used
+        for the gdalwarp command is reproduced via an uncompressed
+        temporary tile in /vsimem/.
+        """
+
+        if not hasattr(gdal, 'Warp'):
+            raise DatasetError('In-process warping requires GDAL 2.1 ' +
+                               'or later (gdal.Warp not found).')
+
+        error_message = self.__gdal_warp(temp_tile_output_path, warp_options)
+        if error_message is None:
+            return
+
+        # Work-around for gdalwarp error writing LZW-compressed GeoTIFFs
+        if (error_message.find('LZW') > -1
+            and file_format == 'GTiff'
+            and 'COMPRESS=LZW' in format_spec):
+
+            LOGGER.info('Creating compressed GeoTIFF tile via temporary uncompressed GeoTIFF')
+
+            uncompressed_tile_path = ('/vsimem/' +
+                                      os.path.basename(temp_tile_output_path) +
+                                      '.tmp')
+            uncompressed_warp_options = [
+                option.replace('COMPRESS=LZW', 'COMPRESS=NONE')
+                for option in warp_options
+                ]
+            try:
+                error_message = self.__gdal_warp(uncompressed_tile_path,
+                                                 uncompressed_warp_options)
+                if error_message is None:
+                    translate_options = ['-of', 'GTiff'] + format_spec
+                    gdal.PushErrorHandler('CPLQuietErrorHandler')
+                    try:
+                        gdal.ErrorReset()
+                        tile_dataset = gdal.Translate(temp_tile_output_path,
+                                                      uncompressed_tile_path,
+                                                      options=translate_options)
+                        if tile_dataset is None:
+                            error_message = gdal.GetLastErrorMsg()
+                        tile_dataset = None # Close to flush the tile to disk
+                    finally:
+                        gdal.PopErrorHandler()
+            finally:
+                gdal.Unlink(uncompressed_tile_path)
+
+        if error_message is not None:
+            raise DatasetError('Unable to perform gdal.Warp: ' +
+                               '"%s" failed: %s' % (' '.join(warp_options),
+                                                    error_message))
+
+    def __gdal_warp(self, output_path, warp_options):
+        """Run gdal.Warp from the band stack vrt to output_path.
+
+        Returns None on success, or the GDAL error message on failure."""
+
+        gdal.PushErrorHandler('CPLQuietErrorHandler')
+        try:
+            gdal.ErrorReset()
+            start_datetime = datetime.now()
+            tile_dataset = gdal.Warp(output_path, self.band_stack.vrt_name,
+                                     options=warp_options)
+            LOGGER.debug('gdal.Warp time = %s', datetime.now() - start_datetime)
+            if tile_dataset is None:
+                error_message = gdal.GetLastErrorMsg() or 'Unknown error'
+                log_multiline(LOGGER.error, error_message,
+                              'error from gdal.Warp', '\t')
+            else:
+                error_message = None
+            tile_dataset = None # Close to flush the tile to disk
+        finally:
+            gdal.PopErrorHandler()
+
+        return error_message
             
     def has_data(self):
         """Check if the reprojection gave rise to a tile with valid data.
 
-        Open the file and check if there is data"""
+        Open the file and scan it block by block, stopping at the first
+        valid pixel. The blocks are read in file order, checking each
+        block of every band before moving on to the next block, so tiles
+        with data near the start of the file (and PQA tiles, where the
+        contiguity bit is checked in every band) are resolved after
+        reading very little. Empty tiles still need every block read. The
+        number of bytes read is kept in self.scan_bytes_read."""
         tile_dataset = gdal.Open(self.temp_tile_output_path)
         start_datetime = datetime.now()
         
@@ -271,14 +567,12 @@ class TileContents(object):
             
         # Convert self.band_stack.band_dict into list of elements sorted by tile_layer
         band_list = [self.band_stack.band_dict[file_number] for file_number in sorted(self.band_stack.band_dict.keys(), key=lambda file_number: self.band_stack.band_dict[file_number]['tile_layer'])]
-        
-        result = False
-        
-        # Read each band in individually - will be quicker for non-empty tiles but slower for empty ones
+
+        # Work out how to test each band for valid data
+        scan_band_list = []
         for band_index in range(tile_dataset.RasterCount):
             band_no = band_index + 1
             band = tile_dataset.GetRasterBand(band_no)
-            band_data = band.ReadAsArray()
             
             # Use DB value: Should actually be the same for all bands in a given processing level       
             nodata_val = band_list[band_index]['nodata_value'] 
@@ -291,33 +585,86 @@ class TileContents(object):
 
             if nodata_val is None:
                 # Special case for PQA with no no-data value defined
-                if (self.band_stack.band_dict[file_number]['level_name'] == 'PQA'):
-                    if (np.bitwise_and(band_data, PQA_CONTIGUITY) > 0).any():
-                        LOGGER.debug('Tile is not empty: PQA data contains some contiguous data')
-                        result = True                
-                        break
+                if band_list[band_index]['level_name'] == 'PQA':
+                    scan_band_list.append((band, None))
                 else:
                     #nodata_value of None means all array data is valid
                     LOGGER.debug('Tile is not empty: No-data value is not set')
-                    result = True
+                    LOGGER.info('Tile has data.')
+                    self.scan_bytes_read = 0
+                    return True
+            else:
+                scan_band_list.append((band, nodata_val))
+
+        result = False
+        self.scan_bytes_read = 0
+        if not scan_band_list:
+            # A tile with no bands (RasterCount == 0) has no data.
+            LOGGER.info('Tile is empty: it has no bands.')
+            return result
+
+        x_size = tile_dataset.RasterXSize
+        y_size = tile_dataset.RasterYSize
+        # Blocks are assumed to be aligned the same way for all bands.
+        # Small blocks (e.g. single-row strips) are read a few at a time
+        # to limit the per-read overhead.
+        block_x_size, block_y_size = scan_band_list[0][0].GetBlockSize()
+        block_y_size *= max(1, SCAN_MIN_PIXELS // (block_x_size * block_y_size))
+
+        for y_offset in range(0, y_size, block_y_size):
+            block_rows = min(block_y_size, y_size - y_offset)
+            for x_offset in range(0, x_size, block_x_size):
+                block_cols = min(block_x_size, x_size - x_offset)
+                for band, nodata_val in scan_band_list:
+                    block_data = band.ReadAsArray(x_offset, y_offset,
+                                                  block_cols, block_rows)
+                    self.scan_bytes_read += block_data.nbytes
+
+                    if nodata_val is None:
+                        if (np.bitwise_and(block_data, PQA_CONTIGUITY) > 0).any():
+                            LOGGER.debug('Tile is not empty: PQA data contains some contiguous data')
+                            result = True
+                            break
+                    elif (block_data != nodata_val).any():
+                        LOGGER.debug('Tile is not empty: Some values != %s', nodata_val)
+                        result = True
+                        break
+                if result:
                     break
-                
-            elif (band_data != nodata_val).any():
-                LOGGER.debug('Tile is not empty: Some values != %s', nodata_val)
-                result = True
+            if result:
                 break
-            
-        # All comparisons have shown that all band contents are no-data:
+
+        # If result is False, all comparisons have shown that all band contents are no-data:
         LOGGER.info('Tile ' + ('has data' if result else 'is empty') + '.')
-        LOGGER.debug('Empty tile detection time = %s', datetime.now() - start_datetime)
+        LOGGER.debug('Empty tile detection time = %s, %d bytes read',
+                     datetime.now() - start_datetime, self.scan_bytes_read)
         return result
 
     def remove(self):
         """Remove tiles that were in coverage but have no data. Also remove
         tiles if we are rolling back the transaction."""
+        if self.promotion:
+            self.promotion.cancel()
+            self.promotion = None
         if os.path.isfile(self.temp_tile_output_path):
             os.remove(self.temp_tile_output_path)
 
+    def start_promotion(self, tile_mover):
+        """Start copying the tile file towards its permanent location in
+        the background, using tile_mover (a tile_mover.TileMover).
+
+        make_permanent waits for the copy to finish.
+        """
+
+        create_directory(os.path.dirname(self.tile_output_path))
+
+        if self.nc_tile_output_path:
+            self.promotion = tile_mover.start(self.nc_temp_tile_output_path,
+                                              self.nc_tile_output_path)
+        else:
+            self.promotion = tile_mover.start(self.temp_tile_output_path,
+                                              self.tile_output_path)
+
     def make_permanent(self):
         """Move the tile file to its permanent location."""
 
@@ -339,10 +686,20 @@ class TileContents(object):
             vrt_file.close()
             
             # Move .nc file
-            shutil.move(self.nc_temp_tile_output_path, self.nc_tile_output_path)
+            self.__promote(self.nc_temp_tile_output_path, self.nc_tile_output_path)
 
         else: # No .vrt file required - just move the tile file
-            shutil.move(self.temp_tile_output_path, self.tile_output_path)
+            self.__promote(self.temp_tile_output_path, self.tile_output_path)
+
+    def __promote(self, source_path, dest_path):
+        """Move a file to the tile store, finishing the background move if
+        one was started."""
+
+        if self.promotion:
+            self.promotion.finish()
+            self.promotion = None
+        else:
+            promote_file(source_path, dest_path)
 
     def get_output_path(self):
         """Return the final location for the tile."""
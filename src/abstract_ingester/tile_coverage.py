@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+
+"""
+tile_coverage: vectorised calculation of the tiles covered by a dataset.
+
+This is a NumPy implementation of DatasetRecord.get_touched_tiles. The
+candidate tiles (those in the smallest rectangle of tiles containing
+the dataset bounding box) are handled as arrays of tile indices, so the
+cost per dataset hardly depends on the number of tiles. This matters
+for fine tile grids (e.g. MODIS or 0.1 degree tiles), where a dataset
+covers thousands of tiles.
+
+The same tests are applied in the same order, with the same floating
+point expressions, as the loop based DatasetRecord methods, so the
+results are identical: the tiles in the largest rectangle of tiles
+inside the bounding box, plus the other candidate tiles whose edges
+cross an edge of the bounding box, plus those lying wholly inside it.
+"""
+
+from math import floor
+import numpy
+
+#
+# Functions
+#
+
+
+def get_touched_tiles(dataset_bbox, cube_origin, cube_tile_size):
+    """Return the set of tiles (itile, jtile) touched by the dataset.
+
+    dataset_bbox is the list of the four dataset corners in tile
+    coordinates, clockwise from the upper left. cube_origin and
+    cube_tile_size are (x, y) tuples for the tile type.
+    """
+
+    (itile_array, jtile_array, definite_mask) = \
+        _get_candidate_tiles(dataset_bbox, cube_origin, cube_tile_size)
+
+    possible_index = numpy.flatnonzero(~definite_mask)
+    possible_i = itile_array[possible_index]
+    possible_j = jtile_array[possible_index]
+
+    tile_vertex_list = _get_tile_vertices(possible_i, possible_j,
+                                          cube_origin, cube_tile_size)
+
+    intersected_mask = _get_intersected_mask(tile_vertex_list, dataset_bbox)
+
+    remaining_vertex_list = [(x[~intersected_mask], y[~intersected_mask])
+                             for (x, y) in tile_vertex_list]
+    inside_count = _get_inside_count(remaining_vertex_list, dataset_bbox)
+    assert numpy.all((inside_count == 4) | (inside_count == 0)), \
+        "Tile partially inside dataset bounding box but has" \
+        "no intersection"
+
+    contained_mask = numpy.zeros(intersected_mask.shape, dtype=bool)
+    contained_mask[~intersected_mask] = (inside_count == 4)
+
+    keep_mask = definite_mask.copy()
+    keep_mask[possible_index] = intersected_mask | contained_mask
+
+    return set(zip(itile_array[keep_mask].tolist(),
+                   jtile_array[keep_mask].tolist()))
+
+
+def _get_index_range(xmin, xmax, ymin, ymax, cube_origin, cube_tile_size):
+    """Return the tile index ranges (xmin_index, xmax_index, ymin_index,
+    ymax_index) for a rectangle in tile coordinates."""
+
+    xorigin, yorigin = cube_origin
+    xsize, ysize = cube_tile_size
+    return (int(floor((xmin - xorigin) / xsize)),
+            int(floor((xmax - xorigin) / xsize)),
+            int(floor((ymin - yorigin) / ysize)),
+            int(floor((ymax - yorigin) / ysize)))
+
+
+def _get_candidate_tiles(dataset_bbox, cube_origin, cube_tile_size):
+    """Return arrays of the tile indices in the smallest rectangle of
+    tiles containing dataset_bbox, and a mask of those in the largest
+    rectangle of tiles inside it (as for
+    DatasetRecord.get_definite_and_possible_tiles)."""
+
+    xyul, xyur, xylr, xyll = dataset_bbox
+    xul, yul = xyul
+    xur, yur = xyur
+    xlr, ylr = xylr
+    xll, yll = xyll
+
+    (inner_xmin, inner_xmax, inner_ymin, inner_ymax) = _get_index_range(
+        max(xll, xul), min(xlr, xur), max(yll, ylr), min(yul, yur),
+        cube_origin, cube_tile_size)
+    (outer_xmin, outer_xmax, outer_ymin, outer_ymax) = _get_index_range(
+        min(xll, xul), max(xlr, xur), min(yll, ylr), max(yul, yur),
+        cube_origin, cube_tile_size)
+
+    (itile_array, jtile_array) = numpy.meshgrid(
+        numpy.arange(outer_xmin, outer_xmax + 1),
+        numpy.arange(outer_ymin, outer_ymax + 1))
+    itile_array = itile_array.ravel()
+    jtile_array = jtile_array.ravel()
+
+    definite_mask = ((itile_array >= inner_xmin) &
+                     (itile_array <= inner_xmax) &
+                     (jtile_array >= inner_ymin) &
+                     (jtile_array <= inner_ymax))
+
+    return (itile_array, jtile_array, definite_mask)
+
+
+def _get_tile_vertices(itile_array, jtile_array, cube_origin, cube_tile_size):
+    """Return the four vertices of each tile, clockwise from the upper
+    left, as a list of (x_array, y_array) tuples."""
+
+    xorigin, yorigin = cube_origin
+    xsize, ysize = cube_tile_size
+    x0 = xorigin + itile_array * xsize
+    y0 = yorigin + (jtile_array + 1) * ysize
+    return [(x0, y0), (x0 + xsize, y0),
+            (x0 + xsize, y0 - ysize), (x0, y0 - ysize)]
+
+
+def _get_intersected_mask(tile_vertex_list, dataset_bbox):
+    """Return a mask of the tiles with an edge crossing an edge of the
+    dataset bounding box (as for DatasetRecord.check_intersection)."""
+
+    intersected_mask = numpy.zeros(tile_vertex_list[0][0].shape, dtype=bool)
+    tile_vtx_number = len(tile_vertex_list)
+    dset_vtx_number = len(dataset_bbox)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for tile_vtx in range(tile_vtx_number):
+            x1, y1 = tile_vertex_list[tile_vtx]
+            x2, y2 = tile_vertex_list[(tile_vtx + 1) % tile_vtx_number]
+            for dset_vtx in range(dset_vtx_number):
+                x3, y3 = dataset_bbox[dset_vtx]
+                x4, y4 = dataset_bbox[(dset_vtx + 1) % dset_vtx_number]
+                rvec = (x2 - x1, y2 - y1)
+                svec = (x4 - x3, y4 - y3)
+                rvec_cross_svec = rvec[0] * svec[1] - rvec[1] * svec[0]
+                qminusp_cross_svec = \
+                    (x3 - x1) * svec[1] - (y3 - y1) * svec[0]
+                qminusp_cross_rvec = \
+                    (x3 - x1) * rvec[1] - (y3 - y1) * rvec[0]
+                tparameter = qminusp_cross_svec / rvec_cross_svec
+                uparameter = qminusp_cross_rvec / rvec_cross_svec
+                intersected_mask |= ((rvec_cross_svec != 0) &
+                                     (tparameter > 0) & (tparameter < 1) &
+                                     (uparameter > 0) & (uparameter < 1))
+
+    return intersected_mask
+
+
+def _get_inside_count(tile_vertex_list, dataset_bbox):
+    """Return the number of vertices of each tile which lie inside the
+    dataset bounding box (using the crossing number test of
+    DatasetRecord.get_contained_tiles)."""
+
+    inside_count = numpy.zeros(tile_vertex_list[0][0].shape, dtype=int)
+    dset_vtx_number = len(dataset_bbox)
+    for x, y in tile_vertex_list:
+        winding_number = numpy.zeros(x.shape, dtype=int)
+        for dset_vtx in range(dset_vtx_number):
+            x1, y1 = dataset_bbox[dset_vtx]
+            x2, y2 = dataset_bbox[(dset_vtx + 1) % dset_vtx_number]
+            upward = (y >= y1) & (y < y2)
+            downward = ~upward & (y <= y1) & (y > y2)
+            winding_number += (
+                (upward & ((x - x1) * (y2 - y1) > (x2 - x1) * (y - y1))) |
+                (downward & ((x - x1) * (y2 - y1) < (x2 - x1) * (y - y1))))
+        inside_count += (winding_number % 2 == 1)
+
+    return inside_count
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+
+"""
+TileMover: promotion of tile files from a staging area to the tile store.
+
+Tiles are written to a temporary directory (the staging area) and moved
+to the tile store when the transaction creating them commits. If the
+staging area is on a different filesystem (e.g. node-local disk or
+tmpfs, see the staging_root configuration item) this move is a copy,
+which is slow for a shared tile store. A TileMover starts these copies
+in the background as soon as a tile is marked for creation, using a
+small pool of threads. Each tile is copied to a hidden partial file in
+its destination directory and synced. At commit time only the copies
+still in flight are waited for, and each tile is then put in place
+with a rename, which is atomic. If the transaction is rolled back the
+partial files are removed.
+"""
+
+import os
+import sys
+import shutil
+import logging
+import threading
+import Queue
+
+# Set up logger.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+MOVER_WORKERS = 4  # Default number of copy threads.
+MOVER_QUEUE_SIZE = 16  # Max. copies waiting for a thread.
+COPY_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes per read when copying.
+
+#
+# Functions
+#
+
+
+def promote_file(source_path, dest_path):
+    """Move a file to its final location, syncing it if it is copied."""
+
+    promotion = Promotion(source_path, dest_path)
+    promotion.copy()
+    promotion.finish()
+
+
+def _sync_directory(dir_path):
+    """Sync a directory, so that a rename within it is durable."""
+
+    dir_fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+#
+# Classes
+#
+
+
+class Promotion(object):
+    """The move of a single file from the staging area to the tile store.
+
+    copy() does the slow part of the move (if any) and may be run in a
+    background thread. finish() waits for that, then renames the file
+    into place. cancel() waits for it, then removes the partial file.
+    """
+
+    def __init__(self, source_path, dest_path):
+
+        self.source_path = source_path
+        self.dest_path = dest_path
+
+        (dest_dir, dest_basename) = os.path.split(dest_path)
+        self.dest_dir = dest_dir
+        if os.stat(source_path).st_dev == os.stat(dest_dir).st_dev:
+            # Same filesystem: a rename will do.
+            self.partial_path = None
+        else:
+            self.partial_path = os.path.join(
+                dest_dir, '.%s.%d.partial' % (dest_basename, os.getpid()))
+
+        self.done_event = threading.Event()
+        self.exc_info = None
+
+    def copy(self):
+        """Copy the file to a partial file beside its destination, and
+        sync it. Any exception is saved to be raised by finish."""
+
+        try:
+            if self.partial_path is not None:
+                with open(self.source_path, 'rb') as source_file:
+                    with open(self.partial_path, 'wb') as partial_file:
+                        shutil.copyfileobj(source_file, partial_file,
+                                           COPY_BUFFER_SIZE)
+                        partial_file.flush()
+                        os.fsync(partial_file.fileno())
+                shutil.copymode(self.source_path, self.partial_path)
+        except Exception:  # pylint: disable=broad-except
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done_event.set()
+
+    def finish(self):
+        """Wait for the copy, then rename the file into place."""
+
+        self.done_event.wait()
+        if self.exc_info is not None:
+            self.__remove_partial()
+            exc_type, exc_value, exc_traceback = self.exc_info
+            raise exc_type, exc_value, exc_traceback
+
+        if self.partial_path is None:
+            os.rename(self.source_path, self.dest_path)
+        else:
+            os.rename(self.partial_path, self.dest_path)
+            _sync_directory(self.dest_dir)
+            os.remove(self.source_path)
+
+    def cancel(self):
+        """Wait for the copy, then remove the partial file."""
+
+        self.done_event.wait()
+        self.__remove_partial()
+
+    def __remove_partial(self):
+        """Remove the partial file, if there is one."""
+
+        if self.partial_path is not None and \
+                os.path.isfile(self.partial_path):
+            os.remove(self.partial_path)
+
+
+class TileMover(object):
+    """Copies tile files to the tile store using a pool of threads.
+
+    The threads are started on first use, and again if the process has
+    forked since (threads are not inherited by a child process). The
+    queue of copies waiting for a thread is bounded, so start blocks if
+    tiles are made faster than they can be copied.
+    """
+
+    def __init__(self, workers=MOVER_WORKERS, queue_size=MOVER_QUEUE_SIZE):
+
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.queue = None
+        self.thread_list = []
+        self.pid = None
+
+    def start(self, source_path, dest_path):
+        """Start moving source_path to dest_path, returning a Promotion.
+
+        The caller must finish (or cancel) the promotion.
+        """
+
+        promotion = Promotion(source_path, dest_path)
+        if promotion.partial_path is None:
+            promotion.done_event.set()
+        else:
+            self.__check_threads()
+            self.queue.put(promotion)
+
+        return promotion
+
+    def close(self):
+        """Stop the threads, after the queued copies are done."""
+
+        if self.pid == os.getpid():
+            for dummy_thread in self.thread_list:
+                self.queue.put(None)
+            for thread in self.thread_list:
+                thread.join()
+
+        self.queue = None
+        self.thread_list = []
+        self.pid = None
+
+    def __check_threads(self):
+        """Start the threads if they are not running in this process."""
+
+        if self.pid == os.getpid():
+            return
+
+        self.queue = Queue.Queue(self.queue_size)
+        self.thread_list = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.__run,
+                                      name='tile-mover-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self.thread_list.append(thread)
+        self.pid = os.getpid()
+
+        LOGGER.debug('Started %d tile mover threads.', self.workers)
+
+    def __run(self):
+        """Thread target: copy queued promotions until told to stop."""
+
+        queue = self.queue
+        while True:
+            promotion = queue.get()
+            if promotion is None:
+                break
+            promotion.copy()
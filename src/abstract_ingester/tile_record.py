@@ -43,7 +43,6 @@ import os
 from ingest_db_wrapper import IngestDBWrapper, TC_PENDING
 from agdc.cube_util import get_file_size_mb
 import re
-import psycopg2
 
 # Set up logger.
 LOGGER = logging.getLogger(__name__)
@@ -63,7 +62,16 @@ class TileRecord(object):
                             'tile_size',
                             'ctime'
                             ]
-    def __init__(self, collection, dataset_record, tile_contents):
+    def __init__(self, collection, dataset_record, tile_contents,
+                 find_or_create=True):
+        """Set up the tile record for a tile.
+
+        If find_or_create is False the tile footprint and tile record
+        are not written to the database. This is left to the caller
+        (see Collection.store_tile_records), which must fill in the
+        tile_id using set_tile_id.
+        """
+
         self.collection = collection
         self.datacube = collection.datacube
         self.dataset_record = dataset_record
@@ -90,43 +98,39 @@ class TileRecord(object):
             get_file_size_mb(self.tile_contents
                                        .temp_tile_output_path)
 
-        self.update_tile_footprint()
+        if find_or_create:
+            self.update_tile_footprint()
+
+            # Make the tile record entry on the database:
+            tile_id = self.db.get_tile_id(tile_dict)
+            if tile_id is None:
+                tile_id = self.db.insert_tile_record(tile_dict)
+            else:
+                # If there was any existing tile corresponding to tile_dict
+                # then it should already have been removed.
+                raise AssertionError("Attempt to recreate an existing tile.")
+            self.set_tile_id(tile_id)
+
+    def set_tile_id(self, tile_id):
+        """Set the tile_id of a newly created record."""
+
+        self.tile_id = tile_id
+        self.tile_dict['tile_id'] = tile_id
+
+    def get_footprint_dict(self):
+        """Return a dictionary describing the tile footprint, suitable
+        for inserting into the tile_footprint table."""
 
-        # Make the tile record entry on the database:
-        self.tile_id = self.db.get_tile_id(tile_dict)
-        if self.tile_id is None:
-            self.tile_id = self.db.insert_tile_record(tile_dict)
-        else:
-            # If there was any existing tile corresponding to tile_dict then
-            # it should already have been removed.
-            raise AssertionError("Attempt to recreate an existing tile.")
-        tile_dict['tile_id'] = self.tile_id
+        return {'x_index': self.tile_footprint[0],
+                'y_index': self.tile_footprint[1],
+                'tile_type_id': self.tile_type_id,
+                'x_min': self.tile_contents.tile_extents[0],
+                'y_min': self.tile_contents.tile_extents[1],
+                'x_max': self.tile_contents.tile_extents[2],
+                'y_max': self.tile_contents.tile_extents[3],
+                'bbox': 'Populate this within sql query?'}
 
     def update_tile_footprint(self):
         """Update the tile footprint entry in the database"""
 
-        if not self.db.tile_footprint_exists(self.tile_dict):
-            # We may need to create a new footprint record.
-            footprint_dict = {'x_index': self.tile_footprint[0],
-                              'y_index': self.tile_footprint[1],
-                              'tile_type_id': self.tile_type_id,
-                              'x_min': self.tile_contents.tile_extents[0],
-                              'y_min': self.tile_contents.tile_extents[1],
-                              'x_max': self.tile_contents.tile_extents[2],
-                              'y_max': self.tile_contents.tile_extents[3],
-                              'bbox': 'Populate this within sql query?'}
-
-            # Create an independent database connection for this transaction.
-            my_db = IngestDBWrapper(self.datacube.create_connection())
-            try:
-                with self.collection.transaction(my_db):
-                    if not my_db.tile_footprint_exists(self.tile_dict):
-                        my_db.insert_tile_footprint(footprint_dict)
-
-            except psycopg2.IntegrityError:
-                # If we get an IntegrityError we assume the tile_footprint
-                # is already in the database, and we do not need to add it.
-                pass
-
-            finally:
-                my_db.close()
+        self.collection.update_tile_footprints([self.get_footprint_dict()])
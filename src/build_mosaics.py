@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+build_mosaics.py - Build the mosaics for tiles left pending by an ingest.
+
+An ingest run with --defermosaic stores its tiles without mosaicking
+them, so that parallel ingests of neighbouring datasets do not wait on
+each other's dataset locks. This command then finds all of the pending
+overlaps with a single query, and makes the mosaics one group of
+overlapping datasets at a time, optionally using a pool of worker
+processes:
+
+    python -m agdc.build_mosaics [-C config_file] [--workers N]
+"""
+
+import os
+import sys
+import argparse
+import logging
+import multiprocessing
+import multiprocessing.util
+from datetime import datetime
+
+from agdc.cube_util import DatasetError
+from agdc.abstract_ingester import IngesterDataCube
+from agdc.abstract_ingester.collection import Collection
+
+#
+# Set up logger.
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Mosaic builder instance used by a worker process.
+#
+
+_WORKER_BUILDER = None
+
+#
+# Classes
+#
+
+
+class MosaicBuilder(object):
+    """Builds the mosaics for pending tiles, one dataset group at a time."""
+
+    def __init__(self, datacube=None, collection=None):
+        """Set up the mosaic builder.
+
+        datacube and collection are as for AbstractIngester: if they are
+        None they are created using the arguments returned by
+        self.parse_args().
+        """
+
+        self.args = self.parse_args()
+
+        if self.args.debug:
+            # Set DEBUG level on the root logger
+            logging.getLogger().setLevel(logging.DEBUG)
+
+        if datacube is None:
+            self.datacube = IngesterDataCube(self.args)
+        else:
+            self.datacube = datacube
+
+        if collection is None:
+            self.collection = Collection(self.datacube)
+        else:
+            self.collection = collection
+
+    @staticmethod
+    def parse_args():
+        """Parse the command line arguments.
+
+        Returns:
+            argparse namespace object
+        """
+        LOGGER.debug('  Calling parse_args()')
+
+        _arg_parser = argparse.ArgumentParser('build_mosaics')
+
+        default_config = os.path.join(os.path.dirname(__file__),
+                                      'agdc_default.conf')
+        _arg_parser.add_argument('-C', '--config', dest='config_file',
+                                 default=default_config,
+                                 help='DataCube configuration file')
+
+        _arg_parser.add_argument('-d', '--debug', dest='debug',
+                                 default=False, action='store_const',
+                                 const=True,
+                                 help='Debug mode flag')
+
+        workers_help = 'Number of worker processes used to build mosaics'\
+            ' in parallel (default 1).'
+        _arg_parser.add_argument('--workers', dest='workers',
+                                 default=1, type=int, help=workers_help)
+
+        args, dummy_unknown_args = _arg_parser.parse_known_args()
+        return args
+
+    def build_mosaics(self):
+        """Build the mosaics for all pending tiles.
+
+        Returns the number of groups which failed (because a lock could
+        not be obtained or a mosaic could not be made).
+        """
+
+        start_datetime = datetime.now()
+
+        group_list = self.collection.get_pending_mosaic_groups()
+        LOGGER.info('Found %d groups of datasets with pending tiles.',
+                    len(group_list))
+
+        workers = max(1, self.args.workers or 1)
+        if workers > 1 and len(group_list) > 1:
+            pool = multiprocessing.Pool(workers,
+                                        initializer=_start_worker,
+                                        initargs=(self,))
+            try:
+                result_list = list(pool.imap_unordered(_mosaic_in_worker,
+                                                       group_list))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            result_list = [self.mosaic_group(dataset_list)
+                           for dataset_list in group_list]
+
+        mosaic_count = sum(count for count in result_list if count)
+        fail_count = result_list.count(None)
+
+        LOGGER.info('Mosaics built: %d, groups failed: %d, in %s.',
+                    mosaic_count, fail_count, datetime.now() - start_datetime)
+        return fail_count
+
+    def mosaic_group(self, dataset_list):
+        """Build the mosaics for one group of datasets.
+
+        The datasets are locked once for the whole group, and the
+        mosaics made in a single transaction. Returns the number of
+        mosaics made, or None if a DatasetError prevented this.
+        """
+
+        try:
+            with self.collection.lock_datasets(dataset_list):
+                with self.collection.transaction():
+                    mosaic_count = \
+                        self.collection.create_pending_mosaics(dataset_list)
+        except DatasetError as err:
+            LOGGER.info('Mosaicking failed for datasets %s:', dataset_list)
+            LOGGER.info(str(err))
+            LOGGER.debug("Exception info:", exc_info=True)
+            return None
+
+        LOGGER.debug('Built %d mosaics for datasets %s.',
+                     mosaic_count, dataset_list)
+        return mosaic_count
+
+    def start_worker(self):
+        """Set up this (forked) mosaic builder as a worker process.
+
+        As for AbstractIngester.start_worker, the worker gets its own
+        datacube (and database connection), lock owner id and temporary
+        tile directory.
+        """
+
+        self.parent_datacube = self.datacube
+
+        self.datacube = IngesterDataCube(self.args)
+        self.datacube.process_id = '%s-%d' % (self.datacube.process_id,
+                                              os.getpid())
+
+        self.collection = Collection(self.datacube)
+        multiprocessing.util.Finalize(self.collection,
+                                      self.collection.cleanup,
+                                      exitpriority=10)
+
+#
+# Worker process functions
+#
+
+
+def _start_worker(builder):
+    """Pool initializer: set up the mosaic builder inherited by a worker."""
+
+    global _WORKER_BUILDER  # pylint: disable=global-statement
+
+    builder.start_worker()
+    _WORKER_BUILDER = builder
+
+
+def _mosaic_in_worker(dataset_list):
+    """Build the mosaics for a group of datasets in a worker process."""
+
+    return _WORKER_BUILDER.mosaic_group(dataset_list)
+
+
+def main():
+    """Build the pending mosaics, returning the exit status."""
+
+    builder = MosaicBuilder()
+    try:
+        fail_count = builder.build_mosaics()
+    finally:
+        builder.collection.cleanup()
+
+    return 1 if fail_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -36,6 +36,7 @@ import time
 import datetime
 import logging
 import errno
+import stat
 import inspect
 
 #
@@ -45,6 +46,14 @@ import inspect
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# Dataset sizes already measured by this process (for instance by the
+# ingest journal), for the next get_directory_size_kb call on the same
+# path: path -> size in kB. See set_directory_size_kb.
+#
+
+_DIRECTORY_SIZE_CACHE = {}
+
 #
 # Utility Functions
 #
@@ -106,6 +115,95 @@ def get_file_size_mb(path):
     return os.path.getsize(path) / (1024*1024)
 
 
+def get_directory_size_kb(path):
+    """Return the disk usage of the directory tree at path in kB.
+
+    This gives the same result as 'du -sk path' for a directory, without
+    running it as a subprocess (see scan_directory_tree). A plain file
+    gives its size, rounded up to a whole kB.
+
+    If the size of path has already been measured by this process and
+    passed to set_directory_size_kb, that size is used (once) instead of
+    walking the tree again.
+
+    Raises:
+    DatasetError if the directory cannot be read.
+    """
+
+    size_kb = _DIRECTORY_SIZE_CACHE.pop(path, None)
+    if size_kb is None:
+        size_kb = scan_directory_tree(path)[2]
+    return size_kb
+
+
+def set_directory_size_kb(path, size_kb):
+    """Record the size of path in kB, as just measured by the caller,
+    for the next get_directory_size_kb call on path. A size_kb of None
+    is ignored."""
+
+    if size_kb is not None:
+        _DIRECTORY_SIZE_CACHE[path] = size_kb
+
+
+def take_directory_size_kb(path):
+    """Return and forget the size recorded for path by
+    set_directory_size_kb, or None if there is none."""
+
+    return _DIRECTORY_SIZE_CACHE.pop(path, None)
+
+
+def scan_directory_tree(path):
+    """Walk the file or directory tree at path once, returning a tuple
+    (latest_mtime, total_size, size_kb).
+
+    latest_mtime is the latest modification time of the files in the
+    tree and total_size their total size in bytes, so rewriting a file
+    in place changes them even though no directory changes. size_kb is
+    the disk usage in kB: for a directory the blocks allocated to every
+    file and directory in the tree, counting hard linked files once and
+    not following symbolic links, as 'du -sk' gives; for a plain file
+    its size rounded up to a whole kB. If path itself is a symbolic link
+    (as for datasets found with --followsymlinks) its target is scanned.
+
+    Raises:
+    DatasetError if the tree cannot be read.
+    """
+
+    try:
+        path_stat = os.stat(path)
+        if not stat.S_ISDIR(path_stat.st_mode):
+            return (path_stat.st_mtime, path_stat.st_size,
+                    (path_stat.st_size + 1023) // 1024)
+
+        latest_mtime = 0.0
+        total_size = 0
+        total_bytes = 0
+        inode_set = set()
+        dir_stack = [(path, path_stat)]
+        while dir_stack:
+            dir_path, dir_stat = dir_stack.pop()
+            total_bytes += dir_stat.st_blocks * 512
+            for name in os.listdir(dir_path):
+                entry_path = os.path.join(dir_path, name)
+                entry_stat = os.lstat(entry_path)
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    dir_stack.append((entry_path, entry_stat))
+                    continue
+                latest_mtime = max(latest_mtime, entry_stat.st_mtime)
+                total_size += entry_stat.st_size
+                if entry_stat.st_nlink > 1:
+                    inode = (entry_stat.st_dev, entry_stat.st_ino)
+                    if inode in inode_set:
+                        continue
+                    inode_set.add(inode)
+                total_bytes += entry_stat.st_blocks * 512
+    except OSError, e:
+        raise DatasetError('Unable to calculate directory size of %s: %s'
+                           % (path, e))
+
+    return (latest_mtime, total_size, (total_bytes + 1023) // 1024)
+
+
 def create_directory(dirname):
     """Create dirname, including any intermediate directories necessary to
     create the leaf directory."""
@@ -47,6 +47,7 @@ import inspect
 
 from EOtools.execute import execute
 from EOtools.utils import log_multiline
+from agdc.lock_manager import LockManager, LOCK_POOL_SIZE, LOCK_MODE_TABLE, LOCK_LEASE
 
 # Set top level standard output 
 console_handler = logging.StreamHandler(sys.stdout)
@@ -214,6 +215,7 @@ where tile_type_id = %(tile_type_id)s
         self.agdc_root = os.path.dirname(__file__)
 
         self.db_connection = None
+        self.lock_manager = None
         
         self.process_id = os.getenv('PBS_O_HOST', socket.gethostname()) + ':' + os.getenv('PBS_JOBID', str(os.getpid()))
         def open_config(config_file):
@@ -373,173 +375,66 @@ order by tile_type_id,satellite_name, sensor_name, level_name, tile_layer
         log_multiline(logger.debug, self.bands, 'self.bands', '\t')    
          
     def __del__(self):
+        if self.lock_manager:
+            self.lock_manager.close()
         if self.db_connection:
             self.db_connection.close()        
     
             
-    def lock_object(self, lock_object, lock_type_id=1, lock_status_id=None, lock_detail=None):
-        # Need separate non-persistent connection for lock mechanism to allow independent transaction commits
-        lock_connection = self.create_connection()
-        
-        lock_cursor = lock_connection.cursor()
-        result = None
-        sql = """-- Insert lock record if doesn't already exist
-insert into lock(
-  lock_type_id,
-  lock_object,
-  lock_owner,
-  lock_status_id)
-select
-  %(lock_type_id)s,
-  %(lock_object)s,
-  %(lock_owner)s,
-  %(lock_status_id)s
-where not exists
-  (select
-    lock_type_id,
-    lock_object
-  from lock
-  where lock_type_id = %(lock_type_id)s
-    and lock_object = %(lock_object)s);
-    
--- Update lock record if it is not owned or owned by this process
-update lock
-set lock_owner = %(lock_owner)s,
-  lock_status_id = %(lock_status_id)s,
-  lock_detail = %(lock_detail)s
-  where lock_type_id = %(lock_type_id)s
-    and lock_object = %(lock_object)s
-    and (lock_owner is null or lock_owner = %(lock_owner)s);
-""" 
-        params = {'lock_type_id': lock_type_id,
-                  'lock_object': lock_object,
-                  'lock_owner': self.process_id,
-                  'lock_status_id': lock_status_id,
-                  'lock_detail': lock_detail
-                  }
+    def get_lock_manager(self):
+        """Return the lock manager, creating it on first use.
         
-        log_multiline(logger.debug, lock_cursor.mogrify(sql, params), 'SQL', '\t')
-        
-        # Need to specifically check object lock record for this process and specified status
-        try:
-            lock_cursor.execute(sql, params)
-            result = self.check_object_locked(lock_object=lock_object, 
-                                              lock_type_id=lock_type_id, 
-                                              lock_status_id=lock_status_id, 
-                                              lock_owner=self.process_id,
-                                              lock_connection=lock_connection)
-        finally:
-            lock_connection.close() 
-            
-        if result:
-            logger.debug('Locked object %s', lock_object)
-        else:
-            logger.debug('Unable to lock object %s', lock_object)
-            
-        return result
+        The lock manager keeps a small pool of autocommit connections for lock
+        operations, which must commit independently of any open transaction.
+        """
+        if self.lock_manager is None:
+            self.lock_manager = LockManager(self.create_connection,
+                                            self.process_id,
+                                            pool_size=int(getattr(self, 'lock_pool_size', None) or LOCK_POOL_SIZE),
+                                            lock_mode=getattr(self, 'lock_mode', None) or LOCK_MODE_TABLE,
+                                            lease=float(getattr(self, 'lock_lease', None) or LOCK_LEASE))
+        return self.lock_manager
             
-
+    def lock_object(self, lock_object, lock_type_id=1, lock_status_id=None, lock_detail=None):
+        return self.get_lock_manager().lock_object(lock_object,
+                                                   lock_type_id=lock_type_id,
+                                                   lock_status_id=lock_status_id,
+                                                   lock_detail=lock_detail)
         
     def unlock_object(self, lock_object, lock_type_id=1):
-        # Need separate non-persistent connection for lock mechanism to allow independent transaction commits
-        lock_connection = self.create_connection()
+        return self.get_lock_manager().unlock_object(lock_object,
+                                                     lock_type_id=lock_type_id)
         
-        lock_cursor = lock_connection.cursor()
-        result = False
-        sql = """-- Delete lock object if it is owned by this process
-delete from lock     
-where lock_type_id = %(lock_type_id)s
-  and lock_object = %(lock_object)s
-  and lock_owner = %(lock_owner)s;
-""" 
-        params = {'lock_type_id': lock_type_id,
-                  'lock_object': lock_object,
-                  'lock_owner': self.process_id
-                  }
+    def lock_objects(self, lock_object_list, lock_type_id=1):
+        """Lock all the objects in lock_object_list together, or none of them."""
+        return self.get_lock_manager().lock_objects(lock_object_list,
+                                                    lock_type_id=lock_type_id)
         
-        log_multiline(logger.debug, lock_cursor.mogrify(sql, params), 'SQL', '\t')
-        try:
-            lock_cursor.execute(sql, params)
-            result = not self.check_object_locked(lock_object, 
-                                                  lock_type_id)   
-        finally:
-            lock_connection.close()
-            
-        if result:
-            logger.debug('Unlocked object %s', lock_object)
-        else:
-            logger.debug('Unable to unlock object %s', lock_object)
-            
-        return result
-    
-    def check_object_locked(self, lock_object, lock_type_id=1, lock_status_id=None, lock_owner=None, lock_connection=None):
-        # Check whether we need to create a new connection and do it if required
-        create_connection = not lock_connection
-        # Need separate non-persistent connection for lock mechanism to allow independent transaction commits
-        lock_connection = lock_connection or self.create_connection()
+    def unlock_objects(self, lock_object_list, lock_type_id=1):
+        return self.get_lock_manager().unlock_objects(lock_object_list,
+                                                      lock_type_id=lock_type_id)
         
-        lock_cursor = lock_connection.cursor()
-        result = None
-        sql = """-- Select lock record if it exists
-select     
-  lock_object,
-  lock_owner,
-  lock_status_id,
-  lock_detail
-  from lock
-  where lock_type_id = %(lock_type_id)s
-    and lock_object = %(lock_object)s
-    and (%(lock_status_id)s is null or lock_status_id = %(lock_status_id)s)
-    and (%(lock_owner)s is null or lock_owner = %(lock_owner)s);
-""" 
-        params = {'lock_type_id': lock_type_id,
-                  'lock_object': lock_object,
-                  'lock_owner': lock_owner,
-                  'lock_status_id': lock_status_id
-                  }
+    def check_object_locked(self, lock_object, lock_type_id=1, lock_status_id=None, lock_owner=None, lock_connection=None):
+        return self.get_lock_manager().check_object_locked(lock_object,
+                                                           lock_type_id=lock_type_id,
+                                                           lock_status_id=lock_status_id,
+                                                           lock_owner=lock_owner,
+                                                           connection=lock_connection)
         
-        log_multiline(logger.debug, lock_cursor.mogrify(sql, params), 'SQL', '\t')
-        try:
-            lock_cursor.execute(sql, params)
-            record = lock_cursor.fetchone()
-            if record:
-                result = {'lock_type_id': lock_type_id,
-                  'lock_object': record[0],
-                  'lock_owner': record[1],
-                  'lock_status_id': record[2],
-                  'lock_detail': record[3]
-                  }       
-        finally:
-            # Only close connection if it was created in this function
-            if create_connection:
-                lock_connection.close()
+    def clear_expired_locks(self, lock_type_id=None):
+        """Remove locks whose lease has expired (because their owner has died).
         
-        return result
+        This is safe to run at any time, unlike clear_all_locks.
+        """
+        return self.get_lock_manager().clear_expired_locks(lock_type_id=lock_type_id)
         
     def clear_all_locks(self, lock_object=None, lock_type_id=1, lock_owner=None):
         """ 
         USE WITH CAUTION - This will affect all processes using specified lock type
         """
-        # Need separate non-persistent connection for lock mechanism to allow independent transaction commits
-        lock_connection = self.create_connection()
-        
-        lock_cursor = lock_connection.cursor()
-        sql = """-- Delete ALL lock objects matching any supplied parameters
-delete from lock     
-where (%(lock_type_id)s is null or lock_type_id = %(lock_type_id)s)
-  and (%(lock_object)s is null or lock_object = %(lock_object)s)
-  and (%(lock_owner)s is null or lock_owner = %(lock_owner)s);
-""" 
-        params = {'lock_type_id': lock_type_id,
-                  'lock_object': lock_object,
-                  'lock_owner': lock_owner
-                  }
-        
-        log_multiline(logger.debug, lock_cursor.mogrify(sql, params), 'SQL', '\t')
-        try:
-            lock_cursor.execute(sql, params)
-        finally:
-            lock_connection.close()
+        self.get_lock_manager().clear_all_locks(lock_object=lock_object,
+                                                lock_type_id=lock_type_id,
+                                                lock_owner=lock_owner)
     
     def check_files_ready(self, filename_list):
         logger.debug('Checking files %s', filename_list)
@@ -38,8 +38,8 @@ import re
 import logging
 import argparse
 
-from EOtools.execute import execute
 from agdc.abstract_ingester import AbstractIngester
+from agdc.abstract_ingester.dataset_walker import walk_datasets
 from landsat_dataset import LandsatDataset
 
 #
@@ -112,6 +112,8 @@ class LandsatIngester(AbstractIngester):
         _arg_parser.add_argument('--synctype', dest='sync_type',
                                  default=None, help=sync_type_help)
 
+        AbstractIngester.add_ingest_arguments(_arg_parser)
+
         return _arg_parser.parse_args()
 
     def find_datasets(self, source_dir):
@@ -123,46 +125,49 @@ class LandsatIngester(AbstractIngester):
         Datasets are filtered by path, row, and date range if
         fast filtering is on (command line flag)."""
 
-        LOGGER.info('Searching for datasets in %s', source_dir)
-        if self.args.follow_symbolic_links:
-            command = "find -L %s -name 'scene01' | sort" % source_dir
-        else:
-            command = "find %s -name 'scene01' | sort" % source_dir
-        LOGGER.debug('executing "%s"', command)
-        result = execute(command)
-        assert not result['returncode'], \
-            '"%s" failed: %s' % (command, result['stderr'])
+        return sorted(self.iter_datasets(source_dir))
+
+    def iter_datasets(self, source_dir):
+        """Generate the paths to the datasets under 'source_dir' as they
+        are found (see find_datasets).
 
-        dataset_list = [os.path.abspath(re.sub(r'/scene01$', '', scenedir))
-                        for scenedir in result['stdout'].split('\n')
-                        if scenedir]
+        The search does not look inside the dataset directories, and
+        fast filtering is done as the datasets are found."""
 
-        if self.args.fast_filter:
-            dataset_list = self.fast_filter_datasets(dataset_list)
+        LOGGER.info('Searching for datasets in %s', source_dir)
 
-        return dataset_list
+        for dataset_path in walk_datasets(
+                source_dir,
+                is_dataset_dir=lambda name_set: 'scene01' in name_set,
+                follow_links=self.args.follow_symbolic_links):
+            if self.args.fast_filter and \
+                    not self.fast_filter_dataset(dataset_path):
+                continue
+            yield dataset_path
 
     def fast_filter_datasets(self, dataset_list):
         """Filter a list of dataset paths by path/row and date range."""
 
-        new_list = []
-        for dataset_path in dataset_list:
-            match = re.search(r'_(\d{3})_(\d{3})_(\d{4})(\d{2})(\d{2})$',
-                              dataset_path)
-            if match:
-                (path, row, year, month, day) = map(int, match.groups())
+        return [dataset_path for dataset_path in dataset_list
+                if self.fast_filter_dataset(dataset_path)]
+
+    def fast_filter_dataset(self, dataset_path):
+        """Return True unless the dataset path shows that the dataset is
+        outside the path/row and date range."""
 
-                if self.filter_dataset(path,
+        match = re.search(r'_(\d{3})_(\d{3})_(\d{4})(\d{2})(\d{2})$',
+                          dataset_path)
+        if match:
+            (path, row, year, month, day) = map(int, match.groups())
+
+            return self.filter_dataset(path,
                                        row,
-                                       datetime.date(year, month, day)):
-                    new_list.append(dataset_path)
-            else:
-                # Note that dataset paths that do not match the pattern
-                # are included. They will be filtered on metadata by
-                # AbstractIngester.
-                new_list.append(dataset_path)
-
-        return new_list
+                                       datetime.date(year, month, day))
+        else:
+            # Note that dataset paths that do not match the pattern
+            # are included. They will be filtered on metadata by
+            # AbstractIngester.
+            return True
 
     def open_dataset(self, dataset_path):
         """Create and return a dataset object.
@@ -41,8 +41,8 @@ import re
 from osgeo import gdal
 from agdc.abstract_ingester import AbstractBandstack
 from agdc.cube_util import DatasetError, create_directory
+from agdc.vrt_writer import write_vrt
 from collections import OrderedDict
-from EOtools.execute import execute
 
 class LandsatBandstack(AbstractBandstack):
     """Landsat subclass of AbstractBandstack class"""
@@ -66,40 +66,22 @@ class LandsatBandstack(AbstractBandstack):
         #Make the list of filenames from the dataset_path/scene01 and each
         #file_number's file_pattern. Also get list of nodata_value.
         self.source_file_list, self.nodata_list = self.list_source_files()
-        nodata_value = self.nodata_list[0]
-        #TODO: check that this works for PQA where nodata_value is None
-        if nodata_value is not None:
-            nodata_spec = ["-srcnodata",
-                           "%d" %nodata_value,
-                           "-vrtnodata",
-                           "%d" %(nodata_value)]
-        else:
-            nodata_spec = []
         #Form the vrt_band_stack_filename.
-        #This is done using
-        #args = shlex.split(command_line)
-        #where command_line is the buildvrt command
         create_directory(temp_dir)
         self.vrt_name = self.get_vrt_name(temp_dir)
-        #Build the vrt
-        buildvrt_cmd = ["gdalbuildvrt",
-                        "-separate",
-                        "-q",
-                        ]
-        buildvrt_cmd.extend(nodata_spec)
-        buildvrt_cmd.extend(["-overwrite", "%s" %self.vrt_name])
-        buildvrt_cmd.extend(self.source_file_list)
-        #for fle in self.source_file_list:
-        #    buildvrt_cmd.append(fle)
-        #buildvrt_cmd = ' '.join(buildvrt_cmd)
-        result = execute(buildvrt_cmd, shell=False)
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to perform gdalbuildvrt: ' +
-                               '"%s" failed: %s'\
-                                   % (buildvrt_cmd, result['stderr']))
-        #Add the metadata and return the band_stack as a gdal datatset, storing
-        #as an attribute of the Bandstack object
-        self.vrt_band_stack = self.add_metadata(self.vrt_name)
+        #Build the vrt, with the metadata, in a single write. Bands without
+        #a nodata_value use that of the first band.
+        #TODO: check that this works for PQA where nodata_value is None
+        nodata_list = [self.nodata_list[0] if nodata_value is None
+                       else nodata_value
+                       for nodata_value in self.nodata_list]
+        write_vrt(self.vrt_name,
+                  self.source_file_list,
+                  separate=True,
+                  nodata_list=nodata_list,
+                  metadata=self.get_dataset_metadata(),
+                  band_metadata_list=self.get_band_metadata_list())
+        self.vrt_band_stack = None
 
     def list_source_files(self):
         """Given the dictionary of band source information, form a list
@@ -131,43 +113,38 @@ class LandsatBandstack(AbstractBandstack):
             %(level_name, satellite, sensor, start_datetime, x_ref, y_ref)
         return os.path.join(vrt_dir, vrt_band_stack_basename)
 
-    def add_metadata(self, vrt_filename):
-        """Add metadata to the VRT."""
-        band_stack_dataset = gdal.Open(vrt_filename)
-        assert band_stack_dataset, 'Unable to open VRT %s' % vrt_filename
-        band_stack_dataset.SetMetadata(
-            {'satellite': self.dataset_mdd['satellite_tag'].upper(),
-             'sensor':  self.dataset_mdd['sensor_name'].upper(),
-             'start_datetime': self.dataset_mdd['start_datetime'].isoformat(),
-             'end_datetime': self.dataset_mdd['end_datetime'].isoformat(),
-             'path': '%03d' % self.dataset_mdd['x_ref'],
-             'row': '%03d' % self.dataset_mdd['y_ref']}
-            )
+    def get_dataset_metadata(self):
+        """Return the dataset metadata for the VRT."""
+        return {'satellite': self.dataset_mdd['satellite_tag'].upper(),
+                'sensor':  self.dataset_mdd['sensor_name'].upper(),
+                'start_datetime':
+                    self.dataset_mdd['start_datetime'].isoformat(),
+                'end_datetime': self.dataset_mdd['end_datetime'].isoformat(),
+                'path': '%03d' % self.dataset_mdd['x_ref'],
+                'row': '%03d' % self.dataset_mdd['y_ref']}
+
+    def get_band_metadata_list(self):
+        """Return the metadata for each band of the VRT, in band order."""
+        band_metadata_list = [None] * len(self.band_dict)
         for band_info in self.band_dict.values():
             #Assume ordering file_number keys also orders the tile_layer
             band_number = band_info['tile_layer']
+            band_metadata_list[band_number - 1] = \
+                {'name': band_info['band_name'],
+                 'filename': self.source_file_list[band_number - 1]}
+        return band_metadata_list
+
+    def add_metadata(self, vrt_filename):
+        """Add metadata to an existing VRT. buildvrt writes the metadata
+        with the VRT, so this is only needed for VRTs made elsewhere."""
+        band_stack_dataset = gdal.Open(vrt_filename)
+        assert band_stack_dataset, 'Unable to open VRT %s' % vrt_filename
+        band_stack_dataset.SetMetadata(self.get_dataset_metadata())
+        band_metadata_list = self.get_band_metadata_list()
+        for band_index, band_metadata in enumerate(band_metadata_list):
+            band_number = band_index + 1
             band = band_stack_dataset.GetRasterBand(band_number)
-            band.SetMetadata \
-                ({'name': band_info['band_name'],
-                  'filename': self.source_file_list[band_number - 1]})
-            if self.nodata_list[band_number - 1] is not None:
-                band.SetNoDataValue(self.nodata_list[band_number - 1])
+            band.SetMetadata(band_metadata)
+            if self.nodata_list[band_index] is not None:
+                band.SetNoDataValue(self.nodata_list[band_index])
             band_stack_dataset.FlushCache()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -41,9 +41,8 @@ import glob
 import re
 
 from EOtools.DatasetDrivers import SceneDataset
-from EOtools.execute import execute
 
-from agdc.cube_util import DatasetError
+from agdc.cube_util import DatasetError, get_directory_size_kb
 from agdc.abstract_ingester import AbstractDataset
 from landsat_bandstack import LandsatBandstack
 
@@ -115,17 +114,7 @@ class LandsatDataset(AbstractDataset):
     def _get_directory_size(self):
         """Calculate the size of the dataset in kB."""
 
-        command = "du -sk %s | cut -f1" % self.get_dataset_path()
-        LOGGER.debug('executing "%s"', command)
-        result = execute(command)
-
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to calculate directory size: ' +
-                               '"%s" failed: %s' % (command, result['stderr']))
-
-        LOGGER.debug('stdout = %s', result['stdout'])
-
-        return int(result['stdout'])
+        return get_directory_size_kb(self.get_dataset_path())
 
     def _get_gcp_count(self):
         """Count the gcp (only for level 1 datasets)."""
@@ -0,0 +1,929 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+    lock_manager.py - object locks for the datacube.
+
+    Locks are used to stop separate processes working on the same
+    object (a dataset, tile or output file) at the same time. Lock
+    operations must commit independently of any transaction the caller
+    has open, so they use their own autocommit connections. These are
+    kept in a small pool rather than opened for each operation, and
+    each operation is a single statement.
+
+    Two lock modes are supported. In 'table' mode (the default) locks
+    are rows in the lock table, keyed on (lock_type_id, lock_object).
+    In 'advisory' mode PostgreSQL session advisory locks are used
+    instead, keyed on lock_type_id and a hash of lock_object. These are
+    held by a single persistent connection, and are released by the
+    server if the process dies. Advisory mode needs a direct (or
+    session pooled) connection to the server, and does not support
+    lock status or detail.
+
+    In either mode, releasing a lock sends a notification on the
+    LOCK_CHANNEL channel, so that processes waiting for the lock (see
+    LockManager.listener) can retry straight away instead of polling.
+
+    In table mode locks are leases: each lock row has an expiry time
+    (lock_expiry), which a background heartbeat thread keeps extending
+    while the lock is held. If the owning process dies its leases
+    expire, after which the locks can be taken over by another process
+    or removed with clear_expired_locks. A lease of zero (or None)
+    gives locks which never expire. The lock_expiry column is added to
+    existing databases by database/lock_lease.sql; on a database without
+    it, leases are turned off (with a warning) and the UNLEASED
+    statements are used.
+"""
+
+import os
+import datetime
+import time
+import select
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+
+from EOtools.utils import log_multiline
+
+#
+# Set up logger
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+LOCK_MODE_TABLE = 'table'
+LOCK_MODE_ADVISORY = 'advisory'
+LOCK_MODES = (LOCK_MODE_TABLE, LOCK_MODE_ADVISORY)
+
+# Default maximum number of idle connections kept in the pool.
+LOCK_POOL_SIZE = 2
+
+# Default lease time for table locks, in seconds. Held leases are
+# renewed every LEASE_RENEW_FRACTION of this.
+LOCK_LEASE = 300
+LEASE_RENEW_FRACTION = 1.0/3
+
+# Notification channel for released locks. The payload is
+# '<lock_type_id>:<lock_object>'.
+LOCK_CHANNEL = 'agdc_lock'
+
+#
+# SQL
+#
+
+# Take or re-take a lock in the lock table. A row is returned only if
+# this owner holds the lock afterwards. An expired lease may be taken
+# over from another owner: the row is locked by the update, so only one
+# process can succeed.
+TABLE_LOCK_SQL = """-- Insert lock record, or update it if not owned, owned by this process or expired
+insert into lock(
+  lock_type_id,
+  lock_object,
+  lock_owner,
+  lock_status_id,
+  lock_detail,
+  lock_expiry)
+values(
+  %(lock_type_id)s,
+  %(lock_object)s,
+  %(lock_owner)s,
+  %(lock_status_id)s,
+  %(lock_detail)s,
+  now() + %(lease)s::interval)
+on conflict (lock_type_id, lock_object) do update
+set lock_owner = excluded.lock_owner,
+  lock_status_id = excluded.lock_status_id,
+  lock_detail = excluded.lock_detail,
+  lock_expiry = excluded.lock_expiry
+where lock.lock_owner is null
+  or lock.lock_owner = excluded.lock_owner
+  or lock.lock_expiry < now()
+returning lock_owner;
+"""
+
+# Take or re-take locks on a list of objects, in sorted order so that
+# competing processes wait on each other rather than deadlocking. Run
+# in a transaction, which is rolled back unless a row is returned for
+# every object.
+TABLE_LOCK_LIST_SQL = """-- Insert or update lock records for a list of objects
+insert into lock(
+  lock_type_id,
+  lock_object,
+  lock_owner,
+  lock_expiry)
+select
+  %(lock_type_id)s,
+  lock_object,
+  %(lock_owner)s,
+  now() + %(lease)s::interval
+  from unnest(%(lock_objects)s::text[]) as lock_object
+  order by lock_object
+on conflict (lock_type_id, lock_object) do update
+set lock_owner = excluded.lock_owner,
+  lock_status_id = null,
+  lock_detail = null,
+  lock_expiry = excluded.lock_expiry
+where lock.lock_owner is null
+  or lock.lock_owner = excluded.lock_owner
+  or lock.lock_expiry < now()
+returning lock_object;
+"""
+
+# Extend the leases on locks held by this owner, returning the locks
+# still held.
+TABLE_RENEW_SQL = """-- Renew lock leases held by this process
+update lock
+set lock_expiry = now() + %(lease)s::interval
+where lock_owner = %(lock_owner)s
+  and (lock_type_id, lock_object) in
+    (select * from unnest(%(lock_type_ids)s::integer[],
+                          %(lock_objects)s::text[]))
+returning lock_type_id, lock_object;
+"""
+
+# Delete a lock owned by this owner, notifying any waiters. The first
+# column is true if the object is no longer locked (by anyone).
+TABLE_UNLOCK_SQL = """-- Delete lock object if it is owned by this process
+with deleted as (
+  delete from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and lock_owner = %(lock_owner)s
+  returning lock_type_id, lock_object),
+notified as (
+  select pg_notify('""" + LOCK_CHANNEL + """',
+                   lock_type_id || ':' || lock_object)
+  from deleted)
+select not exists (
+  select 1 from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and (lock_owner is null or lock_owner <> %(lock_owner)s)
+    and (lock_expiry is null or lock_expiry >= now())),
+  (select count(*) from notified);
+"""
+
+TABLE_UNLOCK_LIST_SQL = """-- Delete lock objects owned by this process
+with deleted as (
+  delete from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = any(%(lock_objects)s::text[])
+    and lock_owner = %(lock_owner)s
+  returning lock_type_id, lock_object)
+select count(pg_notify('""" + LOCK_CHANNEL + """',
+                       lock_type_id || ':' || lock_object))
+from deleted;
+"""
+
+# Expired leases are ignored.
+TABLE_CHECK_SQL = """-- Select lock record if it exists
+select
+  lock_object,
+  lock_owner,
+  lock_status_id,
+  lock_detail
+  from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and (%(lock_status_id)s is null or lock_status_id = %(lock_status_id)s)
+    and (%(lock_owner)s is null or lock_owner = %(lock_owner)s)
+    and (lock_expiry is null or lock_expiry >= now());
+"""
+
+TABLE_CLEAR_SQL = """-- Delete ALL lock objects matching any supplied parameters
+with deleted as (
+  delete from lock
+  where (%(lock_type_id)s is null or lock_type_id = %(lock_type_id)s)
+    and (%(lock_object)s is null or lock_object = %(lock_object)s)
+    and (%(lock_owner)s is null or lock_owner = %(lock_owner)s)
+  returning lock_type_id, lock_object)
+select count(pg_notify('""" + LOCK_CHANNEL + """',
+                       lock_type_id || ':' || lock_object))
+from deleted;
+"""
+
+# Lock table statements used when leases are turned off, or the lock
+# table has no lock_expiry column.
+UNLEASED_LOCK_SQL = """-- Insert lock record, or update it if not owned or owned by this process
+insert into lock(
+  lock_type_id,
+  lock_object,
+  lock_owner,
+  lock_status_id,
+  lock_detail)
+values(
+  %(lock_type_id)s,
+  %(lock_object)s,
+  %(lock_owner)s,
+  %(lock_status_id)s,
+  %(lock_detail)s)
+on conflict (lock_type_id, lock_object) do update
+set lock_owner = excluded.lock_owner,
+  lock_status_id = excluded.lock_status_id,
+  lock_detail = excluded.lock_detail
+where lock.lock_owner is null or lock.lock_owner = excluded.lock_owner
+returning lock_owner;
+"""
+
+UNLEASED_LOCK_LIST_SQL = """-- Insert or update lock records for a list of objects
+insert into lock(
+  lock_type_id,
+  lock_object,
+  lock_owner)
+select
+  %(lock_type_id)s,
+  lock_object,
+  %(lock_owner)s
+  from unnest(%(lock_objects)s::text[]) as lock_object
+  order by lock_object
+on conflict (lock_type_id, lock_object) do update
+set lock_owner = excluded.lock_owner,
+  lock_status_id = null,
+  lock_detail = null
+where lock.lock_owner is null or lock.lock_owner = excluded.lock_owner
+returning lock_object;
+"""
+
+UNLEASED_UNLOCK_SQL = """-- Delete lock object if it is owned by this process
+with deleted as (
+  delete from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and lock_owner = %(lock_owner)s
+  returning lock_type_id, lock_object),
+notified as (
+  select pg_notify('""" + LOCK_CHANNEL + """',
+                   lock_type_id || ':' || lock_object)
+  from deleted)
+select not exists (
+  select 1 from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and (lock_owner is null or lock_owner <> %(lock_owner)s)),
+  (select count(*) from notified);
+"""
+
+UNLEASED_CHECK_SQL = """-- Select lock record if it exists
+select
+  lock_object,
+  lock_owner,
+  lock_status_id,
+  lock_detail
+  from lock
+  where lock_type_id = %(lock_type_id)s
+    and lock_object = %(lock_object)s
+    and (%(lock_status_id)s is null or lock_status_id = %(lock_status_id)s)
+    and (%(lock_owner)s is null or lock_owner = %(lock_owner)s);
+"""
+
+# True if the lock table has the lock_expiry column (see
+# database/lock_lease.sql).
+LOCK_EXPIRY_COLUMN_SQL = """-- Check for the lock_expiry column
+select exists (
+  select 1 from pg_attribute
+  where attrelid = 'lock'::regclass
+    and attname = 'lock_expiry'
+    and not attisdropped);
+"""
+
+TABLE_CLEAR_EXPIRED_SQL = """-- Delete lock objects whose lease has expired
+with deleted as (
+  delete from lock
+  where (%(lock_type_id)s is null or lock_type_id = %(lock_type_id)s)
+    and lock_expiry < now()
+  returning lock_type_id, lock_object)
+select count(pg_notify('""" + LOCK_CHANNEL + """',
+                       lock_type_id || ':' || lock_object))
+from deleted;
+"""
+
+ADVISORY_LOCK_SQL = """-- Take a session advisory lock
+select pg_try_advisory_lock(%(lock_type_id)s, hashtext(%(lock_object)s));
+"""
+
+# Try each advisory lock in sorted order, returning the objects locked.
+ADVISORY_LOCK_LIST_SQL = """-- Take session advisory locks on a list of objects
+select lock_object
+  from (select lock_object
+          from unnest(%(lock_objects)s::text[]) as lock_object
+          order by lock_object) as sorted
+  where pg_try_advisory_lock(%(lock_type_id)s, hashtext(lock_object));
+"""
+
+ADVISORY_UNLOCK_SQL = """-- Release a session advisory lock held by this session
+select pg_advisory_unlock(%(lock_type_id)s, hashtext(%(lock_object)s)),
+  pg_notify('""" + LOCK_CHANNEL + """',
+            %(lock_type_id)s || ':' || %(lock_object)s);
+"""
+
+ADVISORY_UNLOCK_LIST_SQL = """-- Release session advisory locks on a list of objects
+select count(pg_advisory_unlock(%(lock_type_id)s, hashtext(lock_object))),
+  count(pg_notify('""" + LOCK_CHANNEL + """',
+                  %(lock_type_id)s || ':' || lock_object))
+  from unnest(%(lock_objects)s::text[]) as lock_object;
+"""
+
+# The two key form of the advisory lock functions appears in pg_locks
+# with the keys as classid and objid, and objsubid = 2.
+ADVISORY_CHECK_SQL = """-- Find the session holding an advisory lock
+select pid
+  from pg_locks
+  where locktype = 'advisory'
+    and classid = %(lock_type_id)s::integer::oid
+    and objid = hashtext(%(lock_object)s)::oid
+    and objsubid = 2
+    and granted;
+"""
+
+ADVISORY_CLEAR_SQL = """-- Release all session advisory locks held by this session
+select pg_advisory_unlock_all(),
+  pg_notify('""" + LOCK_CHANNEL + """', '');
+"""
+
+
+class LockManager(object):
+    """Takes and releases object locks using pooled connections.
+
+    connection_factory is called with no arguments to make a new
+    autocommit connection. lock_owner identifies this process in the
+    lock table. lease is the lease time for table locks in seconds.
+    """
+
+    def __init__(self, connection_factory, lock_owner,
+                 pool_size=LOCK_POOL_SIZE, lock_mode=LOCK_MODE_TABLE,
+                 lease=LOCK_LEASE):
+
+        assert lock_mode in LOCK_MODES, \
+            "Unknown lock_mode '%s': expected one of %s." % \
+            (lock_mode, ', '.join(LOCK_MODES))
+
+        self.connection_factory = connection_factory
+        self.lock_owner = lock_owner
+        self.pool_size = pool_size
+        self.lock_mode = lock_mode
+        self.lease = (datetime.timedelta(seconds=lease) if lease else None)
+        self.lease_checked = False
+
+        self.pool_lock = threading.Lock()
+        self.pool_pid = os.getpid()
+        self.idle_list = []
+
+        # Advisory locks belong to the session that took them, so they
+        # are all taken and released on one connection.
+        self.advisory_lock = threading.Lock()
+        self.advisory_connection = None
+
+        # Table locks held by this process, as (lock_type_id, lock_object)
+        # tuples, whose leases are renewed by the heartbeat thread.
+        self.held_set = set()
+        self.heartbeat_thread = None
+        self.heartbeat_stop = threading.Event()
+
+    def close(self):
+        """Stop the heartbeat and close the pooled connections.
+
+        In advisory mode this releases any locks still held.
+        """
+
+        self.heartbeat_stop.set()
+
+        with self.pool_lock:
+            if self.pool_pid == os.getpid():
+                for connection in self.idle_list:
+                    connection.close()
+                if self.advisory_connection is not None:
+                    self.advisory_connection.close()
+            self.idle_list = []
+            self.advisory_connection = None
+
+    @contextmanager
+    def connection(self):
+        """Context manager lending a pooled autocommit connection.
+
+        Connections inherited from a parent process (after a fork) are
+        discarded without being closed, since they belong to the parent.
+        A connection which raises a database error is also discarded.
+        """
+
+        connection = self.__checkout()
+        try:
+            yield connection
+        except psycopg2.Error:
+            connection.close()
+            raise
+        else:
+            self.__checkin(connection)
+
+    def lock_object(self, lock_object, lock_type_id=1, lock_status_id=None,
+                    lock_detail=None):
+        """Lock lock_object, returning True if this process holds the
+        lock afterwards and False otherwise."""
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_object': lock_object,
+                  'lock_owner': self.lock_owner,
+                  'lock_status_id': lock_status_id,
+                  'lock_detail': lock_detail,
+                  'lease': self.lease
+                  }
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            result = self.__advisory_execute(ADVISORY_LOCK_SQL, params)[0]
+        else:
+            with self.connection() as connection:
+                sql = (TABLE_LOCK_SQL if self.__use_leases(connection)
+                       else UNLEASED_LOCK_SQL)
+                result = self.__execute(connection, sql,
+                                        params) is not None
+            if result:
+                self.__hold([(lock_type_id, lock_object)])
+
+        if result:
+            LOGGER.debug('Locked object %s', lock_object)
+        else:
+            LOGGER.debug('Unable to lock object %s', lock_object)
+
+        return result
+
+    def unlock_object(self, lock_object, lock_type_id=1):
+        """Release this process's lock on lock_object, returning True if
+        the object is no longer locked."""
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_object': lock_object,
+                  'lock_owner': self.lock_owner
+                  }
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            self.__advisory_execute(ADVISORY_UNLOCK_SQL, params)
+            result = not self.check_object_locked(lock_object, lock_type_id)
+        else:
+            self.__release([(lock_type_id, lock_object)])
+            with self.connection() as connection:
+                sql = (TABLE_UNLOCK_SQL if self.__use_leases(connection)
+                       else UNLEASED_UNLOCK_SQL)
+                result = self.__execute(connection, sql, params)[0]
+
+        if result:
+            LOGGER.debug('Unlocked object %s', lock_object)
+        else:
+            LOGGER.debug('Unable to unlock object %s', lock_object)
+
+        return result
+
+    def lock_objects(self, lock_object_list, lock_type_id=1):
+        """Lock all the objects in lock_object_list, or none of them.
+
+        Returns True if this process holds all the locks afterwards. If
+        any of the objects is locked by another process no locks are
+        taken and False is returned. Lock status and detail are not set.
+
+        However many objects there are, the locks are taken by a single
+        statement. In table mode the statement runs in its own
+        transaction (BEGIN, the insert, then COMMIT or ROLLBACK), which
+        is rolled back unless every lock was taken. That keeps the batch
+        all or nothing even for objects this process already holds.
+        Deleting a partial batch afterwards could release those objects.
+        """
+
+        lock_object_list = sorted(set(lock_object_list))
+        if not lock_object_list:
+            return True
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_objects': lock_object_list,
+                  'lock_owner': self.lock_owner,
+                  'lease': self.lease
+                  }
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            locked_list = self.__advisory_execute(ADVISORY_LOCK_LIST_SQL,
+                                                  params, fetch_all=True)
+            result = len(locked_list) == len(lock_object_list)
+            if locked_list and not result:
+                params['lock_objects'] = [row[0] for row in locked_list]
+                self.__advisory_execute(ADVISORY_UNLOCK_LIST_SQL, params)
+        else:
+            with self.connection() as connection:
+                sql = (TABLE_LOCK_LIST_SQL if self.__use_leases(connection)
+                       else UNLEASED_LOCK_LIST_SQL)
+                connection.autocommit = False
+                try:
+                    locked_list = self.__execute(connection, sql,
+                                                 params, fetch_all=True)
+                    result = len(locked_list) == len(lock_object_list)
+                    if result:
+                        connection.commit()
+                    else:
+                        connection.rollback()
+                except:
+                    connection.rollback()
+                    raise
+                finally:
+                    connection.autocommit = True
+            if result:
+                self.__hold([(lock_type_id, lock_object)
+                             for lock_object in lock_object_list])
+
+        if result:
+            LOGGER.debug('Locked objects %s', lock_object_list)
+        else:
+            LOGGER.debug('Unable to lock objects %s', lock_object_list)
+
+        return result
+
+    def unlock_objects(self, lock_object_list, lock_type_id=1):
+        """Release this process's locks on the objects in
+        lock_object_list."""
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_objects': sorted(set(lock_object_list)),
+                  'lock_owner': self.lock_owner
+                  }
+
+        if not params['lock_objects']:
+            return
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            self.__advisory_execute(ADVISORY_UNLOCK_LIST_SQL, params)
+        else:
+            self.__release([(lock_type_id, lock_object)
+                            for lock_object in params['lock_objects']])
+            with self.connection() as connection:
+                self.__execute(connection, TABLE_UNLOCK_LIST_SQL, params)
+
+        LOGGER.debug('Unlocked objects %s', params['lock_objects'])
+
+    def check_object_locked(self, lock_object, lock_type_id=1,
+                            lock_status_id=None, lock_owner=None,
+                            connection=None):
+        """Return a dictionary describing the lock on lock_object, or
+        None if it is not locked.
+
+        The lock must also match lock_status_id and lock_owner if they
+        are given. In advisory mode the lock status is not recorded, and
+        the owner is only known for this process's own locks (it is
+        given as 'pid:<backend pid>' for others).
+        """
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_object': lock_object,
+                  'lock_owner': lock_owner,
+                  'lock_status_id': lock_status_id
+                  }
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            return self.__advisory_check(params)
+
+        if connection is not None:
+            record = self.__check(connection, params)
+        else:
+            with self.connection() as connection:
+                record = self.__check(connection, params)
+
+        if record is None:
+            return None
+
+        return {'lock_type_id': lock_type_id,
+                'lock_object': record[0],
+                'lock_owner': record[1],
+                'lock_status_id': record[2],
+                'lock_detail': record[3]
+                }
+
+    def clear_all_locks(self, lock_object=None, lock_type_id=1,
+                        lock_owner=None):
+        """Remove all locks matching the parameters given.
+
+        USE WITH CAUTION - This will affect all processes using the
+        specified lock type. In advisory mode only the locks of this
+        process can be cleared.
+        """
+
+        params = {'lock_type_id': lock_type_id,
+                  'lock_object': lock_object,
+                  'lock_owner': lock_owner
+                  }
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            self.__advisory_execute(ADVISORY_CLEAR_SQL, params)
+        else:
+            if lock_owner is None or lock_owner == self.lock_owner:
+                self.__release([key for key in list(self.held_set)
+                                if lock_type_id in (None, key[0]) and
+                                lock_object in (None, key[1])])
+            with self.connection() as connection:
+                self.__execute(connection, TABLE_CLEAR_SQL, params)
+
+    def clear_expired_locks(self, lock_type_id=None):
+        """Remove all table locks (of lock_type_id, if given) whose lease
+        has expired, returning the number removed.
+
+        Unlike clear_all_locks this is safe to run at any time, since
+        the owners of expired locks are presumed dead. Locks without a
+        lease are left alone.
+        """
+
+        if self.lock_mode == LOCK_MODE_ADVISORY:
+            return 0
+
+        params = {'lock_type_id': lock_type_id}
+        with self.connection() as connection:
+            if not self.__has_expiry_column(connection):
+                return 0
+            count = self.__execute(connection, TABLE_CLEAR_EXPIRED_SQL,
+                                   params)[0]
+
+        if count:
+            LOGGER.info('Removed %d expired locks', count)
+
+        return count
+
+    def renew_leases(self):
+        """Extend the leases of the table locks held by this process.
+
+        This is called regularly by the heartbeat thread. A lock which
+        is no longer held (because its lease expired and it was taken
+        over) is logged and forgotten.
+        """
+
+        with self.pool_lock:
+            held_list = sorted(self.held_set)
+
+        if not held_list or self.lease is None:
+            return
+
+        params = {'lock_owner': self.lock_owner,
+                  'lease': self.lease,
+                  'lock_type_ids': [key[0] for key in held_list],
+                  'lock_objects': [key[1] for key in held_list]
+                  }
+        with self.connection() as connection:
+            renewed_list = self.__execute(connection, TABLE_RENEW_SQL,
+                                          params, fetch_all=True)
+
+        lost_set = set(held_list) - set(tuple(row) for row in renewed_list)
+        if lost_set:
+            LOGGER.warning('Lock leases lost: %s', sorted(lost_set))
+            self.__release(lost_set)
+
+    @contextmanager
+    def listener(self):
+        """Context manager listening for released locks.
+
+        This yields a LockListener on a pooled connection. Listening
+        starts before the with block is entered, so a lock released
+        after a failed attempt to take it (inside the block) is not
+        missed.
+        """
+
+        with self.connection() as connection:
+            listener = LockListener(connection)
+            try:
+                yield listener
+            finally:
+                listener.close()
+
+    #
+    # Private methods
+    #
+
+    def __use_leases(self, connection):
+        """Return True if table locks are leased.
+
+        Leases are turned off, with a warning, the first time this finds
+        that the lock table has no lock_expiry column.
+        """
+
+        if self.lease is not None and not self.lease_checked:
+            if not self.__has_expiry_column(connection):
+                LOGGER.warning('The lock table has no lock_expiry column '
+                               '(see database/lock_lease.sql): '
+                               'locks will not be leased')
+                self.lease = None
+            self.lease_checked = True
+
+        return self.lease is not None
+
+    def __has_expiry_column(self, connection):
+        """Return True if the lock table has the lock_expiry column."""
+
+        return self.__execute(connection, LOCK_EXPIRY_COLUMN_SQL, {})[0]
+
+    def __check(self, connection, params):
+        """Return the lock table row matching params, or None."""
+
+        sql = (TABLE_CHECK_SQL if self.__use_leases(connection)
+               else UNLEASED_CHECK_SQL)
+        return self.__execute(connection, sql, params)
+
+    def __checkout(self):
+        """Take an idle connection from the pool, or make a new one."""
+
+        with self.pool_lock:
+            self.__check_pid()
+            if self.idle_list:
+                return self.idle_list.pop()
+
+        return self.connection_factory()
+
+    def __checkin(self, connection):
+        """Return a connection to the pool, closing it if the pool is
+        full."""
+
+        with self.pool_lock:
+            self.__check_pid()
+            if (not connection.closed and
+                    len(self.idle_list) < self.pool_size):
+                self.idle_list.append(connection)
+                return
+
+        connection.close()
+
+    def __check_pid(self):
+        """Forget connections (and locks) inherited from a parent process."""
+
+        if self.pool_pid != os.getpid():
+            self.pool_pid = os.getpid()
+            self.idle_list = []
+            self.advisory_connection = None
+            self.held_set = set()
+            self.heartbeat_thread = None
+
+    def __hold(self, key_list):
+        """Record table locks as held, starting the heartbeat thread if
+        it is not already running."""
+
+        if self.lease is None:
+            return
+
+        with self.pool_lock:
+            self.__check_pid()
+            self.held_set.update(key_list)
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(
+                    target=self.__heartbeat,
+                    name='lock-heartbeat')
+                self.heartbeat_thread.daemon = True
+                self.heartbeat_thread.start()
+
+    def __release(self, key_list):
+        """Record table locks as no longer held."""
+
+        with self.pool_lock:
+            self.held_set.difference_update(key_list)
+
+    def __heartbeat(self):
+        """Heartbeat thread: renew held leases until the manager is
+        closed."""
+
+        interval = self.lease.total_seconds() * LEASE_RENEW_FRACTION
+        while not self.heartbeat_stop.wait(interval):
+            try:
+                self.renew_leases()
+            except psycopg2.Error as err:
+                # Try again next time: the leases will not expire yet.
+                LOGGER.warning('Unable to renew lock leases: %s', err)
+
+    @staticmethod
+    def __execute(connection, sql, params, fetch_all=False):
+        """Execute sql on connection, returning the first row (or None),
+        or a list of all the rows if fetch_all is True."""
+
+        cursor = connection.cursor()
+        try:
+            log_multiline(LOGGER.debug, cursor.mogrify(sql, params),
+                          'SQL', '\t')
+            cursor.execute(sql, params)
+            return cursor.fetchall() if fetch_all else cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def __advisory_execute(self, sql, params, fetch_all=False):
+        """Execute sql on the advisory lock connection, returning the
+        first row, or all the rows if fetch_all is True."""
+
+        with self.advisory_lock:
+            with self.pool_lock:
+                self.__check_pid()
+                if self.advisory_connection is None:
+                    self.advisory_connection = self.connection_factory()
+                connection = self.advisory_connection
+
+            return self.__execute(connection, sql, params, fetch_all)
+
+    def __advisory_check(self, params):
+        """Implement check_object_locked for advisory locks."""
+
+        record = self.__advisory_execute(ADVISORY_CHECK_SQL, params)
+        if record is None:
+            return None
+
+        own_pid = self.advisory_connection.get_backend_pid()
+        lock_owner = (self.lock_owner if record[0] == own_pid
+                      else 'pid:%d' % record[0])
+        if (params['lock_owner'] is not None and
+                params['lock_owner'] != lock_owner):
+            return None
+        if params['lock_status_id'] is not None:
+            return None
+
+        return {'lock_type_id': params['lock_type_id'],
+                'lock_object': params['lock_object'],
+                'lock_owner': lock_owner,
+                'lock_status_id': None,
+                'lock_detail': None
+                }
+
+
+class LockListener(object):
+    """Waits for notifications of released locks on a connection.
+
+    Created by LockManager.listener.
+    """
+
+    def __init__(self, connection):
+
+        self.connection = connection
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute('LISTEN ' + LOCK_CHANNEL + ';')
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Stop listening, and forget any pending notifications."""
+
+        if not self.connection.closed:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute('UNLISTEN ' + LOCK_CHANNEL + ';')
+            finally:
+                cursor.close()
+        del self.connection.notifies[:]
+
+    def wait(self, timeout, lock_object_list=None, lock_type_id=1):
+        """Wait up to timeout seconds for a lock to be released.
+
+        Returns True as soon as one of the objects in lock_object_list
+        (or any object, if it is None) is released, or False if the
+        timeout expires first.
+        """
+
+        if lock_object_list is None:
+            wanted_set = None
+        else:
+            wanted_set = set('%s:%s' % (lock_type_id, lock_object)
+                             for lock_object in lock_object_list)
+
+        deadline = time.time() + timeout
+        while True:
+            self.connection.poll()
+            while self.connection.notifies:
+                notify = self.connection.notifies.pop(0)
+                # An empty payload means all of a process's locks
+                # have been released (see clear_all_locks).
+                if (wanted_set is None or not notify.payload or
+                        notify.payload in wanted_set):
+                    del self.connection.notifies[:]
+                    return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            select.select([self.connection], [], [], remaining)
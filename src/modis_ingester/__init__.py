@@ -37,11 +37,15 @@ import datetime
 import re
 import logging
 import argparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 from os.path import basename
 from osgeo import gdal
-from EOtools.execute import execute
+from agdc.cube_util import DatasetError
+from agdc.vrt_writer import write_vrt
 from agdc.abstract_ingester import AbstractIngester
+from agdc.abstract_ingester.dataset_walker import walk_datasets
 from modis_dataset import ModisDataset
 
 #
@@ -65,6 +69,12 @@ logging.basicConfig(stream=sys.stdout,
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# Constants
+#
+
+VRT_THREADS = 4  # Number of datasets whose VRTs are built in parallel.
+
 
 class ModisIngester(AbstractIngester):
     """Ingester class for Modis datasets."""
@@ -114,30 +124,41 @@ class ModisIngester(AbstractIngester):
         _arg_parser.add_argument('--synctype', dest='sync_type',
                                  default=None, help=sync_type_help)
 
+        # The datasets are ingested from temporary VRTs (see
+        # preprocess_dataset), so they cannot be journaled.
+        AbstractIngester.add_ingest_arguments(_arg_parser, journal=False)
+
         return _arg_parser.parse_args()
 
     def find_datasets(self, source_dir):
         """Return a list of path to the netCDF datasets under 'source_dir' or a single-item list
         if source_dir is a netCDF file path
         """
+
+        dataset_list = sorted(self.iter_datasets(source_dir))
+
+        LOGGER.debug('dataset_list = %s', dataset_list)
+        return dataset_list
+
+    def iter_datasets(self, source_dir):
+        """Generate the paths to the netCDF datasets under 'source_dir' as
+        they are found (see find_datasets).
+        """
         
         # Allow an individual netCDF file to be nominated as the source
         if os.path.isfile(source_dir) and source_dir.endswith(".nc"):
-            LOGGER.debug('%s is a netCDF file')
-            return [source_dir]
+            LOGGER.debug('%s is a netCDF file', source_dir)
+            yield source_dir
+            return
 
         assert os.path.isdir(source_dir), '%s is not a directory' % source_dir
         LOGGER.info('Searching for datasets in %s', source_dir)
 
         # Get all .nc files under source_dir (all levels)
-        dataset_list = []
-        for root, _dirs, files in os.walk(source_dir):
-            dataset_list += [os.path.join(root, nc) for nc in files if nc.endswith('.nc')]
-            
-        dataset_list = sorted(dataset_list)
-        
-        LOGGER.debug('dataset_list = %s', dataset_list)
-        return dataset_list
+        for dataset_path in walk_datasets(
+                source_dir,
+                is_dataset_file=lambda name: name.endswith('.nc')):
+            yield dataset_path
 
 
     def open_dataset(self, dataset_path):
@@ -168,53 +189,59 @@ class ModisIngester(AbstractIngester):
     def preprocess_dataset(self, dataset_list):
         """Performs pre-processing on the dataset_list object.
 
-        dataset_list: list of datasets to be opened and have
-           its metadata read.
+        dataset_list: list (or other iterable) of datasets to be opened
+           and have its metadata read.
+
+        Generates the paths of the VRTs made for each dataset, so that
+        ingestion can start as soon as the first dataset is found. The
+        VRTs of up to VRT_THREADS datasets are built in parallel, ahead
+        of the dataset being ingested.
         """
 
         temp_dir = self.collection.get_temp_tile_directory()
-        vrt_list = []
-
-        for dataset_path in dataset_list:
-            fname = os.path.splitext(basename(dataset_path))[0]
-            dataset_dir = os.path.split(dataset_path)[0]
 
-            mod09_fname = temp_dir + '/' + fname + '.vrt'
-            rbq500_fname = temp_dir + '/' + fname + '_RBQ500.vrt'
+        pool = ThreadPool(VRT_THREADS)
+        try:
+            pending = deque()
+            for dataset_path in dataset_list:
+                pending.append(pool.apply_async(_write_dataset_vrts,
+                                                (dataset_path, temp_dir)))
+                if len(pending) >= VRT_THREADS:
+                    for vrt_path in pending.popleft().get():
+                        yield vrt_path
+            while pending:
+                for vrt_path in pending.popleft().get():
+                    yield vrt_path
+        finally:
+            pool.terminate()
+            pool.join()
 
-            dataset = gdal.Open(dataset_path, gdal.GA_ReadOnly)
-            subDataSets = dataset.GetSubDatasets()
-            command_string = 'gdalbuildvrt -separate -overwrite '
-            command_string += mod09_fname
 
-            command_string += ' ' + subDataSets[1][0] # band 1
-            command_string += ' ' + subDataSets[2][0] # band 2
-            command_string += ' ' + subDataSets[3][0] # band 3
-            command_string += ' ' + subDataSets[4][0] # band 4
-            command_string += ' ' + subDataSets[5][0] # band 5
-            command_string += ' ' + subDataSets[6][0] # band 6
-            command_string += ' ' + subDataSets[7][0] # band 7
+#
+# Functions
+#
 
-            result = execute(command_string=command_string)
-            if result['returncode'] != 0:
-                raise DatasetError('Unable to perform gdalbuildvrt on bands: ' +
-                                   '"%s" failed: %s'\
-                                       % (buildvrt_cmd, result['stderr']))
 
-            vrt_list.append(mod09_fname)
+def _write_dataset_vrts(dataset_path, temp_dir):
+    """Write the MOD09 and RBQ500 VRTs for the netCDF dataset at
+    dataset_path in temp_dir, returning a list of their paths."""
 
-            command_string = 'gdalbuildvrt -separate -overwrite '
-            command_string += rbq500_fname
+    fname = os.path.splitext(basename(dataset_path))[0]
 
-            command_string += ' ' + subDataSets[0][0] # 500m PQA
+    mod09_fname = temp_dir + '/' + fname + '.vrt'
+    rbq500_fname = temp_dir + '/' + fname + '_RBQ500.vrt'
 
-            result = execute(command_string=command_string)
-            if result['returncode'] != 0:
-                raise DatasetError('Unable to perform gdalbuildvrt on rbq: ' +
-                                   '"%s" failed: %s'\
-                                       % (buildvrt_cmd, result['stderr']))
+    dataset = gdal.Open(dataset_path, gdal.GA_ReadOnly)
+    if not dataset:
+        raise DatasetError('Unable to open %s' % dataset_path)
+    subDataSets = dataset.GetSubDatasets()
 
-            vrt_list.append(rbq500_fname)
+    # Bands 1 to 7
+    write_vrt(mod09_fname,
+              [subDataSets[band][0] for band in range(1, 8)],
+              separate=True)
 
-        return vrt_list
+    # 500m PQA
+    write_vrt(rbq500_fname, [subDataSets[0][0]], separate=True)
 
+    return [mod09_fname, rbq500_fname]
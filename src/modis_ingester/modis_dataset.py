@@ -42,9 +42,8 @@ import datetime
 from osgeo import gdal
 
 from EOtools.DatasetDrivers import SceneDataset
-from EOtools.execute import execute
 
-from agdc.cube_util import DatasetError
+from agdc.cube_util import DatasetError, get_directory_size_kb
 from agdc.abstract_ingester import AbstractDataset
 from modis_bandstack import ModisBandstack
 
@@ -55,6 +54,69 @@ from modis_bandstack import ModisBandstack
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+#
+# ECS metadata objects, read from the ODL text of the netCDF attributes
+# (copied from the global attributes of the input HDF file):
+#
+
+ECS_RANGE_BEGINNING_DATE = 'RANGEBEGINNINGDATE'
+ECS_RANGE_BEGINNING_TIME = 'RANGEBEGINNINGTIME'
+ECS_RANGE_ENDING_DATE = 'RANGEENDINGDATE'
+ECS_RANGE_ENDING_TIME = 'RANGEENDINGTIME'
+ECS_ORBIT_NUMBER = 'ORBITNUMBER'
+ECS_PRODUCTION_DATETIME = 'PRODUCTIONDATETIME'
+
+# An OBJECT, END_OBJECT or VALUE line of ODL text.
+ODL_LINE_PATTERN = re.compile(r'^\s*(OBJECT|END_OBJECT|VALUE)\s*=\s*(.*?)\s*$')
+
+# The cloudy percentage in the QA summary. The tab may be escaped.
+CLOUD_COVER_PATTERN = re.compile(r'Cloudy:(?:\s|\\t)*([-+.0-9eE]+)')
+
+#
+# Functions
+#
+
+
+def parse_ecs_metadata(metadata_dict):
+    """Return a dictionary of the values of the ECS metadata objects
+    found in the ODL text of the GDAL metadata items in metadata_dict.
+
+    Each object maps to the VALUE of its innermost OBJECT, without
+    quotes. The first value found for an object is kept.
+    """
+
+    ecs_dict = {}
+    for key in sorted(metadata_dict.keys()):
+        text = metadata_dict[key]
+        if 'END_OBJECT' not in text:
+            continue
+        object_stack = []
+        for line in re.split(r'\n|\\n', text):
+            matchobj = ODL_LINE_PATTERN.match(line)
+            if not matchobj:
+                continue
+            (keyword, value) = matchobj.groups()
+            if keyword == 'OBJECT':
+                object_stack.append(value)
+            elif keyword == 'END_OBJECT':
+                if object_stack:
+                    object_stack.pop()
+            elif object_stack:
+                ecs_dict.setdefault(object_stack[-1],
+                                    value.replace('\\"', '"').strip('"'))
+    return ecs_dict
+
+
+def parse_cloud_cover(metadata_dict):
+    """Return the cloudy percentage from the QA summary in the GDAL
+    metadata items in metadata_dict, or None if there is none."""
+
+    for key in sorted(metadata_dict.keys()):
+        matchobj = CLOUD_COVER_PATTERN.search(metadata_dict[key])
+        if matchobj:
+            return float(matchobj.group(1))
+    return None
+
 #
 # Class definition
 #
@@ -111,38 +173,35 @@ class ModisDataset(AbstractDataset):
         LOGGER.debug('RasterXSize = %s', self._ds.RasterXSize);
         LOGGER.debug('RasterYSize = %s', self._ds.RasterYSize);
 
-        command = "ncdump -v InputFileGlobalAttributes %s" % self._dataset_path
-        result = execute(command)
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to perform ncdump: ' +
-                               '"%s" failed: %s' % (command,
-                                                    result['stderr']))
-
-        s = re.sub(r"\s+", "", result['stdout'])
-        LOGGER.debug('%s = %s', command, s);
+        # The netCDF attributes, including those of the
+        # InputFileGlobalAttributes variable, as 'variable#attribute' items.
+        self._metadata_dict = self._ds.GetMetadata()
+        ecs_dict = parse_ecs_metadata(self._metadata_dict)
 
-        self._rangeendingdate = re.search('RANGEENDINGDATE\\\\nNUM_VAL=1\\\\nVALUE=\\\\\"(.*)\\\\\"\\\\nEND_OBJECT=RANGEENDINGDATE', s).groups(1)[0]
+        self._rangeendingdate = self._get_ecs_value(ecs_dict, ECS_RANGE_ENDING_DATE)
         LOGGER.debug('RangeEndingDate = %s', self._rangeendingdate)
         
-        self._rangeendingtime = re.search('RANGEENDINGTIME\\\\nNUM_VAL=1\\\\nVALUE=\\\\\"(.*)\\\\\"\\\\nEND_OBJECT=RANGEENDINGTIME', s).groups(1)[0]
+        self._rangeendingtime = self._get_ecs_value(ecs_dict, ECS_RANGE_ENDING_TIME)
         LOGGER.debug('RangeEndingTime = %s', self._rangeendingtime)
 
-        self._rangebeginningdate = re.search('RANGEBEGINNINGDATE\\\\nNUM_VAL=1\\\\nVALUE=\\\\\"(.*)\\\\\"\\\\nEND_OBJECT=RANGEBEGINNINGDATE', s).groups(1)[0]
+        self._rangebeginningdate = self._get_ecs_value(ecs_dict, ECS_RANGE_BEGINNING_DATE)
         LOGGER.debug('RangeBeginningDate = %s', self._rangebeginningdate)
         
-        self._rangebeginningtime = re.search('RANGEBEGINNINGTIME\\\\nNUM_VAL=1\\\\nVALUE=\\\\\"(.*)\\\\\"\\\\nEND_OBJECT=RANGEBEGINNINGTIME', s).groups(1)[0]
+        self._rangebeginningtime = self._get_ecs_value(ecs_dict, ECS_RANGE_BEGINNING_TIME)
         LOGGER.debug('RangeBeginningTime = %s', self._rangebeginningtime)
 
         self.scene_start_datetime = self._rangebeginningdate + " " + self._rangebeginningtime
         self.scene_end_datetime = self._rangeendingdate + " " + self._rangeendingtime
 
-        self._orbitnumber = int(re.search('ORBITNUMBER\\\\nCLASS=\\\\\"1\\\\\"\\\\nNUM_VAL=1\\\\nVALUE=(.*)\\\\nEND_OBJECT=ORBITNUMBER', s).groups(1)[0])
+        self._orbitnumber = int(self._get_ecs_value(ecs_dict, ECS_ORBIT_NUMBER))
         LOGGER.debug('OrbitNumber = %d', self._orbitnumber)
 
-        self._cloud_cover_percentage = float(re.search('Cloudy:\\\\t(.*)\\\\n\\\\tMixed', s).groups(1)[0])
+        self._cloud_cover_percentage = parse_cloud_cover(self._metadata_dict)
+        if self._cloud_cover_percentage is None:
+            raise DatasetError('No cloud cover found in %s' % self._dataset_path)
         LOGGER.debug('CloudCover = %f', self._cloud_cover_percentage)
 
-        self._completion_datetime = re.search('PRODUCTIONDATETIME\\\\nNUM_VAL=1\\\\nVALUE=\\\\\"(.*)Z\\\\\"\\\\nEND_OBJECT=PRODUCTIONDATETIME', s).groups(1)[0]
+        self._completion_datetime = self._get_ecs_value(ecs_dict, ECS_PRODUCTION_DATETIME).rstrip('Z')
         LOGGER.debug('ProcessedTime = %s', self._completion_datetime)
 
         self._metadata = self._ds.GetMetadata('SUBDATASETS')
@@ -178,6 +237,16 @@ class ModisDataset(AbstractDataset):
     #
     # Methods to extract extra metadata
     #
+    def _get_ecs_value(self, ecs_dict, object_name):
+        """Return the value of the ECS metadata object object_name, raising
+        a DatasetError if the dataset does not have it."""
+
+        try:
+            return ecs_dict[object_name]
+        except KeyError:
+            raise DatasetError('No %s metadata found in %s' %
+                               (object_name, self._dataset_path))
+
     def _get_datetime_from_string(self, datetime_string):
         """Determine datetime.datetime value from a string in several possible formats"""
         
@@ -205,17 +274,7 @@ class ModisDataset(AbstractDataset):
     def _get_directory_size(self):
         """Calculate the size of the dataset in kB."""
 
-        command = "du -sk %s | cut -f1" % self.get_dataset_path()
-        LOGGER.debug('executing "%s"', command)
-        result = execute(command)
-
-        if result['returncode'] != 0:
-            raise DatasetError('Unable to calculate directory size: ' +
-                               '"%s" failed: %s' % (command, result['stderr']))
-
-        LOGGER.debug('stdout = %s', result['stdout'])
-
-        return int(result['stdout'])
+        return get_directory_size_kb(self.get_dataset_path())
 
     def _get_gcp_count(self):
         """N/A for Modis."""
@@ -337,7 +396,7 @@ class ModisDataset(AbstractDataset):
 
     def get_projection(self):
         """The coordinate refererence system of the image data."""
-        return self._ds.GetMetadata()['NC_GLOBAL#crs']
+        return self._metadata_dict['NC_GLOBAL#crs']
 
     def get_ll_x(self):
         """The x coordinate of the lower left corner of the coverage area.
@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+    tile_benchmark.py - benchmarks for the tiling stage of the ingest.
+
+    The 'warp' benchmark reprojects every tile footprint touched by a
+    landsat dataset with each of the warp engines available to
+    TileContents.reproject. It reports the latency of each tile for each
+    engine, and checks that the engines produce identical tile contents.
+
+    The 'format' benchmark re-encodes a random sample of existing tiles
+    of a tile type with each of a list of candidate format options (see
+    tile_contents.parse_format_options), such as tiled layouts with
+    internal overviews and different compression. For each candidate it
+    reports the total size, the write throughput, the full-read
+    throughput and the latency of small windowed reads (as made by the
+    stacker), so that the format options of each tile type can be
+    chosen from measurements. Throughputs are in uncompressed megabytes
+    per second. The tiles are read back just after they are written, so
+    the reads measure decoding rather than disk access.
+
+    The 'coverage' benchmark times the calculation of the tiles covered
+    by a dataset (DatasetRecord.get_touched_tiles) with each coverage
+    engine, for synthetic scenes on coarse and fine tile grids, and
+    checks that the engines find the same tiles. It does not use the
+    database.
+
+    The datacube configuration file is used to find the database, which
+    supplies the tile type and band information.
+"""
+
+import os
+import sys
+import math
+import shutil
+import random
+import argparse
+import hashlib
+import logging
+from osgeo import gdal
+
+from agdc.cube_util import Stopwatch, create_directory
+from agdc.abstract_ingester import IngesterDataCube
+from agdc.abstract_ingester.collection import Collection
+from agdc.abstract_ingester.dataset_record import DatasetRecord
+from agdc.abstract_ingester.dataset_record import COVERAGE_ENGINES
+from agdc.abstract_ingester.crs_cache import get_transformation
+from agdc.abstract_ingester.tile_contents import TileContents, WARP_ENGINES
+from agdc.abstract_ingester.tile_contents import parse_format_options
+from agdc.abstract_ingester.tile_contents import build_overviews
+from agdc.landsat_ingester.landsat_dataset import LandsatDataset
+
+#
+# Set up logger.
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Candidate format options for the format benchmark. The first is the
+# usual (striped) tile format.
+#
+
+FORMAT_CANDIDATES = [
+    'COMPRESS=LZW,BIGTIFF=YES',
+    'TILED=YES,BLOCKXSIZE=512,BLOCKYSIZE=512,COMPRESS=LZW,BIGTIFF=YES',
+    'TILED=YES,BLOCKXSIZE=512,BLOCKYSIZE=512,COMPRESS=DEFLATE,PREDICTOR=2,'
+    'BIGTIFF=YES',
+    'TILED=YES,BLOCKXSIZE=512,BLOCKYSIZE=512,COMPRESS=DEFLATE,PREDICTOR=2,'
+    'BIGTIFF=YES,OVERVIEWS=2:4:8:16',
+    'TILED=YES,BLOCKXSIZE=512,BLOCKYSIZE=512,COMPRESS=ZSTD,PREDICTOR=2,'
+    'BIGTIFF=YES',
+    ]
+
+WINDOW_SEED = 42  # Seed for the windowed read positions.
+
+#
+# Cases for the coverage benchmark: (name, scene width, scene height,
+# scene rotation in degrees, tile size). Sizes are in degrees, for a
+# geographic tile grid with its origin at (0, 0).
+#
+
+COVERAGE_CASES = [
+    ('landsat, 1 deg tiles', 2.0, 1.7, 12.0, 1.0),
+    ('landsat, 0.25 deg tiles', 2.0, 1.7, 12.0, 0.25),
+    ('landsat, 0.1 deg tiles', 2.0, 1.7, 12.0, 0.1),
+    ('landsat, 0.025 deg tiles', 2.0, 1.7, 12.0, 0.025),
+    ('modis, 1 deg tiles', 10.0, 10.0, 3.0, 1.0),
+    ('modis, 0.1 deg tiles', 10.0, 10.0, 3.0, 0.1),
+    ]
+COVERAGE_CENTRE = (133.3, -24.7)  # Scene centre for the coverage cases.
+
+#
+# Utility functions
+#
+
+
+def get_candidate_footprints(dataset, tile_type_info):
+    """Return the sorted footprints of the tile type touched by the dataset.
+
+    This is the smallest rectangle of footprints containing the dataset
+    bounding box, which includes every footprint DatasetRecord.get_coverage
+    would return (and possibly a few empty ones at the corners).
+    """
+
+    mdd = dataset.metadata_dict
+    transformation = get_transformation(mdd['projection'],
+                                        tile_type_info['crs'])
+    dataset_bbox = DatasetRecord.get_bbox(transformation,
+                                          mdd['geo_transform'],
+                                          mdd['x_pixels'],
+                                          mdd['y_pixels'])
+    (definite_tiles, possible_tiles) = \
+        DatasetRecord.get_definite_and_possible_tiles(
+            dataset_bbox,
+            (tile_type_info['x_origin'], tile_type_info['y_origin']),
+            (tile_type_info['x_size'], tile_type_info['y_size'])
+            )
+
+    return sorted(definite_tiles | possible_tiles)
+
+
+def get_tile_digest(tile_path):
+    """Return an md5 digest of the georeferencing and pixels of a tile."""
+
+    tile_dataset = gdal.Open(tile_path)
+    assert tile_dataset, 'Unable to open tile %s' % tile_path
+
+    digest = hashlib.md5()
+    digest.update(repr(tile_dataset.GetGeoTransform()))
+    digest.update(tile_dataset.GetProjection())
+    for band_no in range(1, tile_dataset.RasterCount + 1):
+        band = tile_dataset.GetRasterBand(band_no)
+        digest.update(repr(band.GetNoDataValue()))
+        digest.update(band.ReadRaster())
+
+    return digest.hexdigest()
+
+
+def get_raster_bytes(tile_path):
+    """Return the uncompressed size in bytes of the bands of a tile."""
+
+    tile_dataset = gdal.Open(tile_path)
+    assert tile_dataset, 'Unable to open tile %s' % tile_path
+
+    raster_bytes = 0
+    for band_no in range(1, tile_dataset.RasterCount + 1):
+        band = tile_dataset.GetRasterBand(band_no)
+        raster_bytes += (tile_dataset.RasterXSize * tile_dataset.RasterYSize *
+                         gdal.GetDataTypeSize(band.DataType) // 8)
+
+    return raster_bytes
+
+
+def encode_tile(source_path, output_path, format_options):
+    """Write a copy of a tile with format_options (as for a tile type).
+
+    Returns None, or an error message if the copy could not be made
+    (e.g. the options ask for a compression this GDAL does not have).
+    """
+
+    (creation_option_list, dummy_overview_list, dummy_resampling) = \
+        parse_format_options(format_options)
+
+    gdal.PushErrorHandler('CPLQuietErrorHandler')
+    try:
+        gdal.ErrorReset()
+        tile_dataset = gdal.Translate(output_path, source_path,
+                                      format='GTiff',
+                                      creationOptions=creation_option_list)
+        if tile_dataset is None:
+            return gdal.GetLastErrorMsg() or 'Unknown error'
+        tile_dataset = None # Close to flush the tile to disk
+    finally:
+        gdal.PopErrorHandler()
+
+    build_overviews(output_path, format_options)
+    return None
+
+
+def read_tile(tile_path):
+    """Read all the bands of a tile."""
+
+    tile_dataset = gdal.Open(tile_path)
+    assert tile_dataset, 'Unable to open tile %s' % tile_path
+    for band_no in range(1, tile_dataset.RasterCount + 1):
+        tile_dataset.GetRasterBand(band_no).ReadRaster()
+
+
+def read_tile_windows(tile_path, window_list, window_size):
+    """Read each window (x_offset, y_offset) of a tile, from every band.
+
+    Returns a list of the read latencies in seconds.
+    """
+
+    tile_dataset = gdal.Open(tile_path)
+    assert tile_dataset, 'Unable to open tile %s' % tile_path
+    band_list = [tile_dataset.GetRasterBand(band_no)
+                 for band_no in range(1, tile_dataset.RasterCount + 1)]
+
+    latency_list = []
+    for (x_offset, y_offset) in window_list:
+        stopwatch = Stopwatch()
+        stopwatch.start()
+        for band in band_list:
+            band.ReadRaster(x_offset, y_offset, window_size, window_size)
+        stopwatch.stop()
+        latency_list.append(stopwatch.read()[0])
+
+    return latency_list
+
+
+def make_scene_bbox(centre, width, height, rotation):
+    """Return the corners of a rotated rectangular scene, clockwise from
+    the upper left (as for DatasetRecord.get_bbox)."""
+
+    (x_centre, y_centre) = centre
+    cos_angle = math.cos(math.radians(rotation))
+    sin_angle = math.sin(math.radians(rotation))
+    corner_list = [(-width / 2.0, height / 2.0), (width / 2.0, height / 2.0),
+                   (width / 2.0, -height / 2.0), (-width / 2.0, -height / 2.0)]
+    return [(x_centre + x * cos_angle + y * sin_angle,
+             y_centre - x * sin_angle + y * cos_angle)
+            for (x, y) in corner_list]
+
+
+def mean_and_median(value_list):
+    """Return a tuple (mean, median) for a non-empty list of numbers."""
+
+    sorted_list = sorted(value_list)
+    count = len(sorted_list)
+    mean = sum(sorted_list) / count
+    if count % 2:
+        median = sorted_list[count // 2]
+    else:
+        median = (sorted_list[count // 2 - 1] + sorted_list[count // 2]) / 2.0
+
+    return (mean, median)
+
+#
+# Benchmarks
+#
+
+
+def benchmark_warp(collection, dataset, tile_type_id, repeat,
+                   output=sys.stdout):
+    """Time the reprojection of each tile of dataset with each warp engine.
+
+    Each tile is warped 'repeat' times with each engine and the fastest
+    time is reported (to reduce the influence of other activity on the
+    node). Returns True if the engines produced identical tiles.
+    """
+
+    tile_type_info = collection.datacube.tile_type_dict[tile_type_id]
+    band_dict = collection.new_bands[
+        collection.get_dataset_key(dataset)][tile_type_id]
+    band_stack = dataset.stack_bands(band_dict)
+    band_stack.buildvrt(collection.get_temp_tile_directory())
+
+    footprint_list = get_candidate_footprints(dataset, tile_type_info)
+
+    latency_dict = {}
+    digest_dict = {}
+    for warp_engine in WARP_ENGINES:
+        for tile_footprint in footprint_list:
+            tile_contents = TileContents(collection.datacube.tile_root,
+                                         tile_type_info,
+                                         tile_footprint,
+                                         band_stack,
+                                         warp_engine=warp_engine)
+            time_list = []
+            for dummy_count in range(repeat):
+                stopwatch = Stopwatch()
+                stopwatch.start()
+                tile_contents.reproject()
+                stopwatch.stop()
+                time_list.append(stopwatch.read()[0])
+
+            key = (warp_engine, tile_footprint)
+            latency_dict[key] = min(time_list)
+            digest_dict[key] = \
+                get_tile_digest(tile_contents.temp_tile_output_path)
+            tile_contents.remove()
+
+    all_identical = True
+    output.write('Warp latency (seconds) for %s, tile type %d\n' %
+                 (dataset.get_dataset_path(), tile_type_id))
+    output.write('%-12s' % 'footprint' +
+                 ''.join(['%12s' % engine for engine in WARP_ENGINES]) +
+                 '  identical\n')
+    for tile_footprint in footprint_list:
+        digest_set = set([digest_dict[(engine, tile_footprint)]
+                          for engine in WARP_ENGINES])
+        identical = len(digest_set) == 1
+        all_identical = all_identical and identical
+        output.write('%-12s' % ('%d,%d' % tile_footprint) +
+                     ''.join(['%12.3f' % latency_dict[(engine, tile_footprint)]
+                              for engine in WARP_ENGINES]) +
+                     '  %s\n' % ('yes' if identical else 'NO'))
+
+    for warp_engine in WARP_ENGINES:
+        (mean, median) = mean_and_median(
+            [latency_dict[(warp_engine, tile_footprint)]
+             for tile_footprint in footprint_list])
+        output.write('%s: %d tiles, mean %.3f s, median %.3f s per tile\n' %
+                     (warp_engine, len(footprint_list), mean, median))
+
+    output.write('Tiles identical for all engines: %s\n' %
+                 ('yes' if all_identical else 'NO'))
+
+    return all_identical
+
+
+def benchmark_format(collection, tile_type_id, sample_size, candidate_list,
+                     window_count, window_size, output=sys.stdout):
+    """Time writing and reading a sample of tiles with each candidate
+    format options string.
+
+    Returns True if every candidate could be written.
+    """
+
+    tile_path_list = [
+        tile_path for tile_path in
+        collection.db.get_sample_tile_pathnames(tile_type_id, sample_size)
+        if os.path.splitext(tile_path)[1].lower() in ('.tif', '.tiff')
+        ]
+    if not tile_path_list:
+        output.write('No GeoTIFF tiles found for tile type %d\n' %
+                     tile_type_id)
+        return False
+
+    # The same windows are read from each version of a tile.
+    window_random = random.Random(WINDOW_SEED)
+    window_dict = {}
+    raster_bytes = 0
+    for tile_path in tile_path_list:
+        tile_dataset = gdal.Open(tile_path)
+        assert tile_dataset, 'Unable to open tile %s' % tile_path
+        x_max = max(0, tile_dataset.RasterXSize - window_size)
+        y_max = max(0, tile_dataset.RasterYSize - window_size)
+        window_dict[tile_path] = [(window_random.randint(0, x_max),
+                                   window_random.randint(0, y_max))
+                                  for dummy_count in range(window_count)]
+        raster_bytes += get_raster_bytes(tile_path)
+    raster_mb = raster_bytes / 1048576.0
+
+    work_dir = os.path.join(collection.get_temp_tile_directory(),
+                            'format_benchmark')
+    create_directory(work_dir)
+
+    all_written = True
+    output.write('Tile formats for %d tiles of tile type %d ' %
+                 (len(tile_path_list), tile_type_id) +
+                 '(%.1f MB uncompressed)\n' % raster_mb)
+    output.write('%-4s%10s%8s%10s%10s%12s%12s\n' %
+                 ('', 'size MB', 'ratio', 'write/s', 'read/s',
+                  'window ms', 'median ms'))
+    try:
+        for (index, format_options) in enumerate(candidate_list):
+            write_time = 0.0
+            read_time = 0.0
+            size_bytes = 0
+            latency_list = []
+            error_message = None
+            for (tile_no, tile_path) in enumerate(tile_path_list):
+                output_path = os.path.join(work_dir, 'tile%d.tif' % tile_no)
+
+                stopwatch = Stopwatch()
+                stopwatch.start()
+                error_message = encode_tile(tile_path, output_path,
+                                            format_options)
+                stopwatch.stop()
+                if error_message is not None:
+                    break
+                write_time += stopwatch.read()[0]
+                size_bytes += os.path.getsize(output_path)
+
+                stopwatch = Stopwatch()
+                stopwatch.start()
+                read_tile(output_path)
+                stopwatch.stop()
+                read_time += stopwatch.read()[0]
+
+                latency_list += read_tile_windows(output_path,
+                                                  window_dict[tile_path],
+                                                  window_size)
+                os.remove(output_path)
+
+            if error_message is not None:
+                all_written = False
+                output.write('%-4s  unable to write: %s\n' %
+                             ('%d.' % (index + 1), error_message.strip()))
+                continue
+
+            if latency_list:
+                (mean, median) = mean_and_median(latency_list)
+            else:
+                (mean, median) = (0.0, 0.0)
+            output.write('%-4s%10.1f%8.2f%10.1f%10.1f%12.2f%12.2f\n' %
+                         ('%d.' % (index + 1),
+                          size_bytes / 1048576.0,
+                          float(raster_bytes) / max(size_bytes, 1),
+                          raster_mb / max(write_time, 1e-6),
+                          raster_mb / max(read_time, 1e-6),
+                          mean * 1000.0, median * 1000.0))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output.write('Window reads are %d x %d pixels, %d per tile. ' %
+                 (window_size, window_size, window_count) +
+                 'Format options:\n')
+    for (index, format_options) in enumerate(candidate_list):
+        output.write('%-4s%s\n' % ('%d.' % (index + 1), format_options))
+
+    return all_written
+
+
+def benchmark_coverage(repeat, output=sys.stdout):
+    """Time DatasetRecord.get_touched_tiles with each coverage engine for
+    each of COVERAGE_CASES.
+
+    Each case is run 'repeat' times with each engine and the fastest
+    time is reported. Returns True if the engines found the same tiles
+    in every case.
+    """
+
+    all_identical = True
+    output.write('Coverage latency (seconds)\n')
+    output.write('%-26s%8s' % ('case', 'tiles') +
+                 ''.join(['%12s' % engine for engine in COVERAGE_ENGINES]) +
+                 '  identical\n')
+    for (name, width, height, rotation, tile_size) in COVERAGE_CASES:
+        dataset_bbox = make_scene_bbox(COVERAGE_CENTRE, width, height,
+                                       rotation)
+        latency_list = []
+        coverage_list = []
+        for coverage_engine in COVERAGE_ENGINES:
+            time_list = []
+            for dummy_count in range(repeat):
+                stopwatch = Stopwatch()
+                stopwatch.start()
+                coverage = DatasetRecord.get_touched_tiles(
+                    dataset_bbox, (0.0, 0.0), (tile_size, tile_size),
+                    coverage_engine=coverage_engine)
+                stopwatch.stop()
+                time_list.append(stopwatch.read()[0])
+            latency_list.append(min(time_list))
+            coverage_list.append(coverage)
+
+        identical = all(coverage == coverage_list[0]
+                        for coverage in coverage_list)
+        all_identical = all_identical and identical
+        output.write('%-26s%8d' % (name, len(coverage_list[0])) +
+                     ''.join(['%12.4f' % latency
+                              for latency in latency_list]) +
+                     '  %s\n' % ('yes' if identical else 'NO'))
+
+    output.write('Tiles identical for all engines: %s\n' %
+                 ('yes' if all_identical else 'NO'))
+
+    return all_identical
+
+#
+# Command line interface
+#
+
+
+def parse_args():
+    """Parse the command line arguments for the benchmarks.
+
+    Returns an argparse namespace object.
+    """
+
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument('-C', '--config', dest='config_file',
+                               default=None,
+                               help='DataCube configuration file')
+    common_parser.add_argument('-d', '--debug', dest='debug',
+                               default=False, action='store_const',
+                               const=True, help='Debug mode flag')
+
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks for the tiling stage of the ingest.')
+    subparsers = arg_parser.add_subparsers(dest='benchmark')
+
+    warp_parser = subparsers.add_parser(
+        'warp', parents=[common_parser],
+        help='Per-tile latency of each warp engine.')
+    warp_parser.add_argument('--dataset', dest='dataset_path',
+                             required=True,
+                             help='Landsat dataset directory to tile')
+    warp_parser.add_argument('--tile-type', dest='tile_type_id',
+                             type=int, default=1,
+                             help='Tile type to reproject into (default 1)')
+    warp_parser.add_argument('--repeat', dest='repeat',
+                             type=int, default=1,
+                             help='Number of times to warp each tile')
+
+    coverage_parser = subparsers.add_parser(
+        'coverage', parents=[common_parser],
+        help='Dataset coverage time of each coverage engine.')
+    coverage_parser.add_argument('--repeat', dest='repeat',
+                                 type=int, default=3,
+                                 help='Number of times to run each case')
+
+    format_parser = subparsers.add_parser(
+        'format', parents=[common_parser],
+        help='Size and read/write speed of candidate tile formats.')
+    format_parser.add_argument('--tile-type', dest='tile_type_id',
+                               type=int, default=1,
+                               help='Tile type to sample (default 1)')
+    format_parser.add_argument('--sample', dest='sample_size',
+                               type=int, default=10,
+                               help='Number of tiles to sample (default 10)')
+    format_parser.add_argument('--options', dest='candidate_list',
+                               action='append', default=None,
+                               help='Candidate format options (may be' +
+                               ' repeated; default: a set of tiled and' +
+                               ' compressed layouts)')
+    format_parser.add_argument('--windows', dest='window_count',
+                               type=int, default=20,
+                               help='Windowed reads per tile (default 20)')
+    format_parser.add_argument('--window-size', dest='window_size',
+                               type=int, default=256,
+                               help='Window size in pixels (default 256)')
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Run the benchmark selected on the command line."""
+
+    args = parse_args()
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.benchmark == 'coverage':
+        success = benchmark_coverage(args.repeat)
+        return 0 if success else 1
+
+    datacube = IngesterDataCube(args)
+    collection = Collection(datacube)
+    success = False
+    try:
+        if args.benchmark == 'warp':
+            dataset = LandsatDataset(args.dataset_path)
+            collection.check_metadata(dataset)
+            success = benchmark_warp(collection, dataset,
+                                     args.tile_type_id, args.repeat)
+        elif args.benchmark == 'format':
+            success = benchmark_format(
+                collection, args.tile_type_id, args.sample_size,
+                args.candidate_list or FORMAT_CANDIDATES,
+                args.window_count, args.window_size)
+    finally:
+        collection.cleanup()
+
+    return 0 if success else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""
+    vrt_writer.py - write GDAL VRT files directly.
+
+    This replaces running gdalbuildvrt as a subprocess and then reopening
+    the result to add metadata. The VRT XML, including the sources, nodata
+    values and dataset and band metadata, is built from the source headers
+    and written in one go. Paths starting with /vsimem/ are written to
+    GDAL's in-memory file system.
+"""
+
+import os
+import logging
+from xml.sax.saxutils import escape, quoteattr
+from osgeo import gdal
+from agdc.cube_util import DatasetError
+
+#
+# Set up logger
+#
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+#
+# Constants
+#
+
+VSIMEM_PREFIX = '/vsimem/'
+
+#
+# Functions
+#
+
+
+def write_vrt(vrt_path, source_list, separate=False,
+              nodata_list=None, metadata=None, band_metadata_list=None,
+              allow_projection_difference=False):
+    """Write a VRT mosaicing or stacking the datasets in source_list.
+
+    This is equivalent to 'gdalbuildvrt [-separate] vrt_path sources...'
+    using the default (average) resolution, followed by setting metadata
+    on the result.
+
+    vrt_path: the VRT to write (overwritten if it exists). This may be a
+        /vsimem/ path.
+    source_list: GDAL dataset names (files or subdatasets).
+    separate: if True each source contributes its first band as a
+        separate VRT band, otherwise every source contributes to each band.
+    nodata_list: nodata value for each VRT band, used as both the source
+        and VRT nodata values (like -srcnodata and -vrtnodata). An entry
+        of None (or no nodata_list) uses the source band's own nodata.
+    metadata: dictionary of dataset metadata.
+    band_metadata_list: list of dictionaries of metadata for each band.
+    allow_projection_difference: if False the sources must all have the
+        same projection.
+    """
+
+    source_info_list = [_get_source_info(source) for source in source_list]
+    if not source_info_list:
+        raise DatasetError('Unable to write VRT %s: no sources' % vrt_path)
+
+    projection = source_info_list[0]['projection']
+    if not allow_projection_difference:
+        for source_info in source_info_list:
+            if source_info['projection'] != projection:
+                raise DatasetError('Unable to write VRT %s: ' % vrt_path +
+                                   '%s has a different projection from %s'
+                                   % (source_info['name'],
+                                      source_info_list[0]['name']))
+
+    # Output grid: union of the source extents at the average resolution
+    x_res = (sum([s['transform'][1] for s in source_info_list]) /
+             len(source_info_list))
+    y_res = (sum([-s['transform'][5] for s in source_info_list]) /
+             len(source_info_list))
+    x_min = min([s['transform'][0] for s in source_info_list])
+    y_max = max([s['transform'][3] for s in source_info_list])
+    x_max = max([s['transform'][0] + s['x_size'] * s['transform'][1]
+                 for s in source_info_list])
+    y_min = min([s['transform'][3] + s['y_size'] * s['transform'][5]
+                 for s in source_info_list])
+    x_size = int(0.5 + (x_max - x_min) / x_res)
+    y_size = int(0.5 + (y_max - y_min) / y_res)
+
+    if separate:
+        band_count = len(source_info_list)
+    else:
+        band_count = len(source_info_list[0]['band_list'])
+
+    lines = ['<VRTDataset rasterXSize="%d" rasterYSize="%d">'
+             % (x_size, y_size)]
+    if projection:
+        lines.append('  <SRS>%s</SRS>' % escape(projection))
+    lines.append('  <GeoTransform>%s</GeoTransform>' %
+                 ', '.join(['%.16e' % value for value in
+                            (x_min, x_res, 0.0, y_max, 0.0, -y_res)]))
+    lines.extend(_metadata_lines(metadata, '  '))
+
+    for band_index in range(band_count):
+        if separate:
+            band_sources = [(source_info_list[band_index], 0)]
+        else:
+            band_sources = [(source_info, band_index)
+                            for source_info in source_info_list]
+
+        first_band = band_sources[0][0]['band_list'][band_sources[0][1]]
+        nodata_value = nodata_list[band_index] if nodata_list else None
+        if nodata_value is None:
+            nodata_value = first_band['nodata_value']
+
+        lines.append('  <VRTRasterBand dataType="%s" band="%d">'
+                     % (first_band['data_type'], band_index + 1))
+        if band_metadata_list:
+            lines.extend(_metadata_lines(band_metadata_list[band_index],
+                                         '    '))
+        if nodata_value is not None:
+            lines.append('    <NoDataValue>%s</NoDataValue>'
+                         % _format_value(nodata_value))
+
+        for source_info, source_band_index in band_sources:
+            lines.extend(_source_lines(source_info, source_band_index,
+                                       nodata_value,
+                                       (x_min, y_max, x_res, y_res)))
+        lines.append('  </VRTRasterBand>')
+
+    lines.append('</VRTDataset>')
+    _write_file(vrt_path, '\n'.join(lines) + '\n')
+
+
+def _get_source_info(source):
+    """Return a dictionary describing the source dataset from its header."""
+
+    dataset = gdal.Open(source)
+    if dataset is None:
+        raise DatasetError('Unable to open VRT source %s' % source)
+
+    transform = dataset.GetGeoTransform()
+    if transform[2] or transform[4]:
+        raise DatasetError('Unable to add rotated VRT source %s' % source)
+
+    band_list = []
+    for band_number in range(1, dataset.RasterCount + 1):
+        band = dataset.GetRasterBand(band_number)
+        block_x_size, block_y_size = band.GetBlockSize()
+        band_list.append({'data_type': gdal.GetDataTypeName(band.DataType),
+                          'block_x_size': block_x_size,
+                          'block_y_size': block_y_size,
+                          'nodata_value': band.GetNoDataValue()})
+
+    source_info = {'name': source,
+                   'projection': dataset.GetProjection(),
+                   'transform': transform,
+                   'x_size': dataset.RasterXSize,
+                   'y_size': dataset.RasterYSize,
+                   'band_list': band_list}
+    del dataset
+    return source_info
+
+
+def _source_lines(source_info, source_band_index, nodata_value, grid):
+    """Return the XML lines for one band of a source placed on the grid
+    (x_min, y_max, x_res, y_res)."""
+
+    x_min, y_max, x_res, y_res = grid
+    transform = source_info['transform']
+    band_info = source_info['band_list'][source_band_index]
+    source_type = 'SimpleSource' if nodata_value is None else 'ComplexSource'
+
+    dst_x_off = (transform[0] - x_min) / x_res
+    dst_y_off = (y_max - transform[3]) / y_res
+    dst_x_size = source_info['x_size'] * transform[1] / x_res
+    dst_y_size = source_info['y_size'] * -transform[5] / y_res
+
+    lines = ['    <%s>' % source_type,
+             '      <SourceFilename relativeToVRT="0">%s</SourceFilename>'
+             % escape(source_info['name']),
+             '      <SourceBand>%d</SourceBand>' % (source_band_index + 1),
+             '      <SourceProperties RasterXSize="%d" RasterYSize="%d" '
+             'DataType="%s" BlockXSize="%d" BlockYSize="%d" />'
+             % (source_info['x_size'], source_info['y_size'],
+                band_info['data_type'], band_info['block_x_size'],
+                band_info['block_y_size']),
+             '      <SrcRect xOff="0" yOff="0" xSize="%d" ySize="%d" />'
+             % (source_info['x_size'], source_info['y_size']),
+             '      <DstRect xOff="%.15g" yOff="%.15g" xSize="%.15g" '
+             'ySize="%.15g" />'
+             % (dst_x_off, dst_y_off, dst_x_size, dst_y_size)]
+    if nodata_value is not None:
+        lines.append('      <NODATA>%s</NODATA>' % _format_value(nodata_value))
+    lines.append('    </%s>' % source_type)
+    return lines
+
+
+def _metadata_lines(metadata, indent):
+    """Return the XML lines for a metadata dictionary."""
+
+    if not metadata:
+        return []
+
+    lines = [indent + '<Metadata>']
+    for key in sorted(metadata.keys()):
+        lines.append('%s  <MDI key=%s>%s</MDI>'
+                     % (indent, quoteattr(str(key)),
+                        escape(str(metadata[key]))))
+    lines.append(indent + '</Metadata>')
+    return lines
+
+
+def _format_value(value):
+    """Format a nodata value as GDAL does (integers without a decimal
+    point)."""
+
+    if float(value).is_integer():
+        return '%d' % value
+    return '%.18g' % value
+
+
+def _write_file(vrt_path, vrt_xml):
+    """Write the VRT XML to a file or a /vsimem/ path."""
+
+    LOGGER.debug('Writing VRT %s', vrt_path)
+
+    if vrt_path.startswith(VSIMEM_PREFIX):
+        gdal.FileFromMemBuffer(vrt_path, vrt_xml)
+        return
+
+    # Write then rename, so a partly-written VRT is never seen by readers
+    temp_vrt_path = '%s.%d.tmp' % (vrt_path, os.getpid())
+    try:
+        with open(temp_vrt_path, 'w') as vrt_file:
+            vrt_file.write(vrt_xml)
+        os.rename(temp_vrt_path, vrt_path)
+    except (IOError, OSError), error:
+        if os.path.exists(temp_vrt_path):
+            os.remove(temp_vrt_path)
+        raise DatasetError('Unable to write VRT %s: %s' % (vrt_path, error))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+
+"""Tests for the crs_cache.py module."""
+
+import unittest
+
+from agdc.abstract_ingester import crs_cache
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestLRUCache(unittest.TestCase):
+    """Unit tests for the LRUCache class."""
+
+    MODULE = 'crs_cache'
+    SUITE = 'TestLRUCache'
+
+    def setUp(self):
+        self.created = []
+        self.cache = crs_cache.LRUCache(2)
+
+    def create(self, key):
+        """Record and return a value for key, or None for key 'bad'."""
+
+        self.created.append(key)
+        return None if key == 'bad' else key.upper()
+
+    def test_hit(self):
+        """A cached value is returned without creating it again."""
+
+        self.assertEqual(self.cache.get('a', self.create), 'A')
+        self.assertEqual(self.cache.get('a', self.create), 'A')
+        self.assertEqual(self.created, ['a'])
+
+    def test_eviction(self):
+        """The least recently used entry is discarded when full."""
+
+        self.cache.get('a', self.create)
+        self.cache.get('b', self.create)
+        self.cache.get('a', self.create)
+        self.cache.get('c', self.create)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get('a', self.create)
+        self.cache.get('b', self.create)
+        self.assertEqual(self.created, ['a', 'b', 'c', 'b'])
+
+    def test_none_not_cached(self):
+        """A value of None is returned but not kept."""
+
+        self.assertIsNone(self.cache.get('bad', self.create))
+        self.assertIsNone(self.cache.get('bad', self.create))
+        self.assertEqual(self.created, ['bad', 'bad'])
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestCrsCache(unittest.TestCase):
+    """Unit tests for the cached spatial references and transformations."""
+
+    MODULE = 'crs_cache'
+    SUITE = 'TestCrsCache'
+
+    def setUp(self):
+        crs_cache.clear_caches()
+
+    def test_transformation_shared(self):
+        """The same transformation is returned for the same projections."""
+
+        transformation = crs_cache.get_transformation('EPSG:32755',
+                                                      'EPSG:4326')
+        self.assertIs(crs_cache.get_transformation('EPSG:32755',
+                                                   'EPSG:4326'),
+                      transformation)
+        self.assertIsNot(crs_cache.get_transformation('EPSG:4326',
+                                                      'EPSG:32755'),
+                         transformation)
+
+    def test_transformation_points(self):
+        """The cached transformations transform a point and back."""
+
+        forward = crs_cache.get_transformation('EPSG:32755', 'EPSG:4326')
+        inverse = crs_cache.get_transformation('EPSG:4326', 'EPSG:32755')
+        point = forward.TransformPoint(500000.0, 6000000.0, 0.0)
+        (x_coord, y_coord, dummy_z) = inverse.TransformPoint(*point)
+        self.assertAlmostEqual(x_coord, 500000.0, places=3)
+        self.assertAlmostEqual(y_coord, 6000000.0, places=3)
+
+    def test_unknown_projection(self):
+        """An unknown projection gives None."""
+
+        self.assertIsNone(crs_cache.get_spatial_ref('not a projection'))
+        self.assertIsNone(crs_cache.get_transformation('not a projection',
+                                                       'EPSG:4326'))
+
+    def tearDown(self):
+        crs_cache.clear_caches()
+
+#
+# Test suite
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestLRUCache, TestCrsCache]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
@@ -35,6 +35,7 @@ import time
 import os
 import random
 import shutil
+import subprocess
 
 import dbutil
 import agdc.cube_util as cube_util
@@ -187,6 +188,81 @@ class TestCreateDirectory(unittest.TestCase):
                           )
 
 
+class TestGetDirectorySize(unittest.TestCase):
+    """Unit tests for the get_directory_size_kb utility function."""
+
+    MODULE = 'cube_util'
+    SUITE = 'TestGetDirectorySize'
+
+    OUTPUT_DIR = dbutil.output_directory(MODULE, SUITE)
+
+    def setUp(self):
+        self.top_dir_path = os.path.join(self.OUTPUT_DIR, 'dataset')
+        shutil.rmtree(self.top_dir_path, ignore_errors=True)
+        cube_util.create_directory(os.path.join(self.top_dir_path, 'scene01'))
+        self.write_file(os.path.join('scene01', 'band1.tif'), 10000)
+        self.write_file('metadata.xml', 100)
+
+    def write_file(self, name, size):
+        """Write a file of the given size under the top directory."""
+
+        f = open(os.path.join(self.top_dir_path, name), 'w')
+        f.write('x' * size)
+        f.close()
+
+    def du_size_kb(self):
+        """Return the size from the du command."""
+
+        output = subprocess.check_output(['du', '-sk', self.top_dir_path])
+        return int(output.split()[0])
+
+    def test_matches_du(self):
+        """Check the size is the same as du gives."""
+
+        self.assertEqual(cube_util.get_directory_size_kb(self.top_dir_path),
+                         self.du_size_kb())
+
+    def test_recorded_size(self):
+        """Check a recorded size is used once, then the tree is walked."""
+
+        cube_util.set_directory_size_kb(self.top_dir_path, 12345)
+        self.assertEqual(cube_util.get_directory_size_kb(self.top_dir_path),
+                         12345)
+        self.assertEqual(cube_util.get_directory_size_kb(self.top_dir_path),
+                         self.du_size_kb())
+
+    def test_plain_file(self):
+        """Check a plain file gives its size rounded up to a kB."""
+
+        self.assertEqual(cube_util.get_directory_size_kb(
+            os.path.join(self.top_dir_path, 'scene01', 'band1.tif')), 10)
+
+    def test_scan_rewritten_file(self):
+        """Check rewriting a file in place changes the latest mtime."""
+
+        band_path = os.path.join(self.top_dir_path, 'scene01', 'band1.tif')
+        old_mtime = int(os.stat(band_path).st_mtime) - 100
+        for name in ('scene01/band1.tif', 'metadata.xml'):
+            os.utime(os.path.join(self.top_dir_path, name),
+                     (old_mtime, old_mtime))
+        (mtime, size, size_kb) = \
+            cube_util.scan_directory_tree(self.top_dir_path)
+        self.assertEqual((mtime, size), (old_mtime, 10100))
+        self.assertEqual(size_kb, self.du_size_kb())
+
+        self.write_file(os.path.join('scene01', 'band1.tif'), 10000)
+        os.utime(band_path, (old_mtime + 10, old_mtime + 10))
+        self.assertEqual(cube_util.scan_directory_tree(self.top_dir_path)[:2],
+                         (old_mtime + 10, 10100))
+
+    def test_missing_dir(self):
+        """Check a missing directory raises a DatasetError."""
+
+        self.assertRaises(cube_util.DatasetError,
+                          cube_util.get_directory_size_kb,
+                          os.path.join(self.top_dir_path, 'missing'))
+
+
 class TestSynchronize(unittest.TestCase):
     """Unit tests for the synchronize utility function."""
 
@@ -305,6 +381,7 @@ def the_suite():
     test_classes = [TestParseDate,
                     TestGetDatacubeRoot,
                     TestCreateDirectory,
+                    TestGetDirectorySize,
                     TestSynchronize,
                     TestStopwatch
                     ]
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+"""
+    test_ingest_journal.py - tests for the IngestJournal class
+"""
+# pylint: disable=too-many-public-methods
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from agdc import cube_util
+from agdc.abstract_ingester import DATASET_COMPLETE, DATASET_SKIPPED
+from agdc.abstract_ingester import DATASET_FAILED
+from agdc.abstract_ingester import ingest_journal
+from agdc.abstract_ingester.ingest_journal import IngestJournal
+
+
+class TestIngestJournal(unittest.TestCase):
+    """Unit tests for the IngestJournal class."""
+
+    MODULE = 'ingest_journal'
+    SUITE = 'TestIngestJournal'
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.temp_dir, 'journal.db')
+        self.dataset_path = self.make_dataset('dataset1', 'contents')
+        self.journal = IngestJournal(self.journal_path,
+                                     [DATASET_COMPLETE, DATASET_SKIPPED])
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.temp_dir)
+
+    def make_dataset(self, name, contents):
+        """Create a dummy dataset file and return its path."""
+        dataset_path = os.path.join(self.temp_dir, name)
+        with open(dataset_path, 'w') as dataset_file:
+            dataset_file.write(contents)
+        return dataset_path
+
+    def make_dataset_dir(self, name):
+        """Create a dummy dataset directory, with a band file in its
+        scene01 subdirectory, and return (dataset_dir, band_path). The
+        modification times are set in the past."""
+        dataset_dir = os.path.join(self.temp_dir, name)
+        scene_dir = os.path.join(dataset_dir, 'scene01')
+        os.makedirs(scene_dir)
+        band_path = os.path.join(scene_dir, 'band1.tif')
+        with open(band_path, 'w') as band_file:
+            band_file.write('contents' * 1024)
+        for path in (band_path, scene_dir, dataset_dir):
+            os.utime(path, (1000000000, 1000000000))
+        return (dataset_dir, band_path)
+
+    @staticmethod
+    def replace_file(path, contents):
+        """Replace the file at path, by writing and renaming a new file."""
+        with open(path + '.new', 'w') as new_file:
+            new_file.write(contents)
+        os.rename(path + '.new', path)
+
+    def fail_walk(self, path):
+        """Stand in for scan_directory_tree, failing the test."""
+        self.fail('%s was walked.' % path)
+
+    def assert_done_without_walk(self, dataset_path):
+        """Assert that dataset_path is done, without walking it."""
+        scan_directory_tree = ingest_journal.scan_directory_tree
+        ingest_journal.scan_directory_tree = self.fail_walk
+        try:
+            self.assertTrue(self.journal.is_done(dataset_path))
+        finally:
+            ingest_journal.scan_directory_tree = scan_directory_tree
+
+    def test_not_journaled(self):
+        "Test that an unknown dataset is not done."
+        self.assertFalse(self.journal.is_done(self.dataset_path))
+
+    def test_outcomes(self):
+        "Test that only done outcomes are done."
+        self.journal.record(self.dataset_path, DATASET_FAILED)
+        self.assertFalse(self.journal.is_done(self.dataset_path))
+        self.journal.record(self.dataset_path, DATASET_SKIPPED)
+        self.assertTrue(self.journal.is_done(self.dataset_path))
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.assertTrue(self.journal.is_done(self.dataset_path))
+
+    def test_changed_dataset(self):
+        "Test that a dataset which has changed size is not done."
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.make_dataset('dataset1', 'new contents')
+        self.assertFalse(self.journal.is_done(self.dataset_path))
+
+    def test_replaced_file(self):
+        "Test that a directory dataset with a file replaced is not done."
+        (dataset_dir, band_path) = self.make_dataset_dir('dataset3')
+        self.journal.record(dataset_dir, DATASET_COMPLETE)
+        self.assertTrue(self.journal.is_done(dataset_dir))
+        self.replace_file(band_path, 'CONTENTS' * 1024)
+        self.assertFalse(self.journal.is_done(dataset_dir))
+
+    def test_linked_dataset(self):
+        "Test that a symbolic link to a dataset directory is scanned."
+        (dataset_dir, band_path) = self.make_dataset_dir('dataset4')
+        link_path = os.path.join(self.temp_dir, 'linked')
+        os.symlink(dataset_dir, link_path)
+        self.assertEqual(cube_util.scan_directory_tree(link_path),
+                         cube_util.scan_directory_tree(dataset_dir))
+        self.journal.record(link_path, DATASET_COMPLETE)
+        self.assertTrue(self.journal.is_done(link_path))
+        self.replace_file(band_path, 'CONTENTS' * 1024)
+        self.assertFalse(self.journal.is_done(link_path))
+
+    def test_done_without_walk(self):
+        "Test that an unchanged done dataset is not walked."
+        (dataset_dir, dummy_band_path) = self.make_dataset_dir('dataset5')
+        self.journal.record(dataset_dir, DATASET_COMPLETE)
+        self.assert_done_without_walk(dataset_dir)
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.assert_done_without_walk(self.dataset_path)
+
+    def test_touched_directory(self):
+        "Test that a dataset whose files are unchanged stays done."
+        (dataset_dir, band_path) = self.make_dataset_dir('dataset6')
+        self.journal.record(dataset_dir, DATASET_COMPLETE)
+        os.utime(os.path.dirname(band_path), (1000000010, 1000000010))
+        self.assertTrue(self.journal.is_done(dataset_dir))
+        self.assert_done_without_walk(dataset_dir)
+
+    def test_size_handed_on(self):
+        "Test that filter_done passes on the journaled dataset size."
+        self.journal.record(self.dataset_path, DATASET_FAILED)
+        cube_util.take_directory_size_kb(self.dataset_path)
+        self.assertEqual(list(self.journal.filter_done([self.dataset_path])),
+                         [self.dataset_path])
+        self.assertEqual(cube_util.take_directory_size_kb(self.dataset_path),
+                         1)
+
+    def test_old_journal(self):
+        "Test that a journal without the added columns is upgraded."
+        self.journal.close()
+        os.remove(self.journal_path)
+        connection = sqlite3.connect(self.journal_path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE ingest_journal (\n" +
+                "    dataset_path TEXT PRIMARY KEY,\n" +
+                "    mtime REAL NOT NULL,\n" +
+                "    size INTEGER NOT NULL,\n" +
+                "    outcome TEXT NOT NULL,\n" +
+                "    journal_time TEXT NOT NULL\n" +
+                ");")
+        connection.close()
+        self.journal = IngestJournal(self.journal_path, [DATASET_COMPLETE])
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.assertTrue(self.journal.is_done(self.dataset_path))
+
+    def test_reopen(self):
+        "Test that the outcomes persist when the journal is reopened."
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.journal.close()
+        self.journal = IngestJournal(self.journal_path, [DATASET_COMPLETE])
+        self.assertTrue(self.journal.is_done(self.dataset_path))
+
+    def test_filter_done(self):
+        "Test filtering a dataset list."
+        other_path = self.make_dataset('dataset2', 'contents')
+        missing_path = os.path.join(self.temp_dir, 'missing')
+        self.journal.record(self.dataset_path, DATASET_COMPLETE)
+        self.journal.record(missing_path, DATASET_COMPLETE)
+        self.assertEqual(list(self.journal.filter_done([self.dataset_path,
+                                                        other_path,
+                                                        missing_path])),
+                         [other_path, missing_path])
+
+
+def the_suite():
+    "Runs the tests"""
+    test_classes = [TestIngestJournal]
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+    suite = unittest.TestSuite(suite_list)
+    return suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+
+"""Tests for the metadata parsing functions in modis_dataset.py."""
+
+import unittest
+
+from agdc.modis_ingester import modis_dataset
+
+#
+# Test data
+#
+
+CORE_METADATA = '''GROUP                  = INVENTORYMETADATA
+  OBJECT                 = RANGEDATETIME
+    OBJECT                 = RANGEBEGINNINGDATE
+      NUM_VAL              = 1
+      VALUE                = "2011-01-31"
+    END_OBJECT             = RANGEBEGINNINGDATE
+    OBJECT                 = RANGEBEGINNINGTIME
+      NUM_VAL              = 1
+      VALUE                = "00:30:00.000000"
+    END_OBJECT             = RANGEBEGINNINGTIME
+  END_OBJECT             = RANGEDATETIME
+  OBJECT                 = ORBITNUMBER
+    CLASS                  = "1"
+    NUM_VAL              = 1
+    VALUE                = 59434
+  END_OBJECT             = ORBITNUMBER
+  OBJECT                 = PRODUCTIONDATETIME
+    NUM_VAL              = 1
+    VALUE                = "2011-02-02T06:03:41.000Z"
+  END_OBJECT             = PRODUCTIONDATETIME
+END_GROUP              = INVENTORYMETADATA
+'''
+
+QA_SUMMARY = 'Percent\tClear:\t80\n\tCloudy:\t12.5\n\tMixed:\t7.5\n'
+
+EXPECTED_ECS = {
+    'RANGEBEGINNINGDATE': '2011-01-31',
+    'RANGEBEGINNINGTIME': '00:30:00.000000',
+    'ORBITNUMBER': '59434',
+    'PRODUCTIONDATETIME': '2011-02-02T06:03:41.000Z'
+    }
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestModisMetadata(unittest.TestCase):
+    """Unit tests for parse_ecs_metadata and parse_cloud_cover."""
+
+    MODULE = 'modis_dataset'
+    SUITE = 'TestModisMetadata'
+
+    METADATA = {
+        'NC_GLOBAL#crs': 'EPSG:4326',
+        'InputFileGlobalAttributes#CoreMetadata.0': CORE_METADATA,
+        'InputFileGlobalAttributes#QAPercentSummary': QA_SUMMARY
+        }
+
+    def test_ecs_metadata(self):
+        """The ECS object values are found, without quotes."""
+
+        self.assertEqual(modis_dataset.parse_ecs_metadata(self.METADATA),
+                         EXPECTED_ECS)
+
+    def test_escaped_ecs_metadata(self):
+        """Escaped newlines and quotes (as shown by ncdump) are handled."""
+
+        escaped = CORE_METADATA.replace('\n', '\\n').replace('"', '\\"')
+        metadata = {'InputFileGlobalAttributes#CoreMetadata.0': escaped}
+        self.assertEqual(modis_dataset.parse_ecs_metadata(metadata),
+                         EXPECTED_ECS)
+
+    def test_cloud_cover(self):
+        """The cloudy percentage is found in the QA summary."""
+
+        self.assertEqual(modis_dataset.parse_cloud_cover(self.METADATA),
+                         12.5)
+        self.assertIsNone(modis_dataset.parse_cloud_cover(
+            {'NC_GLOBAL#crs': 'EPSG:4326'}))
+
+#
+# Test suite
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestModisMetadata]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
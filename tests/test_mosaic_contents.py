@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""Tests for the mosaic_contents.py module."""
+
+import unittest
+import numpy
+
+from agdc.abstract_ingester.mosaic_contents import merge_pqa_blocks
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestMergePqaBlocks(unittest.TestCase):
+    """Unit tests for the merge_pqa_blocks function."""
+
+    MODULE = 'mosaic_contents'
+    SUITE = 'TestMergePqaBlocks'
+
+    ALL_PASS = 0x3fff  # contiguous, all tests passed
+
+    def make_block(self, value_list):
+        """Make a one row PQA block from a list of values."""
+
+        return numpy.array([value_list], dtype='uint16')
+
+    def test_two_way(self):
+        """Contiguous pixels are and-ed, others take the contiguous value."""
+
+        block1 = self.make_block([self.ALL_PASS, 0x3fbf, 0x0000])
+        block2 = self.make_block([0x3f7f, 0x0000, 0x0000])
+        merged = merge_pqa_blocks([block1, block2], 'uint16')
+
+        self.assertEqual(merged.tolist(), [[0x3f7f, 0x3fbf, 0x0000]])
+
+    def test_three_way(self):
+        """Test a merge of three overlapping blocks."""
+
+        block1 = self.make_block([self.ALL_PASS, 0x0000, 0x0002])
+        block2 = self.make_block([0x3f7f, 0x0000, 0x0001])
+        block3 = self.make_block([0x3fbf, 0x3ffe, 0x0000])
+        merged = merge_pqa_blocks([block1, block2, block3], 'uint16')
+
+        self.assertEqual(merged.tolist(), [[0x3f3f, 0x3ffe, 0x0003]])
+
+    def test_single_block(self):
+        """A single block should be returned unchanged."""
+
+        block = self.make_block([self.ALL_PASS, 0x0000, 0x00ff, 0x0100])
+        merged = merge_pqa_blocks([block], 'uint16')
+
+        self.assertEqual(merged.tolist(), block.tolist())
+
+#
+# Test suite
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestMergePqaBlocks]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
@@ -40,7 +40,10 @@ import dbutil
 #import landsat_bandstack
 from abstract_ingester import AbstractIngester
 from abstract_ingester import IngesterDataCube
+from cube_util import DatasetError
 from landsat_ingester import LandsatDataset
+from abstract_ingester.tile_contents import parse_format_options
+from abstract_ingester.tile_contents import DEFAULT_OVERVIEW_RESAMPLING
 from test_landsat_tiler import TestLandsatTiler
 import ingest_test_data as TestIngest
 
@@ -316,9 +319,47 @@ class TestTileContents(unittest.TestCase):
                     LOGGER.info('-' * 80)
                 self.collection.commit_transaction()
 
+class TestParseFormatOptions(unittest.TestCase):
+    """Unit tests for the parse_format_options function."""
+
+    MODULE = 'tile_contents'
+    SUITE = 'ParseFormatOptions'
+
+    def test_creation_options_only(self):
+        """Plain GDAL creation options are passed through unchanged."""
+
+        result = parse_format_options('COMPRESS=LZW,BIGTIFF=YES')
+        self.assertEqual(result, (['COMPRESS=LZW', 'BIGTIFF=YES'],
+                                  [], DEFAULT_OVERVIEW_RESAMPLING))
+
+    def test_overview_options(self):
+        """Overview options are separated from the creation options."""
+
+        result = parse_format_options(
+            'TILED=YES,COMPRESS=DEFLATE,PREDICTOR=2,OVERVIEWS=2:4:8,' +
+            'overview_resampling=average')
+        self.assertEqual(result, (['TILED=YES', 'COMPRESS=DEFLATE',
+                                   'PREDICTOR=2'],
+                                  [2, 4, 8], 'AVERAGE'))
+
+    def test_empty_options(self):
+        """Empty (or missing) format options give no options."""
+
+        self.assertEqual(parse_format_options(''),
+                         ([], [], DEFAULT_OVERVIEW_RESAMPLING))
+        self.assertEqual(parse_format_options(None),
+                         ([], [], DEFAULT_OVERVIEW_RESAMPLING))
+
+    def test_bad_overviews(self):
+        """Overview levels must be integers."""
+
+        self.assertRaises(DatasetError, parse_format_options,
+                          'COMPRESS=LZW,OVERVIEWS=2:four')
+
+
 def the_suite():
     "Runs the tests"""
-    test_classes = [TestTileContents]
+    test_classes = [TestTileContents, TestParseFormatOptions]
     suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
                      test_classes)
     suite = unittest.TestSuite(suite_list)
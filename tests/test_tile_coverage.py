@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""Tests for the tile_coverage.py module."""
+
+import math
+import random
+import unittest
+
+from agdc.abstract_ingester.dataset_record import DatasetRecord
+from agdc.abstract_ingester.dataset_record import COVERAGE_ENGINE_PYTHON
+from agdc.abstract_ingester import tile_coverage
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestTileCoverage(unittest.TestCase):
+    """Unit tests comparing tile_coverage with the DatasetRecord methods."""
+
+    MODULE = 'tile_coverage'
+    SUITE = 'TestTileCoverage'
+
+    SCENE_COUNT = 50
+    TILE_SIZE_LIST = [1.0, 0.25, 0.1, 0.025]
+
+    @staticmethod
+    def make_bbox(centre, width, height, angle):
+        """Return the corners of a rotated rectangle, clockwise from the
+        upper left."""
+
+        (x_centre, y_centre) = centre
+        (cos_angle, sin_angle) = (math.cos(angle), math.sin(angle))
+        corner_list = [(-width / 2, height / 2), (width / 2, height / 2),
+                       (width / 2, -height / 2), (-width / 2, -height / 2)]
+        return [(x_centre + x * cos_angle + y * sin_angle,
+                 y_centre - x * sin_angle + y * cos_angle)
+                for (x, y) in corner_list]
+
+    def check_bbox(self, bbox, cube_origin, cube_tile_size):
+        """Check that both engines give the same coverage for bbox."""
+
+        expected = DatasetRecord.get_touched_tiles(
+            bbox, cube_origin, cube_tile_size,
+            coverage_engine=COVERAGE_ENGINE_PYTHON)
+        result = tile_coverage.get_touched_tiles(bbox, cube_origin,
+                                                 cube_tile_size)
+        self.assertEqual(result, expected)
+
+    def test_random_scenes(self):
+        """Test rotated scenes on coarse and fine tile grids."""
+
+        scene_random = random.Random(1)
+        for tile_size in self.TILE_SIZE_LIST:
+            for dummy_count in range(self.SCENE_COUNT):
+                bbox = self.make_bbox((scene_random.uniform(110.0, 155.0),
+                                       scene_random.uniform(-45.0, -10.0)),
+                                      scene_random.uniform(0.5, 2.5),
+                                      scene_random.uniform(0.5, 2.5),
+                                      scene_random.uniform(-0.3, 0.3))
+                self.check_bbox(bbox, (0.0, 0.0), (tile_size, tile_size))
+
+    def test_aligned_scene(self):
+        """Test a scene whose edges lie on tile boundaries."""
+
+        bbox = [(110.0, -20.0), (112.0, -20.0),
+                (112.0, -22.0), (110.0, -22.0)]
+        self.check_bbox(bbox, (0.0, 0.0), (1.0, 1.0))
+
+    def test_projected_grid(self):
+        """Test a projected (metre) grid with a non-zero origin."""
+
+        bbox = self.make_bbox((512345.0, -3456789.0), 185000.0, 170000.0,
+                              0.2)
+        self.check_bbox(bbox, (-1000000.0, -5000000.0), (4000.0, 4000.0))
+
+    def test_result_type(self):
+        """Footprints should be tuples of python integers."""
+
+        bbox = self.make_bbox((133.3, -24.7), 2.0, 1.7, 0.2)
+        for (itile, jtile) in tile_coverage.get_touched_tiles(
+                bbox, (0.0, 0.0), (1.0, 1.0)):
+            self.assertTrue(isinstance(itile, (int, long)))
+            self.assertTrue(isinstance(jtile, (int, long)))
+
+#
+# Test suite
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestTileCoverage]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
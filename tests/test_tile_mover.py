@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+
+"""Tests for the tile_mover.py module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from agdc.abstract_ingester import tile_mover
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestTileMover(unittest.TestCase):
+    """Unit tests for the TileMover class."""
+
+    MODULE = 'tile_mover'
+    SUITE = 'TestTileMover'
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.temp_dir, 'staging')
+        self.dest_dir = os.path.join(self.temp_dir, 'store')
+        os.mkdir(self.source_dir)
+        os.mkdir(self.dest_dir)
+        self.mover = tile_mover.TileMover(workers=2)
+
+    def make_file(self, name, contents):
+        """Make a file in the staging directory, returning its path."""
+
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'wb') as output_file:
+            output_file.write(contents)
+        return path
+
+    def test_promote_file(self):
+        """Test moving a file synchronously."""
+
+        source_path = self.make_file('tile.tif', 'tile contents')
+        dest_path = os.path.join(self.dest_dir, 'tile.tif')
+        tile_mover.promote_file(source_path, dest_path)
+
+        self.assertFalse(os.path.exists(source_path))
+        with open(dest_path, 'rb') as dest_file:
+            self.assertEqual(dest_file.read(), 'tile contents')
+
+    def test_start_and_finish(self):
+        """Test moving files using the mover."""
+
+        promotion_list = []
+        for index in range(5):
+            source_path = self.make_file('tile%d.tif' % index, str(index))
+            dest_path = os.path.join(self.dest_dir, 'tile%d.tif' % index)
+            promotion_list.append(self.mover.start(source_path, dest_path))
+        for promotion in promotion_list:
+            promotion.finish()
+
+        self.assertEqual(os.listdir(self.source_dir), [])
+        self.assertEqual(sorted(os.listdir(self.dest_dir)),
+                         ['tile%d.tif' % index for index in range(5)])
+
+    def test_copy_and_finish(self):
+        """Test a background copy, forcing the copy path."""
+
+        source_path = self.make_file('tile.tif', 'x' * 100000)
+        dest_path = os.path.join(self.dest_dir, 'tile.tif')
+        promotion = tile_mover.Promotion(source_path, dest_path)
+        promotion.partial_path = os.path.join(self.dest_dir, '.tile.partial')
+        promotion.copy()
+        self.assertTrue(os.path.exists(source_path))
+        promotion.finish()
+
+        self.assertFalse(os.path.exists(source_path))
+        self.assertEqual(os.listdir(self.dest_dir), ['tile.tif'])
+        self.assertEqual(os.path.getsize(dest_path), 100000)
+
+    def test_cancel(self):
+        """A cancelled copy leaves the source and no partial file."""
+
+        source_path = self.make_file('tile.tif', 'tile contents')
+        dest_path = os.path.join(self.dest_dir, 'tile.tif')
+        promotion = tile_mover.Promotion(source_path, dest_path)
+        promotion.partial_path = os.path.join(self.dest_dir, '.tile.partial')
+        promotion.copy()
+        promotion.cancel()
+
+        self.assertTrue(os.path.exists(source_path))
+        self.assertEqual(os.listdir(self.dest_dir), [])
+
+    def tearDown(self):
+        self.mover.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+#
+# Test suite
+#
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestTileMover]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+#
+# Run unit tests if in __main__
+#
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(the_suite())